@@ -43,7 +43,7 @@ class Agente(Base):
     agente_restricoes = Column(Text, nullable=False)
     
     # Configurações LLM específicas do agente
-    modelo_llm = Column(String(100), nullable=True)
+    modelo_llm = Column(String(100), nullable=True, index=True)
     temperatura = Column(String(10), nullable=True)
     max_tokens = Column(String(10), nullable=True)
     top_p = Column(String(10), nullable=True)
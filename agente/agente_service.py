@@ -14,6 +14,7 @@ from agente.agente_schema import AgenteCriar, AgenteAtualizar
 from ferramenta.ferramenta_model import Ferramenta
 from ferramenta.ferramenta_service import FerramentaService
 from llm_providers.llm_integration_service import LLMIntegrationService
+from mensagem.mensagem_service import MensagemService
 
 
 class AgenteService:
@@ -260,9 +261,8 @@ Priorize SEMPRE o uso de tools para garantir respostas precisas e atualizadas.
                 })
             
             # Adicionar imagem se houver
-            if msg.tipo == "imagem" and msg.conteudo_imagem_base64:
-                mime_type = msg.conteudo_mime_type or "image/jpeg"
-                data_url = f"data:{mime_type};base64,{msg.conteudo_imagem_base64}"
+            data_url = MensagemService.obter_data_url_imagem(msg) if msg.tipo == "imagem" else None
+            if data_url:
                 conteudo.append({
                     "type": "image_url",
                     "image_url": {
@@ -364,9 +364,8 @@ Priorize SEMPRE o uso de tools para garantir respostas precisas e atualizadas.
             })
         
         # Adicionar imagem se houver
-        if mensagem.tipo == "imagem" and mensagem.conteudo_imagem_base64:
-            mime_type = mensagem.conteudo_mime_type or "image/jpeg"
-            data_url = f"data:{mime_type};base64,{mensagem.conteudo_imagem_base64}"
+        data_url = MensagemService.obter_data_url_imagem(mensagem) if mensagem.tipo == "imagem" else None
+        if data_url:
             conteudo_atual.append({
                 "type": "image_url",
                 "image_url": {
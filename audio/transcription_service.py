@@ -2,12 +2,95 @@
 Serviço de transcrição de áudio.
 Suporta Groq e OpenAI como provedores de transcrição.
 """
+from fastapi import Depends
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List, Tuple, Union
+import asyncio
+import functools
+import hashlib
+import json
+import random
+import shutil
+import threading
+import time
+import uuid
+import weakref
 import httpx
 import io
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from config.config_service import ConfiguracaoService
+from database import get_db
+from audio.vad_service import VADService
+
+
+@functools.lru_cache(maxsize=256)
+def _normalizar_filename_mime(filename: str, mime_type: str) -> Tuple[str, str]:
+    """
+    Remove parâmetros do mime_type e da extensão do arquivo.
+    Ex.: ("audio.ogg; codecs=opus", "audio/ogg; codecs=opus") -> ("audio.ogg", "audio/ogg")
+    """
+    mime_base = mime_type.split(";", 1)[0].strip()
+    if ";" in filename:
+        base, _, ext = filename.rpartition(".")
+        if base:
+            filename = f"{base}.{ext.split(';', 1)[0].strip()}"
+    return filename, mime_base
+
+
+def _sem_parametros_extras(config: "TranscriptionConfig") -> Dict[str, Any]:
+    """Provedores sem parâmetros adicionais no formulário."""
+    return {}
+
+
+def _extras_groq(config: "TranscriptionConfig") -> Dict[str, Any]:
+    """Para Groq, adicionar timestamp_granularities se verbose_json."""
+    if config.response_format == "verbose_json":
+        return {"timestamp_granularities[]": "segment"}
+    return {}
+
+
+@dataclass(frozen=True, slots=True)
+class ProviderSpec:
+    """Descreve um provedor de transcrição: endpoint, chave da API key e parâmetros extras."""
+    
+    endpoint: str
+    api_key_config: str
+    extra: Callable[["TranscriptionConfig"], Dict[str, Any]] = _sem_parametros_extras
+
+
+@dataclass(frozen=True, slots=True)
+class TranscriptionConfig:
+    """Configuração de transcrição, lida uma vez e repassada aos serviços."""
+    
+    habilitado: bool
+    provedor: str
+    provedor_fallback: str
+    modelo: str
+    idioma: str
+    temperatura: Optional[float]
+    prompt: str
+    response_format: str
+    responder_audio: bool
+    timeout: int
+    connect_timeout: int
+    write_timeout: int
+    vad_habilitado: bool
+    transcode_habilitado: bool
+    concorrencia: int
+    api_keys: Dict[str, Optional[str]] = field(default_factory=dict)
+    
+    def api_key(self, provedor: str) -> Optional[str]:
+        """Retorna a API key configurada para o provedor."""
+        return self.api_keys.get(provedor)
 
 
 class TranscriptionService:
@@ -30,44 +113,179 @@ class TranscriptionService:
         ]
     }
     
+    # Um cliente HTTP por event loop (reaproveita conexões keep-alive entre transcrições).
+    # As conexões do pool ficam presas ao loop que as abriu, e cada mensagem do WhatsApp
+    # roda numa thread com loop próprio, que é fechado ao final
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """Obtém (criando sob demanda) o cliente HTTP do event loop atual."""
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+            )
+            cls._clients[loop] = client
+        return client
+    
+    # Cache de transcrições por conteúdo (sha256 do áudio + parâmetros do modelo)
+    _cache: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+    # Lock de threads: o cache é usado pelos event loops de várias mensagens ao mesmo tempo
+    # (nenhum await acontece enquanto ele está adquirido)
+    _cache_lock = threading.Lock()
+    CACHE_MAX_ITENS = 512
+    CACHE_TTL_SEGUNDOS = 86400
+    
     @staticmethod
-    def obter_configuracao(db: Session) -> Dict[str, Any]:
-        """Obtém configuração de transcrição do banco."""
-        return {
-            "habilitado": ConfiguracaoService.obter_valor(db, "audio_transcricao_habilitado", True),
-            "provedor": ConfiguracaoService.obter_valor(db, "audio_transcricao_provedor", "groq"),
-            "modelo": ConfiguracaoService.obter_valor(db, "audio_transcricao_modelo", "whisper-large-v3-turbo"),
-            "idioma": ConfiguracaoService.obter_valor(db, "audio_transcricao_idioma", "pt"),
-            "temperatura": ConfiguracaoService.obter_valor(db, "audio_transcricao_temperatura", 0.0),
-            "prompt": ConfiguracaoService.obter_valor(db, "audio_transcricao_prompt", ""),
-            "response_format": ConfiguracaoService.obter_valor(db, "audio_transcricao_formato", "text"),
-            "responder_audio": ConfiguracaoService.obter_valor(db, "audio_responder_habilitado", True),
-        }
+    def _chave_cache(hash_conteudo: str, provedor: str, config: "TranscriptionConfig") -> str:
+        """Gera a chave do cache a partir do hash do áudio e dos parâmetros de transcrição."""
+        return ":".join([
+            hash_conteudo,
+            provedor,
+            config.modelo or "",
+            config.idioma or "",
+            config.prompt or "",
+            str(config.temperatura),
+            config.response_format or "",
+        ])
+    
+    @classmethod
+    async def _obter_do_cache(cls, chave: str) -> Optional[Dict[str, Any]]:
+        """Retorna uma transcrição em cache (se existir e não estiver expirada)."""
+        with cls._cache_lock:
+            item = cls._cache.get(chave)
+            if item is None:
+                return None
+            
+            expira_em, resultado = item
+            if expira_em < time.monotonic():
+                del cls._cache[chave]
+                return None
+            
+            cls._cache.move_to_end(chave)
+            return dict(resultado, cached=True)
+    
+    @classmethod
+    async def _salvar_no_cache(cls, chave: str, resultado: Dict[str, Any]):
+        """Armazena uma transcrição bem-sucedida no cache (LRU com TTL)."""
+        with cls._cache_lock:
+            cls._cache[chave] = (time.monotonic() + cls.CACHE_TTL_SEGUNDOS, resultado)
+            cls._cache.move_to_end(chave)
+            while len(cls._cache) > cls.CACHE_MAX_ITENS:
+                cls._cache.popitem(last=False)
+    
+    # Áudios acima deste tamanho são transcodificados antes do envio (se habilitado)
+    TRANSCODE_LIMITE_BYTES = 256 * 1024
+    
+    # Contador de transcrições resolvidas via fallback: (de, para) -> total
+    fallback_total: Dict[Tuple[str, str], int] = {}
+    
+    # Retentativas com backoff curto (centenas de ms) para não inflar a latência
+    RETRY_TENTATIVAS = 3
+    RETRY_ATRASO_INICIAL = 0.2
+    RETRY_ATRASO_MAX = 1.0
+    RETRY_AFTER_MAX = 5.0
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    
+    # Limite de transcrições simultâneas (evita rajadas contra a API). Cada mensagem do
+    # WhatsApp é processada numa thread com event loop próprio, então o limite precisa
+    # valer entre threads: uma asyncio.Queue ou um asyncio.Semaphore ficariam presos a um loop
+    _limite: Optional[Tuple[int, threading.BoundedSemaphore]] = None
+    ESPERA_VAGA_SEGUNDOS = 0.05
+    
+    @classmethod
+    def _obter_limite(cls, concorrencia: int) -> threading.BoundedSemaphore:
+        """Semáforo de transcrições (criado sob demanda; recriado se a concorrência mudar)."""
+        quantidade = max(1, int(concorrencia))
+        entrada = cls._limite
+        if entrada is None or entrada[0] != quantidade:
+            entrada = (quantidade, threading.BoundedSemaphore(quantidade))
+            cls._limite = entrada
+        return entrada[1]
+    
+    @classmethod
+    async def fechar_client(cls):
+        """
+        Fecha o cliente HTTP do event loop atual (chamado no shutdown da aplicação
+        e ao fim do processamento de cada mensagem, antes de o loop da thread fechar).
+        """
+        client = cls._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    # Campo da configuração -> (chave no banco, valor padrão)
+    CHAVES_TRANSCRICAO = {
+        "habilitado": ("audio_transcricao_habilitado", True),
+        "provedor": ("audio_transcricao_provedor", "groq"),
+        "provedor_fallback": ("audio_transcricao_provedor_fallback", "groq,openai"),
+        "modelo": ("audio_transcricao_modelo", "whisper-large-v3-turbo"),
+        "idioma": ("audio_transcricao_idioma", "pt"),
+        "temperatura": ("audio_transcricao_temperatura", 0.0),
+        "prompt": ("audio_transcricao_prompt", ""),
+        "response_format": ("audio_transcricao_formato", "text"),
+        "responder_audio": ("audio_responder_habilitado", True),
+        "timeout": ("audio_transcricao_timeout", 60),
+        "connect_timeout": ("audio_transcricao_connect_timeout", 5),
+        "write_timeout": ("audio_transcricao_write_timeout", 10),
+        "vad_habilitado": ("audio_vad_habilitado", False),
+        "transcode_habilitado": ("audio_transcode_habilitado", False),
+        "concorrencia": ("audio_transcricao_concorrencia", 4),
+    }
+    
+    # Provedores suportados (adicionar um provedor = adicionar uma entrada)
+    PROVEDORES: Dict[str, ProviderSpec] = {
+        "groq": ProviderSpec(GROQ_ENDPOINT, "groq_api_key", _extras_groq),
+        "openai": ProviderSpec(OPENAI_ENDPOINT, "openai_api_key"),
+    }
+    
+    @staticmethod
+    def _chaves_e_padroes() -> Tuple[List[str], Dict[str, Any]]:
+        """Chaves (configuração + API keys) e padrões usados para montar TranscriptionConfig."""
+        chaves = [chave for chave, _ in TranscriptionService.CHAVES_TRANSCRICAO.values()]
+        chaves += [spec.api_key_config for spec in TranscriptionService.PROVEDORES.values()]
+        padroes = {chave: padrao for chave, padrao in TranscriptionService.CHAVES_TRANSCRICAO.values()}
+        return chaves, padroes
+    
+    @staticmethod
+    def _montar_config(valores: Dict[str, Any]) -> TranscriptionConfig:
+        """Monta TranscriptionConfig a partir dos valores lidos em lote."""
+        return TranscriptionConfig(
+            **{campo: valores[chave] for campo, (chave, _) in TranscriptionService.CHAVES_TRANSCRICAO.items()},
+            api_keys={
+                provedor: valores[spec.api_key_config]
+                for provedor, spec in TranscriptionService.PROVEDORES.items()
+            }
+        )
     
     @staticmethod
-    def obter_api_key(db: Session, provedor: str) -> Optional[str]:
-        """Obtém a API key do provedor."""
-        if provedor == "groq":
-            return ConfiguracaoService.obter_valor(db, "groq_api_key")
-        elif provedor == "openai":
-            return ConfiguracaoService.obter_valor(db, "openai_api_key")
-        return None
+    def carregar_config(db: Session) -> TranscriptionConfig:
+        """Lê toda a configuração de transcrição (incluindo API keys) em uma única consulta."""
+        chaves, padroes = TranscriptionService._chaves_e_padroes()
+        return TranscriptionService._montar_config(ConfiguracaoService.obter_valores_bulk(db, chaves, padroes))
+    
+    @staticmethod
+    async def carregar_config_async() -> TranscriptionConfig:
+        """Lê a configuração de transcrição sem bloquear o event loop."""
+        chaves, padroes = TranscriptionService._chaves_e_padroes()
+        return TranscriptionService._montar_config(await ConfiguracaoService.obter_valores_bulk_async(chaves, padroes))
     
     @staticmethod
     async def transcrever(
-        db: Session,
         audio_bytes: bytes,
         filename: str = "audio.ogg",
-        mime_type: str = "audio/ogg"
+        mime_type: str = "audio/ogg",
+        config: Optional[TranscriptionConfig] = None
     ) -> Dict[str, Any]:
         """
         Transcreve áudio para texto.
         
         Args:
-            db: Sessão do banco
             audio_bytes: Bytes do arquivo de áudio
             filename: Nome do arquivo
             mime_type: Tipo MIME do áudio
+            config: Configuração já carregada (ex.: via Depends); se omitida, é lida do cache/banco
             
         Returns:
             Dict com:
@@ -77,119 +295,458 @@ class TranscriptionService:
                 - duracao: float (duração em segundos)
                 - erro: str (se houver erro)
         """
-        config = TranscriptionService.obter_configuracao(db)
+        # Bytes em memória podem ser reenviados, o que permite retentativas
+        return await TranscriptionService._transcrever_limitado(
+            config,
+            audio_bytes,
+            len(audio_bytes),
+            filename,
+            mime_type,
+            hashlib.sha256(audio_bytes).hexdigest()
+        )
+    
+    @staticmethod
+    async def transcrever_batch(
+        itens: List[Tuple[bytes, str, str]],
+        config: Optional[TranscriptionConfig] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Transcreve vários áudios de uma vez.
+        
+        Os áudios são enviados em paralelo; o limite de transcrições simultâneas
+        controla quantas chamadas ficam em andamento ao mesmo tempo.
+        
+        Args:
+            itens: Lista de tuplas (audio_bytes, filename, mime_type)
+            config: Configuração já carregada (opcional)
+            
+        Returns:
+            Lista de resultados na mesma ordem dos itens
+        """
+        if config is None:
+            config = await TranscriptionService.carregar_config_async()
         
+        return await asyncio.gather(*[
+            TranscriptionService.transcrever(audio_bytes, filename, mime_type, config=config)
+            for audio_bytes, filename, mime_type in itens
+        ])
+    
+    @staticmethod
+    def _montar_multipart(
+        boundary: str,
+        campos: Dict[str, Any],
+        filename: str,
+        mime_type: str
+    ) -> Tuple[bytes, bytes]:
+        """
+        Monta o prefixo (campos de formulário + cabeçalho do arquivo) e o sufixo
+        de um corpo multipart/form-data. O conteúdo do arquivo vai entre os dois.
+        """
+        partes = []
+        for nome, valor in campos.items():
+            partes.append(
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{nome}"\r\n\r\n'
+                f'{valor}\r\n'
+            )
+        partes.append(
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'
+        )
+        prefixo = "".join(partes).encode("utf-8")
+        sufixo = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        return prefixo, sufixo
+    
+    @staticmethod
+    async def _corpo_multipart(
+        prefixo: bytes,
+        sufixo: bytes,
+        audio: Union[bytes, AsyncIterator[bytes]],
+        hasher=None
+    ) -> AsyncIterator[bytes]:
+        """Gera o corpo multipart em blocos, repassando o áudio sem acumulá-lo em memória."""
+        yield prefixo
+        if isinstance(audio, bytes):
+            yield audio
+        else:
+            async for bloco in audio:
+                if hasher is not None:
+                    hasher.update(bloco)
+                yield bloco
+        yield sufixo
+    
+    @staticmethod
+    async def transcrever_stream(
+        audio_iter: AsyncIterator[bytes],
+        size: int,
+        filename: str = "audio.ogg",
+        mime_type: str = "audio/ogg",
+        hash_conteudo: Optional[str] = None,
+        config: Optional[TranscriptionConfig] = None
+    ) -> Dict[str, Any]:
+        """
+        Transcreve áudio recebido como iterador assíncrono de bytes.
+        
+        A transcrição aguarda uma vaga no limite de transcrições simultâneas,
+        que controla quantas chamadas à API ficam em andamento ao mesmo tempo.
+        
+        Args:
+            audio_iter: Iterador assíncrono com os bytes do áudio
+            size: Tamanho total do áudio em bytes (define o Content-Length)
+            filename: Nome do arquivo
+            mime_type: Tipo MIME do áudio
+            hash_conteudo: sha256 do áudio, se já conhecido (permite consultar o cache antes do envio)
+            config: Configuração já carregada (opcional)
+            
+        Returns:
+            Dict no mesmo formato de transcrever()
+        """
+        return await TranscriptionService._transcrever_limitado(
+            config, audio_iter, size, filename, mime_type, hash_conteudo
+        )
+    
+    @staticmethod
+    async def _transcrever_limitado(config: Optional[TranscriptionConfig], *argumentos) -> Dict[str, Any]:
+        """Aguarda uma vaga no limite de transcrições simultâneas e executa a transcrição."""
+        if config is None:
+            config = await TranscriptionService.carregar_config_async()
+        
+        limite = TranscriptionService._obter_limite(config.concorrencia)
+        # Sem bloquear o event loop: tenta a vaga e, se não houver, espera um pouco
+        while not limite.acquire(blocking=False):
+            await asyncio.sleep(TranscriptionService.ESPERA_VAGA_SEGUNDOS)
+        try:
+            return await TranscriptionService._transcrever_stream_impl(config, *argumentos)
+        finally:
+            limite.release()
+    
+    @staticmethod
+    def _atraso_retry(tentativa: int, response: Optional[httpx.Response] = None) -> float:
+        """Calcula o atraso antes da próxima tentativa (backoff exponencial curto com jitter)."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), TranscriptionService.RETRY_AFTER_MAX)
+                except ValueError:
+                    pass
+        
+        atraso = TranscriptionService.RETRY_ATRASO_INICIAL * (2 ** tentativa)
+        atraso += random.uniform(0, TranscriptionService.RETRY_ATRASO_INICIAL)
+        return min(atraso, TranscriptionService.RETRY_ATRASO_MAX)
+    
+    @staticmethod
+    async def _post_com_retry(
+        endpoint: str,
+        headers: Dict[str, str],
+        montar_corpo: Callable[[], AsyncIterator[bytes]],
+        reenviavel: bool,
+        timeout: httpx.Timeout
+    ) -> httpx.Response:
+        """
+        Envia a requisição de transcrição, repetindo em falhas transitórias
+        (erros de rede, 429 e 5xx). Transcrever é idempotente, então reenviar é seguro.
+        
+        Corpos vindos de um stream não podem ser reenviados depois de consumidos:
+        nesse caso só falhas de conexão (antes do envio do corpo) são repetidas.
+        """
+        client = await TranscriptionService._get_client()
+        
+        for tentativa in range(TranscriptionService.RETRY_TENTATIVAS):
+            ultima = tentativa == TranscriptionService.RETRY_TENTATIVAS - 1
+            try:
+                response = await client.post(
+                    endpoint,
+                    headers=headers,
+                    content=montar_corpo(),
+                    timeout=timeout
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if ultima:
+                    raise
+                await asyncio.sleep(TranscriptionService._atraso_retry(tentativa))
+                continue
+            except httpx.TransportError:
+                if ultima or not reenviavel:
+                    raise
+                await asyncio.sleep(TranscriptionService._atraso_retry(tentativa))
+                continue
+            
+            if response.status_code in TranscriptionService.RETRY_STATUS and reenviavel and not ultima:
+                print(f"🔁 Transcrição retornou {response.status_code}, tentando novamente...")
+                await asyncio.sleep(TranscriptionService._atraso_retry(tentativa, response))
+                continue
+            
+            return response
+    
+    @staticmethod
+    def _cadeia_provedores(config: TranscriptionConfig) -> List[str]:
+        """Monta a ordem de provedores a tentar: o principal primeiro, depois os de fallback."""
+        cadeia = [config.provedor]
+        for provedor in (config.provedor_fallback or "").split(","):
+            provedor = provedor.strip()
+            if provedor and provedor not in cadeia:
+                cadeia.append(provedor)
+        return cadeia
+    
+    @staticmethod
+    def _modelo_para_provedor(provedor: str, modelo: str) -> str:
+        """Usa o modelo configurado se o provedor o oferece; senão, o primeiro modelo do provedor."""
+        modelos = TranscriptionService.MODELOS.get(provedor, [])
+        if not modelos or any(m["id"] == modelo for m in modelos):
+            return modelo
+        return modelos[0]["id"]
+    
+    @staticmethod
+    async def _transcodificar_opus(audio_bytes: bytes) -> Optional[bytes]:
+        """Transcodifica o áudio para Opus 16 kHz mono 24 kbps via ffmpeg (None se falhar)."""
+        if shutil.which("ffmpeg") is None:
+            return None
+        
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-v", "quiet", "-i", "pipe:0",
+                "-ac", "1", "-ar", "16000",
+                "-c:a", "libopus", "-b:a", "24k",
+                "-f", "ogg", "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            saida, _ = await proc.communicate(audio_bytes)
+            if proc.returncode != 0 or not saida:
+                return None
+            return saida
+        except Exception as e:
+            print(f"⚠️ Erro ao transcodificar áudio: {e}")
+            return None
+    
+    @staticmethod
+    async def _transcrever_stream_impl(
+        config: TranscriptionConfig,
+        audio: Union[bytes, AsyncIterator[bytes]],
+        size: int,
+        filename: str = "audio.ogg",
+        mime_type: str = "audio/ogg",
+        hash_conteudo: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Executa a transcrição de fato (chamado por _transcrever_limitado).
+        
+        Tenta os provedores na ordem configurada (principal + fallback) e
+        retorna o primeiro sucesso.
+        
+        Args:
+            config: Configuração de transcrição
+            audio: Bytes do áudio ou iterador assíncrono com os bytes
+            size: Tamanho total do áudio em bytes (define o Content-Length)
+            filename: Nome do arquivo
+            mime_type: Tipo MIME do áudio
+            hash_conteudo: sha256 do áudio, se já conhecido (permite consultar o cache antes do envio)
+            
+        Returns:
+            Dict no mesmo formato de transcrever()
+        """
         # Verificar se transcrição está habilitada
-        if not config["habilitado"]:
+        if not config.habilitado:
             return {
                 "sucesso": False,
                 "texto": None,
                 "erro": "Transcrição de áudio desabilitada"
             }
         
-        provedor = config["provedor"]
-        api_key = TranscriptionService.obter_api_key(db, provedor)
+        # Áudios sem fala (toques acidentais, silêncio) não precisam ir para a API
+        if config.vad_habilitado and isinstance(audio, bytes):
+            if not await VADService.contem_fala(audio):
+                print("🔇 Áudio sem fala detectada, transcrição ignorada")
+                return {
+                    "sucesso": True,
+                    "texto": "",
+                    "idioma": config.idioma,
+                    "duracao": None,
+                    "provedor": None,
+                    "modelo": None,
+                    "vad_skipped": True
+                }
         
-        if not api_key:
+        cadeia = TranscriptionService._cadeia_provedores(config)
+        if not isinstance(audio, bytes):
+            # Um stream só pode ser enviado uma vez: sem fallback
+            cadeia = cadeia[:1]
+        
+        configs_provedor = {
+            provedor: replace(config, modelo=TranscriptionService._modelo_para_provedor(provedor, config.modelo))
+            for provedor in cadeia
+        }
+        
+        # Áudios idênticos (encaminhados, repetidos) reaproveitam a transcrição anterior
+        if hash_conteudo:
+            for provedor in cadeia:
+                resultado_cache = await TranscriptionService._obter_do_cache(
+                    TranscriptionService._chave_cache(hash_conteudo, provedor, configs_provedor[provedor])
+                )
+                if resultado_cache:
+                    return resultado_cache
+        
+        # Áudios grandes são reduzidos para Opus 16 kHz mono (o Whisper reamostra para isso de qualquer forma)
+        if config.transcode_habilitado and isinstance(audio, bytes) \
+                and len(audio) > TranscriptionService.TRANSCODE_LIMITE_BYTES:
+            transcodificado = await TranscriptionService._transcodificar_opus(audio)
+            if transcodificado and len(transcodificado) < len(audio):
+                print(f"🗜️ Áudio transcodificado: {len(audio) // 1024}KB → {len(transcodificado) // 1024}KB")
+                audio, size = transcodificado, len(transcodificado)
+                filename, mime_type = "audio.ogg", "audio/ogg"
+        
+        erros = []
+        for indice, provedor in enumerate(cadeia):
+            resultado = await TranscriptionService._tentar_provedor(
+                provedor, configs_provedor[provedor], audio, size, filename, mime_type, hash_conteudo
+            )
+            if resultado["sucesso"]:
+                if indice > 0:
+                    chave_metrica = (cadeia[0], provedor)
+                    TranscriptionService.fallback_total[chave_metrica] = \
+                        TranscriptionService.fallback_total.get(chave_metrica, 0) + 1
+                    print(f"🔀 Transcrição feita via fallback: {cadeia[0]} → {provedor}")
+                return resultado
+            erros.append(f"{provedor}: {resultado['erro']}")
+        
+        return {
+            "sucesso": False,
+            "texto": None,
+            "erro": erros[0] if len(erros) == 1 else " | ".join(erros)
+        }
+    
+    @staticmethod
+    async def _tentar_provedor(
+        provedor: str,
+        config: TranscriptionConfig,
+        audio: Union[bytes, AsyncIterator[bytes]],
+        size: int,
+        filename: str,
+        mime_type: str,
+        hash_conteudo: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        Transcreve o áudio em um provedor específico.
+        
+        O corpo multipart é enviado em blocos, direto da origem para o socket,
+        sem materializar o áudio inteiro em memória.
+        """
+        spec = TranscriptionService.PROVEDORES.get(provedor)
+        if not spec:
             return {
                 "sucesso": False,
                 "texto": None,
-                "erro": f"API Key do {provedor} não configurada"
+                "erro": f"Provedor '{provedor}' não suportado"
             }
         
-        # Determinar endpoint
-        if provedor == "groq":
-            endpoint = TranscriptionService.GROQ_ENDPOINT
-        elif provedor == "openai":
-            endpoint = TranscriptionService.OPENAI_ENDPOINT
-        else:
+        api_key = config.api_key(provedor)
+        if not api_key:
             return {
                 "sucesso": False,
                 "texto": None,
-                "erro": f"Provedor '{provedor}' não suportado"
+                "erro": f"API Key do {provedor} não configurada"
             }
         
+        # Sem hash prévio, ele é calculado durante o envio e a transcrição entra no cache ao final
+        hasher = None if hash_conteudo else hashlib.sha256()
+        
+        # Conexão falha rápido; a leitura espera o tempo de inferência do Whisper
+        timeout = config.timeout
+        timeouts = httpx.Timeout(
+            connect=float(config.connect_timeout),
+            read=float(timeout),
+            write=float(config.write_timeout),
+            pool=5.0
+        )
+        
         try:
-            # Limpar mime_type (remover parâmetros como "; codecs=opus")
-            mime_base = mime_type.split(";")[0].strip()
-            
-            # Corrigir extensão do filename se necessário
-            if ";" in filename:
-                # Remover parâmetros do filename também
-                parts = filename.rsplit(".", 1)
-                if len(parts) == 2:
-                    ext_limpa = parts[1].split(";")[0].strip()
-                    filename = f"{parts[0]}.{ext_limpa}"
-            
-            # Preparar form data
-            files = {
-                "file": (filename, audio_bytes, mime_base)
-            }
+            # Limpar mime_type e extensão (remover parâmetros como "; codecs=opus")
+            filename, mime_base = _normalizar_filename_mime(filename, mime_type)
             
+            # Preparar campos do formulário
             data = {
-                "model": config["modelo"],
-                "response_format": config["response_format"],
+                "model": config.modelo,
+                "response_format": config.response_format,
             }
             
             # Adicionar parâmetros opcionais
-            if config["idioma"]:
-                data["language"] = config["idioma"]
+            if config.idioma:
+                data["language"] = config.idioma
+            
+            if config.temperatura is not None:
+                data["temperature"] = float(config.temperatura)
             
-            if config["temperatura"] is not None:
-                data["temperature"] = float(config["temperatura"])
+            if config.prompt:
+                data["prompt"] = config.prompt
             
-            if config["prompt"]:
-                data["prompt"] = config["prompt"]
+            # Parâmetros específicos do provedor
+            data.update(spec.extra(config))
             
-            # Para Groq, adicionar timestamp_granularities se verbose_json
-            if provedor == "groq" and config["response_format"] == "verbose_json":
-                data["timestamp_granularities[]"] = "segment"
+            # Montar corpo multipart em streaming
+            boundary = uuid.uuid4().hex
+            prefixo, sufixo = TranscriptionService._montar_multipart(boundary, data, filename, mime_base)
             
             # Fazer requisição
-            timeout = ConfiguracaoService.obter_valor(db, "audio_transcricao_timeout", 60)
+            response = await TranscriptionService._post_com_retry(
+                spec.endpoint,
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": f"multipart/form-data; boundary={boundary}",
+                    "Content-Length": str(len(prefixo) + size + len(sufixo))
+                },
+                montar_corpo=lambda: TranscriptionService._corpo_multipart(prefixo, sufixo, audio, hasher),
+                reenviavel=isinstance(audio, bytes),
+                timeout=timeouts
+            )
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    endpoint,
-                    headers={
-                        "Authorization": f"Bearer {api_key}"
-                    },
-                    files=files,
-                    data=data,
-                    timeout=float(timeout)
-                )
-                
-                if response.status_code != 200:
-                    return {
-                        "sucesso": False,
-                        "texto": None,
-                        "erro": f"Erro na API ({response.status_code}): {response.text}"
-                    }
+            if response.status_code != 200:
+                return {
+                    "sucesso": False,
+                    "texto": None,
+                    "erro": f"Erro na API ({response.status_code}): {response.text}"
+                }
+            
+            # Processar resposta
+            if config.response_format == "text":
+                texto = response.text
+                resultado = {
+                    "sucesso": True,
+                    "texto": texto.strip(),
+                    "idioma": config.idioma,
+                    "duracao": None,
+                    "provedor": provedor,
+                    "modelo": config.modelo
+                }
+            else:
+                # JSON response (verbose_json pode trazer muitos segmentos)
+                result = orjson.loads(response.content) if ORJSON_AVAILABLE else response.json()
+                resultado = {
+                    "sucesso": True,
+                    "texto": result.get("text", "").strip(),
+                    "idioma": result.get("language", config.idioma),
+                    "duracao": result.get("duration"),
+                    "segmentos": result.get("segments"),
+                    "provedor": provedor,
+                    "modelo": config.modelo
+                }
+            
+            if hasher is not None:
+                hash_conteudo = hasher.hexdigest()
+            await TranscriptionService._salvar_no_cache(
+                TranscriptionService._chave_cache(hash_conteudo, provedor, config),
+                resultado
+            )
+            return resultado
                 
-                # Processar resposta
-                if config["response_format"] == "text":
-                    texto = response.text
-                    return {
-                        "sucesso": True,
-                        "texto": texto.strip(),
-                        "idioma": config["idioma"],
-                        "duracao": None,
-                        "provedor": provedor,
-                        "modelo": config["modelo"]
-                    }
-                else:
-                    # JSON response
-                    result = response.json()
-                    return {
-                        "sucesso": True,
-                        "texto": result.get("text", "").strip(),
-                        "idioma": result.get("language", config["idioma"]),
-                        "duracao": result.get("duration"),
-                        "segmentos": result.get("segments"),
-                        "provedor": provedor,
-                        "modelo": config["modelo"]
-                    }
-                    
+        except (httpx.ConnectTimeout, httpx.ConnectError):
+            return {
+                "sucesso": False,
+                "texto": None,
+                "erro": "Falha ao conectar ao provedor"
+            }
         except httpx.TimeoutException:
             return {
                 "sucesso": False,
@@ -211,11 +768,19 @@ class TranscriptionService:
         return TranscriptionService.MODELOS
     
     @staticmethod
-    async def testar_conexao(db: Session) -> Dict[str, Any]:
+    def listar_modelos_json(provedor: str = None) -> bytes:
+        """Lista modelos disponíveis já serializados em JSON (pré-calculado no import)."""
+        if provedor:
+            return _MODELOS_JSON_POR_PROVEDOR.get(provedor) or json.dumps({provedor: []}).encode("utf-8")
+        return _MODELOS_JSON
+    
+    @staticmethod
+    async def testar_conexao(config: Optional[TranscriptionConfig] = None) -> Dict[str, Any]:
         """Testa conexão com o provedor de transcrição."""
-        config = TranscriptionService.obter_configuracao(db)
-        provedor = config["provedor"]
-        api_key = TranscriptionService.obter_api_key(db, provedor)
+        if config is None:
+            config = await TranscriptionService.carregar_config_async()
+        provedor = config.provedor
+        api_key = config.api_key(provedor)
         
         if not api_key:
             return {
@@ -229,5 +794,18 @@ class TranscriptionService:
             "sucesso": True,
             "mensagem": f"API Key do {provedor} configurada",
             "provedor": provedor,
-            "modelo": config["modelo"]
+            "modelo": config.modelo
         }
+
+
+# Respostas JSON dos modelos, serializadas uma única vez (MODELOS é estático)
+_MODELOS_JSON = json.dumps(TranscriptionService.MODELOS, ensure_ascii=False).encode("utf-8")
+_MODELOS_JSON_POR_PROVEDOR = {
+    provedor: json.dumps({provedor: modelos}, ensure_ascii=False).encode("utf-8")
+    for provedor, modelos in TranscriptionService.MODELOS.items()
+}
+
+
+def get_transcription_config(db: Session = Depends(get_db)) -> TranscriptionConfig:
+    """Dependency que lê a configuração de transcrição uma vez por requisição."""
+    return TranscriptionService.carregar_config(db)
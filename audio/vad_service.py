@@ -0,0 +1,93 @@
+"""
+Detecção de voz (VAD) para evitar transcrever áudios silenciosos.
+Usa Silero VAD (opcional) sobre PCM 16 kHz mono decodificado pelo ffmpeg.
+"""
+import asyncio
+import logging
+import shutil
+import threading
+from typing import Optional
+
+# Dependências opcionais (pip install silero-vad)
+try:
+    import numpy as np
+    import torch
+    from silero_vad import load_silero_vad, get_speech_timestamps
+    SILERO_AVAILABLE = True
+except ImportError:
+    SILERO_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class VADService:
+    """Serviço para detectar se um áudio contém fala antes de enviá-lo à API."""
+
+    TAXA_AMOSTRAGEM = 16000
+    FALA_MINIMA_MS = 100
+
+    # O modelo Silero guarda estado entre chamadas (get_speech_timestamps o reinicia e o
+    # alimenta) e os áudios chegam de várias threads, cada mensagem com seu event loop:
+    # carregamento e inferência ficam serializados por um lock de threads
+    _modelo = None
+    _modelo_lock = threading.Lock()
+
+    @staticmethod
+    def disponivel() -> bool:
+        """Indica se o VAD pode ser usado (Silero instalado e ffmpeg no PATH)."""
+        return SILERO_AVAILABLE and shutil.which("ffmpeg") is not None
+
+    @classmethod
+    def _detectar_trechos(cls, amostras) -> list:
+        """Detecta os trechos de fala, carregando o modelo na primeira vez (bloqueante: roda em thread)."""
+        with cls._modelo_lock:
+            if cls._modelo is None:
+                cls._modelo = load_silero_vad()
+            return get_speech_timestamps(
+                amostras,
+                cls._modelo,
+                sampling_rate=cls.TAXA_AMOSTRAGEM
+            )
+
+    @staticmethod
+    async def _decodificar_pcm(audio_bytes: bytes) -> Optional[bytes]:
+        """Decodifica o áudio (ogg/opus, mp3, etc.) para PCM s16le 16 kHz mono via ffmpeg."""
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-v", "quiet", "-i", "pipe:0",
+            "-ac", "1", "-ar", str(VADService.TAXA_AMOSTRAGEM),
+            "-f", "s16le", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        saida, _ = await proc.communicate(audio_bytes)
+        if proc.returncode != 0:
+            return None
+        return saida
+
+    @staticmethod
+    async def contem_fala(audio_bytes: bytes) -> bool:
+        """
+        Verifica se o áudio contém fala.
+
+        Em caso de qualquer falha (dependência ausente, áudio não decodificável),
+        retorna True para que o áudio siga normalmente para a transcrição.
+        """
+        if not VADService.disponivel():
+            return True
+
+        try:
+            pcm = await VADService._decodificar_pcm(audio_bytes)
+            if not pcm:
+                return True
+
+            amostras = torch.from_numpy(
+                np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+            )
+            trechos = await asyncio.to_thread(VADService._detectar_trechos, amostras)
+
+            total_fala = sum(trecho["end"] - trecho["start"] for trecho in trechos)
+            return total_fala * 1000 >= VADService.FALA_MINIMA_MS * VADService.TAXA_AMOSTRAGEM
+        except Exception as e:
+            logger.warning(f"Falha no VAD, seguindo com transcrição: {e}")
+            return True
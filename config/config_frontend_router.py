@@ -17,29 +17,24 @@ templates = Jinja2Templates(directory="templates")
 @router.get("/", response_class=HTMLResponse)
 def pagina_configuracoes(request: Request, db: Session = Depends(get_db)):
     """Página de configurações do sistema."""
-    # Buscar configurações por categoria
-    config_openrouter = ConfiguracaoService.listar_por_categoria(db, "openrouter")
-    config_agente = ConfiguracaoService.listar_por_categoria(db, "agente")
-    config_geral = ConfiguracaoService.listar_por_categoria(db, "geral")
-    config_llm = ConfiguracaoService.listar_por_categoria(db, "llm")
-    config_sessao = ConfiguracaoService.listar_por_categoria(db, "sessao")
-    config_ferramenta = ConfiguracaoService.listar_por_categoria(db, "ferramenta")
-    config_mcp = ConfiguracaoService.listar_por_categoria(db, "mcp")
-    config_audio = ConfiguracaoService.listar_por_categoria(db, "audio")
+    # Buscar configurações de todas as categorias em uma única consulta
+    configs = ConfiguracaoService.listar_por_categorias(db, [
+        "openrouter", "agente", "geral", "llm", "sessao", "ferramenta", "mcp", "audio"
+    ])
     
     # Buscar provedores locais para o dropdown
     provedores_locais = ProvedorLLMService.listar_todos(db)
     
     return templates.TemplateResponse("config/settings.html", {
         "request": request,
-        "config_openrouter": config_openrouter,
-        "config_agente": config_agente,
-        "config_geral": config_geral,
-        "config_llm": config_llm,
-        "config_sessao": config_sessao,
-        "config_ferramenta": config_ferramenta,
-        "config_mcp": config_mcp,
-        "config_audio": config_audio,
+        "config_openrouter": configs["openrouter"],
+        "config_agente": configs["agente"],
+        "config_geral": configs["geral"],
+        "config_llm": configs["llm"],
+        "config_sessao": configs["sessao"],
+        "config_ferramenta": configs["ferramenta"],
+        "config_mcp": configs["mcp"],
+        "config_audio": configs["audio"],
         "provedores_locais": provedores_locais,
         "titulo": "Configurações do Sistema"
     })
@@ -61,8 +56,10 @@ async def salvar_openrouter(
         return RedirectResponse(url="/configuracoes", status_code=303)
     else:
         # Salvar configurações
-        ConfiguracaoService.definir_valor(db, "openrouter_api_key", api_key)
-        ConfiguracaoService.definir_valor(db, "openrouter_modelo_padrao", modelo_padrao)
+        ConfiguracaoService.definir_valores_bulk(db, {
+            "openrouter_api_key": api_key,
+            "openrouter_modelo_padrao": modelo_padrao,
+        })
         return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -76,11 +73,13 @@ def salvar_parametros_llm(
     db: Session = Depends(get_db)
 ):
     """Salva parâmetros LLM."""
-    ConfiguracaoService.definir_valor(db, "openrouter_temperatura", str(temperatura))
-    ConfiguracaoService.definir_valor(db, "openrouter_max_tokens", str(max_tokens))
-    ConfiguracaoService.definir_valor(db, "openrouter_top_p", str(top_p))
-    ConfiguracaoService.definir_valor(db, "openrouter_frequency_penalty", str(frequency_penalty))
-    ConfiguracaoService.definir_valor(db, "openrouter_presence_penalty", str(presence_penalty))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "openrouter_temperatura": str(temperatura),
+        "openrouter_max_tokens": str(max_tokens),
+        "openrouter_top_p": str(top_p),
+        "openrouter_frequency_penalty": str(frequency_penalty),
+        "openrouter_presence_penalty": str(presence_penalty),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -96,13 +95,15 @@ def salvar_agente(
     db: Session = Depends(get_db)
 ):
     """Salva configurações do agente."""
-    ConfiguracaoService.definir_valor(db, "agente_papel_padrao", papel)
-    ConfiguracaoService.definir_valor(db, "agente_objetivo_padrao", objetivo)
-    ConfiguracaoService.definir_valor(db, "agente_politicas_padrao", politicas)
-    ConfiguracaoService.definir_valor(db, "agente_tarefa_padrao", tarefa)
-    ConfiguracaoService.definir_valor(db, "agente_objetivo_explicito_padrao", objetivo_explicito)
-    ConfiguracaoService.definir_valor(db, "agente_publico_padrao", publico)
-    ConfiguracaoService.definir_valor(db, "agente_restricoes_padrao", restricoes)
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "agente_papel_padrao": papel,
+        "agente_objetivo_padrao": objetivo,
+        "agente_politicas_padrao": politicas,
+        "agente_tarefa_padrao": tarefa,
+        "agente_objetivo_explicito_padrao": objetivo_explicito,
+        "agente_publico_padrao": publico,
+        "agente_restricoes_padrao": restricoes,
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -114,9 +115,11 @@ def salvar_geral(
     db: Session = Depends(get_db)
 ):
     """Salva configurações gerais."""
-    ConfiguracaoService.definir_valor(db, "sistema_diretorio_uploads", diretorio_uploads)
-    ConfiguracaoService.definir_valor(db, "sistema_max_tamanho_imagem_mb", str(max_tamanho_imagem_mb))
-    ConfiguracaoService.definir_valor(db, "sistema_qualidade_jpeg", str(qualidade_jpeg))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "sistema_diretorio_uploads": diretorio_uploads,
+        "sistema_max_tamanho_imagem_mb": str(max_tamanho_imagem_mb),
+        "sistema_qualidade_jpeg": str(qualidade_jpeg),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -128,16 +131,19 @@ def salvar_provedores_llm(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de provedores LLM."""
-    ConfiguracaoService.definir_valor(db, "llm_provedor_padrao", provedor_padrao)
-    ConfiguracaoService.definir_valor(db, "llm_fallback_openrouter", str(fallback_openrouter).lower())
+    valores = {
+        "llm_provedor_padrao": provedor_padrao,
+        "llm_fallback_openrouter": str(fallback_openrouter).lower(),
+    }
     
     # Salvar ID do provedor local se selecionado
     if provedor_padrao == "local" and provedor_local_id:
-        ConfiguracaoService.definir_valor(db, "llm_provedor_local_id", provedor_local_id)
+        valores["llm_provedor_local_id"] = provedor_local_id
     elif provedor_padrao != "local":
         # Limpar ID do provedor local se não for modo local
-        ConfiguracaoService.definir_valor(db, "llm_provedor_local_id", "")
+        valores["llm_provedor_local_id"] = ""
     
+    ConfiguracaoService.definir_valores_bulk(db, valores)
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -148,8 +154,10 @@ def salvar_sessao(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de sessão WhatsApp."""
-    ConfiguracaoService.definir_valor(db, "sessao_diretorio", sessao_diretorio)
-    ConfiguracaoService.definir_valor(db, "sessao_history_sync_delay", str(history_sync_delay))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "sessao_diretorio": sessao_diretorio,
+        "sessao_history_sync_delay": str(history_sync_delay),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -162,10 +170,12 @@ def salvar_agente_avancado(
     db: Session = Depends(get_db)
 ):
     """Salva configurações avançadas do agente."""
-    ConfiguracaoService.definir_valor(db, "agente_max_ferramentas", str(max_ferramentas))
-    ConfiguracaoService.definir_valor(db, "agente_max_iteracoes_loop", str(max_iteracoes))
-    ConfiguracaoService.definir_valor(db, "agente_historico_mensagens", str(historico_mensagens))
-    ConfiguracaoService.definir_valor(db, "agente_rag_resultados_padrao", str(rag_resultados))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "agente_max_ferramentas": str(max_ferramentas),
+        "agente_max_iteracoes_loop": str(max_iteracoes),
+        "agente_historico_mensagens": str(historico_mensagens),
+        "agente_rag_resultados_padrao": str(rag_resultados),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -177,9 +187,11 @@ def salvar_ferramenta(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de ferramentas."""
-    ConfiguracaoService.definir_valor(db, "ferramenta_timeout_http", str(timeout_http))
-    ConfiguracaoService.definir_valor(db, "ferramenta_timeout_download", str(timeout_download))
-    ConfiguracaoService.definir_valor(db, "ferramenta_timeout_teste", str(timeout_teste))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "ferramenta_timeout_http": str(timeout_http),
+        "ferramenta_timeout_download": str(timeout_download),
+        "ferramenta_timeout_teste": str(timeout_teste),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -190,8 +202,10 @@ def salvar_mcp(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de MCP."""
-    ConfiguracaoService.definir_valor(db, "mcp_max_clients_por_agente", str(max_clients))
-    ConfiguracaoService.definir_valor(db, "mcp_timeout_execucao", str(timeout_execucao))
+    ConfiguracaoService.definir_valores_bulk(db, {
+        "mcp_max_clients_por_agente": str(max_clients),
+        "mcp_timeout_execucao": str(timeout_execucao),
+    })
     return RedirectResponse(url="/configuracoes", status_code=303)
 
 
@@ -210,16 +224,19 @@ def salvar_audio(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de áudio/transcrição."""
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_habilitado", transcricao_habilitado)
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_provedor", provedor)
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_modelo", modelo)
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_idioma", idioma)
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_temperatura", str(temperatura))
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_prompt", prompt)
-    ConfiguracaoService.definir_valor(db, "audio_transcricao_timeout", str(timeout))
-    ConfiguracaoService.definir_valor(db, "audio_responder_habilitado", responder_habilitado)
+    valores = {
+        "audio_transcricao_habilitado": transcricao_habilitado,
+        "audio_transcricao_provedor": provedor,
+        "audio_transcricao_modelo": modelo,
+        "audio_transcricao_idioma": idioma,
+        "audio_transcricao_temperatura": str(temperatura),
+        "audio_transcricao_prompt": prompt,
+        "audio_transcricao_timeout": str(timeout),
+        "audio_responder_habilitado": responder_habilitado,
+    }
     if groq_api_key:
-        ConfiguracaoService.definir_valor(db, "groq_api_key", groq_api_key)
+        valores["groq_api_key"] = groq_api_key
     if openai_api_key:
-        ConfiguracaoService.definir_valor(db, "openai_api_key", openai_api_key)
+        valores["openai_api_key"] = openai_api_key
+    ConfiguracaoService.definir_valores_bulk(db, valores)
     return RedirectResponse(url="/configuracoes", status_code=303)
@@ -1,7 +1,7 @@
 """
 Modelo de dados para configurações do sistema.
 """
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, Text, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -18,10 +18,16 @@ class Configuracao(Base):
     valor = Column(Text, nullable=True)
     tipo = Column(String(50), nullable=False, default="string")  # string, int, float, bool, json
     descricao = Column(Text, nullable=True)
-    categoria = Column(String(50), nullable=False, default="geral")  # geral, openrouter, whatsapp, agente
+    categoria = Column(String(50), nullable=False, default="geral", index=True)  # geral, openrouter, whatsapp, agente
     editavel = Column(Boolean, default=True)
     criado_em = Column(DateTime(timezone=True), server_default=func.now())
     atualizado_em = Column(DateTime(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        # No PostgreSQL, leituras por chave viram index-only scans (valor/tipo no próprio índice)
+        # Em outros bancos seria só uma cópia do índice único de chave, por isso fica restrito ao PostgreSQL
+        Index("ix_configuracoes_chave_covering", "chave", postgresql_include=["valor", "tipo"]).ddl_if(dialect="postgresql"),
+    )
+
     def __repr__(self):
         return f"<Configuracao(chave='{self.chave}', valor='{self.valor}')>"
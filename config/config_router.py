@@ -2,8 +2,9 @@
 Rotas da API para configurações.
 """
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from database import get_db
 from config.config_schema import (
     ConfiguracaoResposta,
@@ -12,6 +13,11 @@ from config.config_schema import (
     TestarConexaoResposta
 )
 from config.config_service import ConfiguracaoService
+from audio.transcription_service import (
+    TranscriptionService,
+    TranscriptionConfig,
+    get_transcription_config
+)
 
 router = APIRouter(prefix="/api/configuracoes", tags=["Configurações"])
 
@@ -28,6 +34,27 @@ def listar_por_categoria(categoria: str, db: Session = Depends(get_db)):
     return ConfiguracaoService.listar_por_categoria(db, categoria)
 
 
+@router.get("/valores")
+def listar_valores(categoria: Optional[str] = None, db: Session = Depends(get_db)):
+    """Lista {chave: valor} das configurações, com os valores já convertidos."""
+    return ConfiguracaoService.listar_valores(db, categoria)
+
+
+@router.get("/audio/modelos")
+def listar_modelos_transcricao(provedor: Optional[str] = None):
+    """Lista modelos de transcrição disponíveis (JSON pré-serializado)."""
+    return Response(
+        content=TranscriptionService.listar_modelos_json(provedor),
+        media_type="application/json"
+    )
+
+
+@router.post("/audio/testar")
+async def testar_transcricao(config: TranscriptionConfig = Depends(get_transcription_config)):
+    """Verifica se o provedor de transcrição está configurado."""
+    return await TranscriptionService.testar_conexao(config=config)
+
+
 @router.get("/{chave}", response_model=ConfiguracaoResposta)
 def obter_configuracao(chave: str, db: Session = Depends(get_db)):
     """Obtém uma configuração específica."""
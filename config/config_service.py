@@ -2,9 +2,22 @@
 Serviço de lógica de negócio para configurações.
 """
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
+from sqlalchemy.sql import func
+from typing import Optional, List, Dict, Any, Tuple, Callable, Union
+import asyncio
 import httpx
 import json
+import time
+from pathlib import Path
+
+# Dependência opcional (pip install orjson)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+from database import insert_com_conflito
 from config.config_model import Configuracao
 from config.config_schema import (
     ConfiguracaoCriar,
@@ -13,10 +26,187 @@ from config.config_schema import (
     TestarConexaoResposta
 )
 
+def _json_loads(valor: Union[str, bytes]) -> Any:
+    """Desserializa JSON com orjson quando disponível (erros são json.JSONDecodeError)."""
+    return orjson.loads(valor) if ORJSON_AVAILABLE else json.loads(valor)
+
+
+def _json_dumps(valor: Any) -> str:
+    """Serializa para JSON sem escapar caracteres não-ASCII."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(valor).decode()
+    return json.dumps(valor, ensure_ascii=False)
+
+
+_VALORES_VERDADEIROS = frozenset({"true", "1", "sim", "yes"})
+
+
+def _converter_bool(valor: str) -> bool:
+    """Interpreta o texto armazenado como booleano."""
+    return valor.lower() in _VALORES_VERDADEIROS
+
+
+# tipo da configuração -> conversor do valor armazenado (tipos ausentes ficam como string)
+_CONVERSORES: Dict[str, Callable[[str], Any]] = {
+    "int": int,
+    "float": float,
+    "bool": _converter_bool,
+    "json": _json_loads,
+}
+
+
+# classe do valor -> tipo da configuração (o que não estiver aqui é salvo como string)
+_TIPO_POR_CLASSE: Dict[type, str] = {
+    bool: "bool",
+    int: "int",
+    float: "float",
+    dict: "json",
+    list: "json",
+}
+
+
+def _serializar_valor(valor: Any) -> Tuple[str, str]:
+    """Converte um valor Python em (texto armazenado, tipo da configuração)."""
+    tipo = _TIPO_POR_CLASSE.get(type(valor))
+    if tipo is None:
+        # Subclasses (ex.: OrderedDict, IntEnum) seguem o tipo da classe base
+        tipo = next(
+            (tipo_base for classe, tipo_base in _TIPO_POR_CLASSE.items() if isinstance(valor, classe)),
+            "string"
+        )
+    if tipo == "json":
+        return _json_dumps(valor), tipo
+    return str(valor), tipo
+
+
+def _numero_ou_none(valor: Any, conversor: Callable[[Any], Any]) -> Any:
+    """Converte um campo numérico vindo de API externa, retornando None se inválido."""
+    if valor is None:
+        return None
+    try:
+        return conversor(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+# Marca "valor ainda não convertido" (json, ou conversão que falhou) no cache
+_SEM_VALOR = object()
+
+
+def _carregar_configuracoes_padrao() -> List[Dict[str, Any]]:
+    """Lê as configurações padrão do arquivo defaults.json (ao lado deste módulo)."""
+    with open(Path(__file__).parent / "defaults.json", "rb") as arquivo:
+        return _json_loads(arquivo.read())
+
+
+# Configurações padrão do sistema, criadas no startup se ainda não existirem
+CONFIGURACOES_PADRAO: List[Dict[str, Any]] = _carregar_configuracoes_padrao()
+
+# Validadas uma única vez na importação (são constantes), prontas para bulk insert
+_CONFIGURACOES_PADRAO_VALIDADAS = [
+    ConfiguracaoCriar(**config_data).model_dump() for config_data in CONFIGURACOES_PADRAO
+]
+
 
 class ConfiguracaoService:
     """Serviço para gerenciar configurações do sistema."""
 
+    # Cache em memória: chave -> ((tipo, valor, convertido) ou None se não existir, expira_em)
+    _cache: Dict[str, Tuple[Optional[Tuple[str, Optional[str], Any]], float]] = {}
+    CACHE_TTL_SEGUNDOS = 60
+
+    # Cliente HTTP compartilhado (reaproveita conexões TCP/TLS com o OpenRouter)
+    _client: Optional[httpx.AsyncClient] = None
+    _client_lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """Obtém (criando sob demanda) o cliente HTTP compartilhado."""
+        if cls._client is not None and not cls._client.is_closed:
+            return cls._client
+
+        if cls._client_lock is None:
+            cls._client_lock = asyncio.Lock()
+
+        async with cls._client_lock:
+            if cls._client is None or cls._client.is_closed:
+                cls._client = httpx.AsyncClient(
+                    timeout=10.0,
+                    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+                )
+        return cls._client
+
+    @classmethod
+    async def fechar_client(cls):
+        """Fecha o cliente HTTP compartilhado (chamado no shutdown da aplicação)."""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    # Chaves que influenciam a escolha de provedor LLM (cacheada no LLMIntegrationService)
+    CHAVES_PROVEDOR_LLM = frozenset({
+        "openrouter_api_key", "llm_provedor_padrao", "llm_provedor_local_id", "llm_fallback_openrouter"
+    })
+
+    @staticmethod
+    def invalidar_cache(chave: Optional[str] = None):
+        """Invalida o cache de uma chave (ou de todas, se nenhuma for informada)."""
+        if chave is None:
+            ConfiguracaoService._cache.clear()
+        else:
+            ConfiguracaoService._cache.pop(chave, None)
+
+        if chave is None or chave in ConfiguracaoService.CHAVES_PROVEDOR_LLM:
+            from llm_providers.llm_integration_service import LLMIntegrationService
+            LLMIntegrationService.invalidar_cache()
+
+    @staticmethod
+    def _cache_obter(chave: str):
+        """Retorna (encontrado, (tipo, valor, convertido) ou None) a partir do cache."""
+        item = ConfiguracaoService._cache.get(chave)
+        if item is None or item[1] < time.monotonic():
+            return False, None
+        return True, item[0]
+
+    @staticmethod
+    def _cache_salvar(chave: str, bruto: Optional[Tuple[str, Optional[str]]]):
+        """
+        Armazena no cache o par (tipo, valor) de uma configuração junto com o valor
+        já convertido. Valores json não são guardados convertidos, pois são mutáveis
+        e seriam compartilhados entre chamadores.
+        """
+        entrada = None
+        if bruto:
+            tipo, valor = bruto
+            convertido = _SEM_VALOR
+            if tipo != "json":
+                convertido = ConfiguracaoService._converter_valor(tipo, valor, _SEM_VALOR)
+            entrada = (tipo, valor, convertido)
+        ConfiguracaoService._cache[chave] = (entrada, time.monotonic() + ConfiguracaoService.CACHE_TTL_SEGUNDOS)
+        return entrada
+
+    @staticmethod
+    def _valor_da_entrada(entrada: Optional[Tuple[str, Optional[str], Any]], padrao: Any = None) -> Any:
+        """Resolve o valor final de uma entrada do cache, usando o padrão quando necessário."""
+        if not entrada:
+            return padrao
+        tipo, valor, convertido = entrada
+        if convertido is _SEM_VALOR:
+            return ConfiguracaoService._converter_valor(tipo, valor, padrao)
+        return convertido
+
+    @staticmethod
+    def aquecer_cache(db: Session) -> int:
+        """
+        Carrega todas as configurações no cache com uma única consulta (usado no startup),
+        para que as primeiras leituras não precisem ir ao banco.
+        Retorna a quantidade de configurações carregadas.
+        """
+        linhas = db.query(Configuracao.chave, Configuracao.valor, Configuracao.tipo).all()
+        for chave, valor, tipo in linhas:
+            ConfiguracaoService._cache_salvar(chave, (tipo, valor))
+        return len(linhas)
+
     @staticmethod
     def obter_por_chave(db: Session, chave: str) -> Optional[Configuracao]:
         """Obtém uma configuração pela chave."""
@@ -28,30 +218,128 @@ class ConfiguracaoService:
         Obtém o valor de uma configuração, convertendo para o tipo correto.
         Retorna o valor padrão se não encontrar.
         """
-        config = ConfiguracaoService.obter_por_chave(db, chave)
-        if not config or config.valor is None:
+        encontrado, entrada = ConfiguracaoService._cache_obter(chave)
+        if not encontrado:
+            config = ConfiguracaoService.obter_por_chave(db, chave)
+            entrada = ConfiguracaoService._cache_salvar(chave, (config.tipo, config.valor) if config else None)
+
+        return ConfiguracaoService._valor_da_entrada(entrada, padrao)
+
+    @staticmethod
+    def _converter_valor(tipo: str, valor: Optional[str], padrao: Any = None) -> Any:
+        """Converte o valor armazenado (string) para o tipo declarado da configuração."""
+        if tipo == "string":
+            # Caso mais comum: nada a converter
+            return padrao if valor is None else valor
+
+        if valor is None:
             return padrao
 
-        # Converter para o tipo correto
+        conversor = _CONVERSORES.get(tipo)
+        if conversor is None:
+            return valor
+
         try:
-            if config.tipo == "int":
-                return int(config.valor)
-            elif config.tipo == "float":
-                return float(config.valor)
-            elif config.tipo == "bool":
-                return config.valor.lower() in ("true", "1", "sim", "yes")
-            elif config.tipo == "json":
-                return json.loads(config.valor)
-            else:
-                return config.valor
+            return conversor(valor)
         except (ValueError, json.JSONDecodeError):
             return padrao
 
+    @staticmethod
+    def obter_valores_bulk(db: Session, chaves: List[str], padroes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Obtém os valores de várias configurações com uma única consulta.
+        Retorna um dict chave -> valor convertido, usando os padrões para chaves ausentes.
+        """
+        padroes = padroes or {}
+        entradas = {}
+        faltantes = []
+
+        for chave in chaves:
+            encontrado, entrada = ConfiguracaoService._cache_obter(chave)
+            if encontrado:
+                entradas[chave] = entrada
+            else:
+                faltantes.append(chave)
+
+        if faltantes:
+            linhas = db.query(Configuracao.chave, Configuracao.valor, Configuracao.tipo)\
+                .filter(Configuracao.chave.in_(faltantes))\
+                .all()
+            brutos = {chave: (tipo, valor) for chave, valor, tipo in linhas}
+            for chave in faltantes:
+                entradas[chave] = ConfiguracaoService._cache_salvar(chave, brutos.get(chave))
+
+        return {
+            chave: ConfiguracaoService._valor_da_entrada(entradas[chave], padroes.get(chave))
+            for chave in chaves
+        }
+
+    @staticmethod
+    async def obter_valores_bulk_async(chaves: List[str], padroes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Versão para código assíncrono de obter_valores_bulk.
+        Se todas as chaves estiverem em cache, responde sem I/O; senão a consulta
+        roda em uma thread com sessão própria, sem bloquear o event loop.
+        """
+        padroes = padroes or {}
+        entradas = {}
+        for chave in chaves:
+            encontrado, entrada = ConfiguracaoService._cache_obter(chave)
+            if not encontrado:
+                break
+            entradas[chave] = entrada
+        else:
+            # Usa as entradas já lidas: uma segunda consulta ao cache poderia
+            # encontrar o TTL vencido e tentar ir ao banco sem sessão
+            return {
+                chave: ConfiguracaoService._valor_da_entrada(entradas[chave], padroes.get(chave))
+                for chave in chaves
+            }
+
+        def consultar():
+            from database import SessionLocal
+            db = SessionLocal()
+            try:
+                return ConfiguracaoService.obter_valores_bulk(db, chaves, padroes)
+            finally:
+                db.close()
+
+        return await asyncio.to_thread(consultar)
+
+    @staticmethod
+    async def obter_valor_async(chave: str, padrao: Any = None) -> Any:
+        """Versão para código assíncrono de obter_valor (não bloqueia o event loop)."""
+        valores = await ConfiguracaoService.obter_valores_bulk_async([chave], {chave: padrao})
+        return valores[chave]
+
     @staticmethod
     def listar_por_categoria(db: Session, categoria: str) -> List[Configuracao]:
         """Lista todas as configurações de uma categoria."""
         return db.query(Configuracao).filter(Configuracao.categoria == categoria).all()
 
+    @staticmethod
+    def listar_por_categorias(db: Session, categorias: List[str]) -> Dict[str, List[Configuracao]]:
+        """Lista as configurações de várias categorias com uma única consulta, agrupadas por categoria."""
+        agrupadas = {categoria: [] for categoria in categorias}
+        configs = db.query(Configuracao).filter(Configuracao.categoria.in_(categorias)).all()
+        for config in configs:
+            agrupadas[config.categoria].append(config)
+        return agrupadas
+
+    @staticmethod
+    def listar_valores(db: Session, categoria: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Retorna {chave: valor convertido} das configurações (opcionalmente de uma categoria).
+        Consulta só as colunas necessárias, sem instanciar objetos Configuracao.
+        """
+        query = db.query(Configuracao.chave, Configuracao.valor, Configuracao.tipo)
+        if categoria:
+            query = query.filter(Configuracao.categoria == categoria)
+        return {
+            chave: ConfiguracaoService._converter_valor(tipo, valor)
+            for chave, valor, tipo in query.all()
+        }
+
     @staticmethod
     def listar_todas(db: Session) -> List[Configuracao]:
         """Lista todas as configurações."""
@@ -63,7 +351,8 @@ class ConfiguracaoService:
         db_config = Configuracao(**config.model_dump())
         db.add(db_config)
         db.commit()
-        db.refresh(db_config)
+        # Sem refresh: os atributos expirados no commit só são recarregados se forem lidos
+        ConfiguracaoService.invalidar_cache(config.chave)
         return db_config
 
     @staticmethod
@@ -81,7 +370,7 @@ class ConfiguracaoService:
             setattr(db_config, campo, valor)
 
         db.commit()
-        db.refresh(db_config)
+        ConfiguracaoService.invalidar_cache(chave)
         return db_config
 
     @staticmethod
@@ -92,38 +381,59 @@ class ConfiguracaoService:
         """
         db_config = ConfiguracaoService.obter_por_chave(db, chave)
 
-        if db_config:
-            # Converter valor para string
-            if isinstance(valor, (dict, list)):
-                valor_str = json.dumps(valor, ensure_ascii=False)
-            else:
-                valor_str = str(valor)
+        if not db_config and not criar_se_nao_existir:
+            raise ValueError(f"Configuração '{chave}' não encontrada")
+
+        valor_str, tipo = _serializar_valor(valor)
 
+        if db_config:
             db_config.valor = valor_str
-            db.commit()
-            db.refresh(db_config)
-            return db_config
-        elif criar_se_nao_existir:
-            # Criar nova configuração
-            tipo = "string"
-            if isinstance(valor, bool):
-                tipo = "bool"
-            elif isinstance(valor, int):
-                tipo = "int"
-            elif isinstance(valor, float):
-                tipo = "float"
-            elif isinstance(valor, (dict, list)):
-                tipo = "json"
-
-            nova_config = ConfiguracaoCriar(
-                chave=chave,
-                valor=str(valor) if not isinstance(valor, (dict, list)) else json.dumps(valor),
-                tipo=tipo,
-                categoria="geral"
+        else:
+            # Criar nova configuração (valores internos, sem passar por ConfiguracaoCriar)
+            db_config = Configuracao(chave=chave, valor=valor_str, tipo=tipo, categoria="geral")
+            db.add(db_config)
+
+        db.commit()
+        ConfiguracaoService.invalidar_cache(chave)
+        return db_config
+
+    @staticmethod
+    def definir_valores_bulk(db: Session, valores: Dict[str, Any]) -> None:
+        """
+        Define os valores de várias configurações de uma vez (upsert + um único commit).
+        Chaves inexistentes são criadas na categoria "geral", como em definir_valor.
+        """
+        if not valores:
+            return
+
+        linhas = []
+        for chave, valor in valores.items():
+            valor_str, tipo = _serializar_valor(valor)
+            linhas.append({"chave": chave, "valor": valor_str, "tipo": tipo, "categoria": "geral", "editavel": True})
+
+        insert = insert_com_conflito(db)
+        if insert is not None:
+            stmt = insert(Configuracao).values(linhas)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["chave"],
+                set_={"valor": stmt.excluded.valor, "atualizado_em": func.now()}
             )
-            return ConfiguracaoService.criar(db, nova_config)
+            db.execute(stmt)
         else:
-            raise ValueError(f"Configuração '{chave}' não encontrada")
+            # Demais bancos: atualiza/cria linha a linha, mas com um único commit
+            existentes = {
+                config.chave: config
+                for config in db.query(Configuracao).filter(Configuracao.chave.in_(list(valores))).all()
+            }
+            for linha in linhas:
+                if linha["chave"] in existentes:
+                    existentes[linha["chave"]].valor = linha["valor"]
+                else:
+                    db.add(Configuracao(**linha))
+
+        db.commit()
+        for chave in valores:
+            ConfiguracaoService.invalidar_cache(chave)
 
     @staticmethod
     def deletar(db: Session, chave: str) -> bool:
@@ -137,8 +447,28 @@ class ConfiguracaoService:
 
         db.delete(db_config)
         db.commit()
+        ConfiguracaoService.invalidar_cache(chave)
         return True
 
+    # Referências às gravações em segundo plano (evita que sejam coletadas antes de terminar)
+    _tarefas_pendentes: set = set()
+
+    @staticmethod
+    def _definir_valor_em_segundo_plano(chave: str, valor: Any) -> asyncio.Task:
+        """Executa definir_valor em uma thread, com sessão própria, sem bloquear quem chamou."""
+        def salvar():
+            from database import SessionLocal
+            db = SessionLocal()
+            try:
+                ConfiguracaoService.definir_valor(db, chave, valor)
+            finally:
+                db.close()
+
+        tarefa = asyncio.create_task(asyncio.to_thread(salvar))
+        ConfiguracaoService._tarefas_pendentes.add(tarefa)
+        tarefa.add_done_callback(ConfiguracaoService._tarefas_pendentes.discard)
+        return tarefa
+
     @staticmethod
     async def testar_conexao_openrouter(db: Session, api_key: Optional[str] = None) -> TestarConexaoResposta:
         """
@@ -156,54 +486,65 @@ class ConfiguracaoService:
             )
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://openrouter.ai/api/v1/models",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    timeout=10.0
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    modelos = []
-
-                    for modelo_data in data.get("data", []):
-                        modelo = ModeloLLM(
-                            id=modelo_data.get("id", ""),
-                            nome=modelo_data.get("name", modelo_data.get("id", "")),
-                            contexto=modelo_data.get("context_length"),
-                            preco_input=modelo_data.get("pricing", {}).get("prompt"),
-                            preco_output=modelo_data.get("pricing", {}).get("completion"),
-                            suporta_imagens="vision" in modelo_data.get("id", "").lower() or 
-                                          "vision" in modelo_data.get("name", "").lower() or
-                                          modelo_data.get("architecture", {}).get("modality") == "multimodal",
-                            suporta_ferramentas="tools" in modelo_data.get("supported_parameters", [])
-                        )
-                        modelos.append(modelo)
-
-                    # Salvar API key se a conexão foi bem-sucedida
-                    ConfiguracaoService.definir_valor(db, "openrouter_api_key", api_key)
-
-                    return TestarConexaoResposta(
-                        sucesso=True,
-                        mensagem=f"{len(modelos)} modelos disponíveis",
-                        modelos=modelos
-                    )
-                elif response.status_code == 401:
+            client = await ConfiguracaoService._get_client()
+            async with client.stream(
+                "GET",
+                "https://openrouter.ai/api/v1/models",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                },
+                timeout=10.0
+            ) as response:
+                # Em caso de erro, responde sem ler o corpo
+                if response.status_code == 401:
                     return TestarConexaoResposta(
                         sucesso=False,
                         mensagem="API Key inválida",
                         modelos=None
                     )
-                else:
+                elif response.status_code != 200:
                     return TestarConexaoResposta(
                         sucesso=False,
                         mensagem=f"Erro ao conectar: {response.status_code}",
                         modelos=None
                     )
+                conteudo = await response.aread()
+
+            # Parse direto dos bytes (orjson, quando disponível), sem decodificar para str
+            data = _json_loads(conteudo)
+            modelos = []
+
+            for modelo_data in data.get("data") or ():
+                modelo_id = modelo_data.get("id") or ""
+                nome = modelo_data.get("name") or modelo_id
+                pricing = modelo_data.get("pricing") or {}
+                architecture = modelo_data.get("architecture") or {}
+                suporta_imagens = (
+                    "vision" in modelo_id.lower()
+                    or "vision" in nome.lower()
+                    or architecture.get("modality") == "multimodal"
+                )
+                # Campos já normalizados acima: model_construct evita validar centenas de modelos
+                modelos.append(ModeloLLM.model_construct(
+                    id=str(modelo_id),
+                    nome=str(nome),
+                    contexto=_numero_ou_none(modelo_data.get("context_length"), int),
+                    preco_input=_numero_ou_none(pricing.get("prompt"), float),
+                    preco_output=_numero_ou_none(pricing.get("completion"), float),
+                    suporta_imagens=bool(suporta_imagens),
+                    suporta_ferramentas="tools" in (modelo_data.get("supported_parameters") or ())
+                ))
+
+            # Salvar API key se a conexão foi bem-sucedida (em segundo plano, sem atrasar a resposta)
+            if api_key != ConfiguracaoService.obter_valor(db, "openrouter_api_key"):
+                ConfiguracaoService._definir_valor_em_segundo_plano("openrouter_api_key", api_key)
+
+            return TestarConexaoResposta(
+                sucesso=True,
+                mensagem=f"{len(modelos)} modelos disponíveis",
+                modelos=modelos
+            )
 
         except httpx.TimeoutException:
             return TestarConexaoResposta(
@@ -221,366 +562,26 @@ class ConfiguracaoService:
     @staticmethod
     def inicializar_configuracoes_padrao(db: Session):
         """Inicializa configurações padrão do sistema."""
-        configuracoes_padrao = [
-            # Provedores LLM
-            {
-                "chave": "llm_provedor_padrao",
-                "valor": "openrouter",
-                "tipo": "string",
-                "descricao": "Provedor LLM padrão (openrouter, local, custom)",
-                "categoria": "llm",
-                "editavel": True
-            },
-            {
-                "chave": "llm_provedor_local_id",
-                "valor": None,
-                "tipo": "int",
-                "descricao": "ID do provedor local padrão",
-                "categoria": "llm",
-                "editavel": True
-            },
-            {
-                "chave": "llm_fallback_openrouter",
-                "valor": "true",
-                "tipo": "bool",
-                "descricao": "Usar OpenRouter como fallback quando provedor local falhar",
-                "categoria": "llm",
-                "editavel": True
-            },
-            # OpenRouter
-            {
-                "chave": "openrouter_api_key",
-                "valor": None,
-                "tipo": "string",
-                "descricao": "API Key do OpenRouter",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_modelo_padrao",
-                "valor": "google/gemini-2.0-flash-001",
-                "tipo": "string",
-                "descricao": "Modelo LLM padrão",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_temperatura",
-                "valor": "0.7",
-                "tipo": "float",
-                "descricao": "Temperatura para geração de respostas (0.0 a 2.0)",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_max_tokens",
-                "valor": "2000",
-                "tipo": "int",
-                "descricao": "Máximo de tokens na resposta",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_top_p",
-                "valor": "1.0",
-                "tipo": "float",
-                "descricao": "Top P para amostragem (0.0 a 1.0)",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_frequency_penalty",
-                "valor": "0.0",
-                "tipo": "float",
-                "descricao": "Penalidade de frequência (-2.0 a 2.0). Evita repetição de palavras.",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            {
-                "chave": "openrouter_presence_penalty",
-                "valor": "0.0",
-                "tipo": "float",
-                "descricao": "Penalidade de presença (-2.0 a 2.0). Incentiva novos tópicos.",
-                "categoria": "openrouter",
-                "editavel": True
-            },
-            # Agente
-            {
-                "chave": "agente_papel_padrao",
-                "valor": "assistente pessoal",
-                "tipo": "string",
-                "descricao": "Papel padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_objetivo_padrao",
-                "valor": "ajudar o usuário com suas dúvidas e tarefas",
-                "tipo": "string",
-                "descricao": "Objetivo padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_politicas_padrao",
-                "valor": "ser educado, respeitoso e prestativo",
-                "tipo": "string",
-                "descricao": "Políticas padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_tarefa_padrao",
-                "valor": "responder perguntas de forma clara e objetiva",
-                "tipo": "string",
-                "descricao": "Tarefa padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_objetivo_explicito_padrao",
-                "valor": "fornecer informações úteis e precisas",
-                "tipo": "string",
-                "descricao": "Objetivo explícito padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_publico_padrao",
-                "valor": "usuários em geral",
-                "tipo": "string",
-                "descricao": "Público-alvo padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_restricoes_padrao",
-                "valor": "responder em português brasileiro, ser conciso",
-                "tipo": "string",
-                "descricao": "Restrições padrão do agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            # Sistema
-            {
-                "chave": "sistema_diretorio_uploads",
-                "valor": "./uploads",
-                "tipo": "string",
-                "descricao": "Diretório para armazenar uploads",
-                "categoria": "geral",
-                "editavel": True
-            },
-            {
-                "chave": "sistema_max_tamanho_imagem_mb",
-                "valor": "10",
-                "tipo": "int",
-                "descricao": "Tamanho máximo de imagem em MB",
-                "categoria": "geral",
-                "editavel": True
-            },
-            {
-                "chave": "sistema_qualidade_jpeg",
-                "valor": "85",
-                "tipo": "int",
-                "descricao": "Qualidade JPEG ao salvar imagens (1-100)",
-                "categoria": "geral",
-                "editavel": True
-            },
-            # Agente - Limites
-            {
-                "chave": "agente_max_ferramentas",
-                "valor": "20",
-                "tipo": "int",
-                "descricao": "Máximo de ferramentas por agente",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_max_iteracoes_loop",
-                "valor": "10",
-                "tipo": "int",
-                "descricao": "Máximo de iterações do loop de ferramentas",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_historico_mensagens",
-                "valor": "10",
-                "tipo": "int",
-                "descricao": "Quantidade de mensagens anteriores no contexto",
-                "categoria": "agente",
-                "editavel": True
-            },
-            {
-                "chave": "agente_rag_resultados_padrao",
-                "valor": "3",
-                "tipo": "int",
-                "descricao": "Número de resultados padrão na busca RAG",
-                "categoria": "agente",
-                "editavel": True
-            },
-            # Sessão WhatsApp
-            {
-                "chave": "sessao_history_sync_delay",
-                "valor": "5",
-                "tipo": "int",
-                "descricao": "Segundos para ignorar mensagens antigas ao conectar (history sync)",
-                "categoria": "sessao",
-                "editavel": True
-            },
-            {
-                "chave": "sessao_diretorio",
-                "valor": "./sessoes",
-                "tipo": "string",
-                "descricao": "Diretório para armazenar dados das sessões WhatsApp",
-                "categoria": "sessao",
-                "editavel": True
-            },
-            # Ferramentas padrão do agente
-            {
-                "chave": "agente_ferramentas_padrao",
-                "valor": "[\"obter_data_hora_atual\", \"calcular\"]",
-                "tipo": "json",
-                "descricao": "Ferramentas padrão ao criar um agente (nomes separados por vírgula)",
-                "categoria": "agente",
-                "editavel": True
-            },
-            # Áudio - Transcrição
-            {
-                "chave": "audio_transcricao_habilitado",
-                "valor": "true",
-                "tipo": "bool",
-                "descricao": "Habilitar transcrição de áudio",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_provedor",
-                "valor": "groq",
-                "tipo": "string",
-                "descricao": "Provedor de transcrição (groq, openai)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_modelo",
-                "valor": "whisper-large-v3-turbo",
-                "tipo": "string",
-                "descricao": "Modelo de transcrição",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_idioma",
-                "valor": "pt",
-                "tipo": "string",
-                "descricao": "Idioma do áudio (ISO 639-1: pt, en, es, etc.)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_temperatura",
-                "valor": "0.0",
-                "tipo": "float",
-                "descricao": "Temperatura para transcrição (0.0 recomendado)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_prompt",
-                "valor": "",
-                "tipo": "string",
-                "descricao": "Prompt para guiar transcrição (nomes próprios, siglas)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_formato",
-                "valor": "text",
-                "tipo": "string",
-                "descricao": "Formato de resposta (text, json, verbose_json)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_transcricao_timeout",
-                "valor": "60",
-                "tipo": "int",
-                "descricao": "Timeout para transcrição em segundos",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "audio_responder_habilitado",
-                "valor": "true",
-                "tipo": "bool",
-                "descricao": "Responder mensagens de áudio automaticamente",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "groq_api_key",
-                "valor": "",
-                "tipo": "string",
-                "descricao": "Chave de API do Groq (para transcrição)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            {
-                "chave": "openai_api_key",
-                "valor": "",
-                "tipo": "string",
-                "descricao": "Chave de API da OpenAI (para transcrição e outros serviços)",
-                "categoria": "audio",
-                "editavel": True
-            },
-            # MCP Client
-            {
-                "chave": "mcp_max_clients_por_agente",
-                "valor": "5",
-                "tipo": "int",
-                "descricao": "Máximo de clientes MCP por agente",
-                "categoria": "mcp",
-                "editavel": True
-            },
-            {
-                "chave": "mcp_timeout_execucao",
-                "valor": "60",
-                "tipo": "int",
-                "descricao": "Timeout para execução de tools MCP em segundos",
-                "categoria": "mcp",
-                "editavel": True
-            },
-            # Ferramentas - Timeouts
-            {
-                "chave": "ferramenta_timeout_http",
-                "valor": "30",
-                "tipo": "int",
-                "descricao": "Timeout para requisições HTTP em segundos",
-                "categoria": "ferramenta",
-                "editavel": True
-            },
-            {
-                "chave": "ferramenta_timeout_download",
-                "valor": "60",
-                "tipo": "int",
-                "descricao": "Timeout para download de mídia (vídeo/documento) em segundos",
-                "categoria": "ferramenta",
-                "editavel": True
-            },
-            {
-                "chave": "ferramenta_timeout_teste",
-                "valor": "10",
-                "tipo": "int",
-                "descricao": "Timeout para testes de ferramenta no wizard em segundos",
-                "categoria": "ferramenta",
-                "editavel": True
-            },
+        insert = insert_com_conflito(db)
+        if insert is not None:
+            # Um único INSERT ... ON CONFLICT DO NOTHING (idempotente mesmo com boots concorrentes)
+            stmt = insert(Configuracao).values(_CONFIGURACOES_PADRAO_VALIDADAS)
+            db.execute(stmt.on_conflict_do_nothing(index_elements=["chave"]))
+            db.commit()
+            ConfiguracaoService.invalidar_cache()
+            return
+
+        # Demais bancos: uma consulta para as chaves existentes e um único commit para as faltantes
+        chaves = [config_data["chave"] for config_data in _CONFIGURACOES_PADRAO_VALIDADAS]
+        existentes = {
+            chave for (chave,) in db.query(Configuracao.chave).filter(Configuracao.chave.in_(chaves)).all()
+        }
+        faltantes = [
+            config_data for config_data in _CONFIGURACOES_PADRAO_VALIDADAS
+            if config_data["chave"] not in existentes
         ]
 
-        for config_data in configuracoes_padrao:
-            # Verificar se já existe
-            existe = ConfiguracaoService.obter_por_chave(db, config_data["chave"])
-            if not existe:
-                config = ConfiguracaoCriar(**config_data)
-                ConfiguracaoService.criar(db, config)
+        if faltantes:
+            db.bulk_insert_mappings(Configuracao, faltantes)
+            db.commit()
+            ConfiguracaoService.invalidar_cache()
@@ -1,7 +1,9 @@
 """
 Configuração do banco de dados SQLAlchemy.
 """
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -9,11 +11,26 @@ import os
 # URL do banco de dados
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./fluxi.db")
 
+# Pool para bancos servidor: as rotas síncronas rodam no threadpool do FastAPI (40 threads),
+# e com o padrão (5 + 10) requisições concorrentes ficavam esperando conexão livre
+if "sqlite" in DATABASE_URL:
+    _opcoes_pool = {}
+else:
+    _opcoes_pool = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_pre_ping": True,
+    }
+
 # Criar engine
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    echo=False
+    echo=False,
+    **_opcoes_pool,
+    # Cache de SQL compilado (padrão 500): cabe todas as queries distintas da aplicação,
+    # sem expulsar as do processamento de mensagens. Com echo=True o log mostra "[cached since ...]"
+    query_cache_size=1200
 )
 
 # Session local
@@ -37,5 +54,74 @@ def get_db():
 def criar_tabelas():
     """
     Cria todas as tabelas no banco de dados.
+    Índices novos em tabelas que já existiam também são criados
+    (o create_all só cria os índices junto com a tabela).
     """
+    if engine.dialect.name == "postgresql":
+        # Extensão dos índices trigram (busca por trecho de texto); precisa existir antes
+        # do create_all, que cria os índices junto com as tabelas
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception as e:
+            print(f"⚠️  Não foi possível habilitar a extensão pg_trgm: {e}")
     Base.metadata.create_all(bind=engine)
+    # Índices não dependem da ordem das tabelas (sorted_tables avisaria do ciclo agentes/sessoes)
+    for tabela in Base.metadata.tables.values():
+        for indice in tabela.indexes:
+            try:
+                indice.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                # Ex.: índice único sobre dados antigos duplicados; o sistema segue sem ele
+                print(f"⚠️  Não foi possível criar o índice {indice.name}: {e}")
+
+
+def extensao_pg_instalada(nome: str):
+    """
+    Condição para ddl_if: o DDL só é emitido se a extensão do PostgreSQL estiver instalada.
+    Sem ela (ex.: usuário sem permissão para criá-la), o índice é pulado em vez de
+    derrubar o create_all inteiro.
+    """
+    def condicao(ddl, target, bind, **kw):
+        if not isinstance(bind, Connection):
+            # Só compilando o DDL (sem conexão real): emite normalmente
+            return True
+        return bind.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = :nome"), {"nome": nome}
+        ).first() is not None
+    return condicao
+
+
+def insert_com_conflito(db):
+    """Retorna o insert com suporte a ON CONFLICT do dialeto atual (ou None se não houver)."""
+    dialeto = db.get_bind().dialect.name
+    if dialeto == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialeto == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+@contextmanager
+def contar_queries(conexao=None):
+    """
+    Registra os SQLs executados dentro do bloco (por padrão, em todo o engine).
+    Útil para conferir quantas queries uma operação faz e flagrar N+1:
+    
+        with contar_queries() as queries:
+            ProvedorLLMService.listar_todos(db)
+        assert len(queries) <= 3
+    """
+    alvo = conexao if conexao is not None else engine
+    queries = []
+    
+    def _antes_de_executar(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+    
+    event.listen(alvo, "before_cursor_execute", _antes_de_executar)
+    try:
+        yield queries
+    finally:
+        event.remove(alvo, "before_cursor_execute", _antes_de_executar)
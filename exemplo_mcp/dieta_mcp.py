@@ -17,9 +17,16 @@ from datetime import datetime, timedelta
 from typing import Optional
 from fastmcp import FastMCP
 
+# Dependência opcional (pip install orjson)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Configurar logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     datefmt='%H:%M:%S'
 )
@@ -42,25 +49,162 @@ mcp = FastMCP(
 # Arquivo JSON para persistência
 DATA_FILE = os.path.join(os.path.dirname(__file__), "dieta_data.json")
 
+# fsync a cada gravação (mais durável, porém mais lento); desligado por padrão
+FSYNC_AO_SALVAR = os.getenv("DIETA_MCP_FSYNC", "false").lower() in ("1", "true", "sim", "yes")
+
+
+# Separadores das respostas das ferramentas (montados uma vez)
+_SEP = "=" * 40
+_SEP_NL = "\n" + _SEP
+
+
+# Cache em memória dos dados, revalidado pelo mtime/tamanho do arquivo.
+# "por_data"/"cal_por_data"/"por_id" indexam as refeições do dict em "indice_de".
+_CACHE = {
+    "data": None, "mtime": None,
+    "indice_de": None, "por_data": None, "cal_por_data": None, "por_id": None, "proximo_id": 1
+}
+
+
+def _assinatura_arquivo() -> Optional[tuple]:
+    """Retorna (mtime_ns, tamanho) do arquivo de dados, ou None se não existir."""
+    try:
+        st = os.stat(DATA_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 
 def carregar_dados() -> dict:
-    """Carrega dados do arquivo JSON."""
-    logger.debug(f"Carregando dados de {DATA_FILE}")
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            dados = json.load(f)
-            logger.debug(f"Dados carregados: {len(dados.get('refeicoes', []))} refeições")
-            return dados
-    logger.debug("Arquivo não existe, retornando dados vazios")
-    return {"refeicoes": [], "meta_diaria": 2000}
+    """
+    Carrega dados do arquivo JSON.
+    Só relê o arquivo quando ele muda; o dict retornado é o do cache, então
+    alterações devem ser persistidas com salvar_dados().
+    """
+    assinatura = _assinatura_arquivo()
+    if assinatura is None:
+        logger.debug("Arquivo não existe, retornando dados vazios")
+        return {"refeicoes": [], "meta_diaria": 2000}
+
+    if _CACHE["data"] is not None and _CACHE["mtime"] == assinatura:
+        return _CACHE["data"]
+
+    logger.debug("Carregando dados de %s", DATA_FILE)
+    with open(DATA_FILE, "rb", buffering=0) as f:
+        conteudo = f.read()
+    dados = orjson.loads(conteudo) if ORJSON_AVAILABLE else json.loads(conteudo)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Dados carregados: %d refeições", len(dados.get("refeicoes", [])))
+    _CACHE["data"] = dados
+    _CACHE["mtime"] = assinatura
+    return dados
+
+
+def _indice_por_data(dados: dict) -> tuple:
+    """
+    Retorna (por_data, cal_por_data) das refeições de `dados`:
+    data -> lista de refeições e data -> total de calorias.
+    O índice é montado em uma única passada e reaproveitado enquanto `dados` for o mesmo.
+    """
+    if _CACHE["indice_de"] is not dados:
+        por_data = {}
+        cal_por_data = {}
+        por_id = {}
+        for r in dados["refeicoes"]:
+            por_data.setdefault(r["data"], []).append(r)
+            cal_por_data[r["data"]] = cal_por_data.get(r["data"], 0) + r["calorias"]
+            por_id.setdefault(r["id"], r)
+        _CACHE["indice_de"] = dados
+        _CACHE["por_data"] = por_data
+        _CACHE["cal_por_data"] = cal_por_data
+        _CACHE["por_id"] = por_id
+        _CACHE["proximo_id"] = max(por_id, default=0) + 1
+    return _CACHE["por_data"], _CACHE["cal_por_data"]
+
+
+def _refeicao_por_id(dados: dict, refeicao_id: int) -> Optional[dict]:
+    """Busca uma refeição pelo ID usando o índice."""
+    _indice_por_data(dados)
+    return _CACHE["por_id"].get(refeicao_id)
+
+
+def _proximo_id(dados: dict) -> int:
+    """Próximo ID livre (maior ID + 1, evitando repetir IDs após remoções)."""
+    _indice_por_data(dados)
+    return _CACHE["proximo_id"]
+
+
+def _indexar_refeicao(dados: dict, refeicao: dict):
+    """Inclui uma refeição recém-registrada no índice (se ele for de `dados`)."""
+    if _CACHE["indice_de"] is dados:
+        _CACHE["por_data"].setdefault(refeicao["data"], []).append(refeicao)
+        _CACHE["cal_por_data"][refeicao["data"]] = _CACHE["cal_por_data"].get(refeicao["data"], 0) + refeicao["calorias"]
+        _CACHE["por_id"].setdefault(refeicao["id"], refeicao)
+        _CACHE["proximo_id"] = max(_CACHE["proximo_id"], refeicao["id"] + 1)
+
+
+def _desindexar_refeicao(dados: dict, refeicao: dict):
+    """Remove uma refeição do índice (se ele for de `dados`)."""
+    if _CACHE["indice_de"] is dados:
+        if _CACHE["por_id"].get(refeicao["id"]) is refeicao:
+            del _CACHE["por_id"][refeicao["id"]]
+        do_dia = _CACHE["por_data"].get(refeicao["data"], [])
+        if refeicao in do_dia:
+            do_dia.remove(refeicao)
+            _CACHE["cal_por_data"][refeicao["data"]] -= refeicao["calorias"]
 
 
 def salvar_dados(dados: dict):
-    """Salva dados no arquivo JSON."""
-    logger.debug(f"Salvando dados em {DATA_FILE}")
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(dados, f, ensure_ascii=False, indent=2)
-    logger.info(f"Dados salvos: {len(dados.get('refeicoes', []))} refeições")
+    """Salva dados no arquivo JSON (e atualiza o cache com o que foi gravado)."""
+    logger.debug("Salvando dados em %s", DATA_FILE)
+    if ORJSON_AVAILABLE:
+        payload = orjson.dumps(dados, option=orjson.OPT_INDENT_2)
+    else:
+        payload = json.dumps(dados, ensure_ascii=False, indent=2).encode("utf-8")
+    
+    # Grava em arquivo temporário e troca de forma atômica (sem arquivo corrompido em caso de falha)
+    tmp_file = DATA_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(payload)
+        if FSYNC_AO_SALVAR:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_file, DATA_FILE)
+    _CACHE["data"] = dados
+    _CACHE["mtime"] = _assinatura_arquivo()
+    logger.info("Dados salvos: %d refeições", len(dados.get("refeicoes", [])))
+
+
+def _hoje_str() -> str:
+    """Data de hoje no formato usado nos registros (YYYY-MM-DD)."""
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _get_meta() -> int:
+    """Meta diária de calorias (lida do cache)."""
+    return carregar_dados().get("meta_diaria", 2000)
+
+
+def _get_refeicoes_por_data(data: str) -> tuple:
+    """Refeições de uma data (YYYY-MM-DD), direto do índice."""
+    por_data, _ = _indice_por_data(carregar_dados())
+    return por_data.get(data, ())
+
+
+def _get_calorias_por_data(data: str) -> int:
+    """Total de calorias de uma data (YYYY-MM-DD), direto do índice."""
+    _, cal_por_data = _indice_por_data(carregar_dados())
+    return cal_por_data.get(data, 0)
+
+
+def _formatar_refeicao(r: dict) -> str:
+    """Bloco de texto de uma refeição nas listagens (uma única string)."""
+    obs = f"\n  Obs: {r['observacoes']}" if r.get("observacoes") else ""
+    return (
+        f"\n[{r['hora']}] {r['tipo'].upper()} (ID: {r['id']})"
+        f"\n  {r['alimentos']}"
+        f"\n  {r['calorias']} kcal{obs}"
+    )
 
 
 # ============== TOOLS ==============
@@ -84,13 +228,14 @@ def registrar_refeicao(
     Returns:
         Confirmação do registro
     """
-    logger.info(f"[TOOL] registrar_refeicao chamada: {tipo_refeicao}, {alimentos}, {calorias} kcal")
+    logger.info("[TOOL] registrar_refeicao chamada: %s, %s, %s kcal", tipo_refeicao, alimentos, calorias)
     dados = carregar_dados()
     
+    agora = datetime.now()
     refeicao = {
-        "id": len(dados["refeicoes"]) + 1,
-        "data": datetime.now().strftime("%Y-%m-%d"),
-        "hora": datetime.now().strftime("%H:%M"),
+        "id": _proximo_id(dados),
+        "data": agora.strftime("%Y-%m-%d"),
+        "hora": agora.strftime("%H:%M"),
         "tipo": tipo_refeicao.lower().replace(" ", "_"),
         "alimentos": alimentos,
         "calorias": calorias,
@@ -98,10 +243,11 @@ def registrar_refeicao(
     }
     
     dados["refeicoes"].append(refeicao)
+    _indexar_refeicao(dados, refeicao)
     salvar_dados(dados)
     
     resultado = f"Refeição registrada! ID: {refeicao['id']} | {tipo_refeicao}: {alimentos} ({calorias} kcal)"
-    logger.info(f"[TOOL] registrar_refeicao resultado: {resultado}")
+    logger.info("[TOOL] registrar_refeicao resultado: %s", resultado)
     return resultado
 
 
@@ -114,26 +260,19 @@ def listar_refeicoes_hoje() -> str:
         Lista de refeições do dia com total de calorias
     """
     logger.info("[TOOL] listar_refeicoes_hoje chamada")
-    dados = carregar_dados()
-    hoje = datetime.now().strftime("%Y-%m-%d")
-    
-    refeicoes_hoje = [r for r in dados["refeicoes"] if r["data"] == hoje]
+    refeicoes_hoje = _get_refeicoes_por_data(_hoje_str())
     
     if not refeicoes_hoje:
         return "Nenhuma refeição registrada hoje."
     
-    resultado = ["REFEIÇÕES DE HOJE", "=" * 40]
+    resultado = ["REFEIÇÕES DE HOJE", _SEP]
     total_calorias = 0
     
     for r in refeicoes_hoje:
-        resultado.append(f"\n[{r['hora']}] {r['tipo'].upper()} (ID: {r['id']})")
-        resultado.append(f"  {r['alimentos']}")
-        resultado.append(f"  {r['calorias']} kcal")
-        if r.get("observacoes"):
-            resultado.append(f"  Obs: {r['observacoes']}")
+        resultado.append(_formatar_refeicao(r))
         total_calorias += r["calorias"]
     
-    resultado.append("\n" + "=" * 40)
+    resultado.append(_SEP_NL)
     resultado.append(f"TOTAL DO DIA: {total_calorias} kcal")
     
     return "\n".join(resultado)
@@ -150,26 +289,20 @@ def listar_refeicoes_data(data: str) -> str:
     Returns:
         Lista de refeições da data especificada
     """
-    logger.info(f"[TOOL] listar_refeicoes_data chamada: {data}")
-    dados = carregar_dados()
-    
-    refeicoes_data = [r for r in dados["refeicoes"] if r["data"] == data]
+    logger.info("[TOOL] listar_refeicoes_data chamada: %s", data)
+    refeicoes_data = _get_refeicoes_por_data(data)
     
     if not refeicoes_data:
         return f"Nenhuma refeição registrada em {data}."
     
-    resultado = [f"REFEIÇÕES DE {data}", "=" * 40]
+    resultado = [f"REFEIÇÕES DE {data}", _SEP]
     total_calorias = 0
     
     for r in refeicoes_data:
-        resultado.append(f"\n[{r['hora']}] {r['tipo'].upper()} (ID: {r['id']})")
-        resultado.append(f"  {r['alimentos']}")
-        resultado.append(f"  {r['calorias']} kcal")
-        if r.get("observacoes"):
-            resultado.append(f"  Obs: {r['observacoes']}")
+        resultado.append(_formatar_refeicao(r))
         total_calorias += r["calorias"]
     
-    resultado.append("\n" + "=" * 40)
+    resultado.append(_SEP_NL)
     resultado.append(f"TOTAL: {total_calorias} kcal")
     
     return "\n".join(resultado)
@@ -184,26 +317,24 @@ def resumo_semanal() -> str:
         Resumo semanal com média diária
     """
     logger.info("[TOOL] resumo_semanal chamada")
-    dados = carregar_dados()
     hoje = datetime.now()
     
-    resultado = ["RESUMO SEMANAL", "=" * 40]
-    total_semana = 0
-    dias_com_registro = 0
-    
+    # Janela de 7 dias (data -> calorias), montada uma vez a partir dos totais diários
+    semana = {}
     for i in range(7):
         data = (hoje - timedelta(days=i)).strftime("%Y-%m-%d")
-        refeicoes_dia = [r for r in dados["refeicoes"] if r["data"] == data]
-        calorias_dia = sum(r["calorias"] for r in refeicoes_dia)
-        
-        if calorias_dia > 0:
-            dias_com_registro += 1
-            total_semana += calorias_dia
-            resultado.append(f"{data}: {calorias_dia} kcal")
-        else:
-            resultado.append(f"{data}: -- sem registro --")
-    
-    resultado.append("\n" + "=" * 40)
+        semana[data] = _get_calorias_por_data(data)
+    
+    total_semana = sum(semana.values())
+    dias_com_registro = sum(1 for calorias_dia in semana.values() if calorias_dia > 0)
+    
+    resultado = ["RESUMO SEMANAL", _SEP]
+    resultado.extend(
+        f"{data}: {calorias_dia} kcal" if calorias_dia > 0 else f"{data}: -- sem registro --"
+        for data, calorias_dia in semana.items()
+    )
+    
+    resultado.append(_SEP_NL)
     resultado.append(f"TOTAL SEMANA: {total_semana} kcal")
     
     if dias_com_registro > 0:
@@ -224,18 +355,16 @@ def deletar_refeicao(refeicao_id: int) -> str:
     Returns:
         Confirmação da remoção
     """
-    logger.info(f"[TOOL] deletar_refeicao chamada: ID {refeicao_id}")
+    logger.info("[TOOL] deletar_refeicao chamada: ID %s", refeicao_id)
     dados = carregar_dados()
     
-    refeicao_encontrada = None
-    for i, r in enumerate(dados["refeicoes"]):
-        if r["id"] == refeicao_id:
-            refeicao_encontrada = dados["refeicoes"].pop(i)
-            break
-    
+    refeicao_encontrada = _refeicao_por_id(dados, refeicao_id)
     if not refeicao_encontrada:
         return f"Refeição com ID {refeicao_id} não encontrada."
     
+    dados["refeicoes"].remove(refeicao_encontrada)
+    _desindexar_refeicao(dados, refeicao_encontrada)
+    
     salvar_dados(dados)
     
     return f"Refeição removida: {refeicao_encontrada['tipo']} - {refeicao_encontrada['alimentos']}"
@@ -252,7 +381,7 @@ def definir_meta_calorica(meta: int) -> str:
     Returns:
         Confirmação da meta definida
     """
-    logger.info(f"[TOOL] definir_meta_calorica chamada: {meta} kcal")
+    logger.info("[TOOL] definir_meta_calorica chamada: %s kcal", meta)
     dados = carregar_dados()
     dados["meta_diaria"] = meta
     salvar_dados(dados)
@@ -269,19 +398,15 @@ def verificar_meta_hoje() -> str:
         Status do consumo vs meta
     """
     logger.info("[TOOL] verificar_meta_hoje chamada")
-    dados = carregar_dados()
-    hoje = datetime.now().strftime("%Y-%m-%d")
-    
-    meta = dados.get("meta_diaria", 2000)
-    refeicoes_hoje = [r for r in dados["refeicoes"] if r["data"] == hoje]
-    consumido = sum(r["calorias"] for r in refeicoes_hoje)
+    meta = _get_meta()
+    consumido = _get_calorias_por_data(_hoje_str())
     
     restante = meta - consumido
     percentual = (consumido / meta) * 100 if meta > 0 else 0
     
     resultado = [
         "STATUS DO DIA",
-        "=" * 40,
+        _SEP,
         f"Meta: {meta} kcal",
         f"Consumido: {consumido} kcal ({percentual:.1f}%)",
     ]
@@ -291,7 +416,7 @@ def verificar_meta_hoje() -> str:
     else:
         resultado.append(f"Excedido: {abs(restante)} kcal")
     
-    resultado.append("=" * 40)
+    resultado.append(_SEP)
     
     if percentual < 50:
         resultado.append("Ainda tem bastante margem hoje!")
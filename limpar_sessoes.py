@@ -4,10 +4,43 @@ Use quando houver problemas de reconexão.
 """
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from database import SessionLocal, criar_tabelas
 from sessao.sessao_model import Sessao
 from config.config_service import ConfiguracaoService
 
+def _arquivos_existentes(sessao_dir: str) -> set:
+    """Lista (com uma única leitura do diretório) os nomes de arquivos de sessão."""
+    try:
+        with os.scandir(sessao_dir) as entradas:
+            return {entrada.name for entrada in entradas if entrada.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def _remover_arquivo(db_path: Path) -> str:
+    """Remove um arquivo de sessão e devolve a linha de log correspondente."""
+    try:
+        db_path.unlink(missing_ok=True)
+        return f"   ✅ Arquivo removido: {db_path}"
+    except Exception as e:
+        return f"   ❌ Erro ao remover arquivo: {e}"
+
+
+def _remover_arquivos(caminhos: list):
+    """Remove os arquivos de sessão (chamado depois do commit no banco).
+    
+    As remoções rodam em paralelo: em diretórios de rede (NFS) o custo é
+    dominado pela latência de metadados do sistema de arquivos.
+    """
+    if not caminhos:
+        return
+    with ThreadPoolExecutor(max_workers=min(8, len(caminhos))) as executor:
+        for linha in executor.map(_remover_arquivo, caminhos):
+            print(linha)
+
+
 def limpar_sessoes():
     """Limpa todas as sessões desconectadas e seus arquivos."""
     print("🧹 Limpando sessões desconectadas...\n")
@@ -29,6 +62,10 @@ def limpar_sessoes():
         print(f"📊 Total de sessões no banco: {len(sessoes)}")
         print(f"📁 Diretório de sessões: {sessao_dir}\n")
         
+        base = Path(sessao_dir)
+        existentes = _arquivos_existentes(sessao_dir)
+        remover = []
+        
         for sessao in sessoes:
             print(f"\n{'='*60}")
             print(f"📱 Sessão: {sessao.nome} (ID: {sessao.id})")
@@ -36,35 +73,36 @@ def limpar_sessoes():
             print(f"   Telefone: {sessao.telefone or 'N/A'}")
             
             # Verificar arquivo de sessão
-            db_path = f"{sessao_dir}/sessao_{sessao.id}.db"
-            arquivo_existe = os.path.exists(db_path)
+            nome_arquivo = f"sessao_{sessao.id}.db"
+            db_path = base / nome_arquivo
+            arquivo_existe = nome_arquivo in existentes
             print(f"   Arquivo: {'✅ Existe' if arquivo_existe else '❌ Não existe'}")
             
             # Se está desconectado ou com erro, limpar
             if sessao.status in ["desconectado", "erro"]:
                 print(f"\n   🔧 Limpando sessão desconectada...")
                 
-                # Limpar QR Code do banco
-                sessao.qr_code = None
-                sessao.qr_code_gerado_em = None
-                sessao.status = "desconectado"
-                
-                # Remover arquivo de sessão
+                # Arquivo de sessão é removido depois do commit
                 if arquivo_existe:
-                    try:
-                        os.remove(db_path)
-                        print(f"   ✅ Arquivo removido: {db_path}")
-                    except Exception as e:
-                        print(f"   ❌ Erro ao remover arquivo: {e}")
+                    remover.append(db_path)
                 
                 print(f"   ✅ Sessão limpa no banco de dados")
             elif sessao.status == "conectado":
                 print(f"   ⚠️  Sessão marcada como conectada, mas pode estar desconectada.")
                 print(f"   💡 Dica: Tente desconectar pela interface antes de limpar.")
         
+        # Limpar QR Code das sessões desconectadas/com erro (um único UPDATE)
+        db.query(Sessao).filter(Sessao.status.in_(["desconectado", "erro"])).update(
+            {"qr_code": None, "qr_code_gerado_em": None, "status": "desconectado"},
+            synchronize_session=False
+        )
+        
         # Commit das alterações
         db.commit()
         
+        # Remover arquivos só depois que o banco foi atualizado
+        _remover_arquivos(remover)
+        
         print(f"\n{'='*60}")
         print("✅ Limpeza concluída!")
         print("\n💡 Próximos passos:")
@@ -97,25 +135,25 @@ def limpar_todas_sessoes():
         sessao_dir = ConfiguracaoService.obter_valor(db, "sessao_diretorio", "./sessoes")
         
         sessoes = db.query(Sessao).all()
+        base = Path(sessao_dir)
+        existentes = _arquivos_existentes(sessao_dir)
+        remover = []
         
         for sessao in sessoes:
             print(f"🔧 Limpando sessão: {sessao.nome} (ID: {sessao.id})")
             
-            # Limpar QR Code do banco
-            sessao.qr_code = None
-            sessao.qr_code_gerado_em = None
-            sessao.status = "desconectado"
-            
-            # Remover arquivo de sessão
-            db_path = f"{sessao_dir}/sessao_{sessao.id}.db"
-            if os.path.exists(db_path):
-                try:
-                    os.remove(db_path)
-                    print(f"   ✅ Arquivo removido: {db_path}")
-                except Exception as e:
-                    print(f"   ❌ Erro ao remover arquivo: {e}")
+            # Arquivo de sessão é removido depois do commit
+            nome_arquivo = f"sessao_{sessao.id}.db"
+            if nome_arquivo in existentes:
+                remover.append(base / nome_arquivo)
         
+        # Limpar QR Code de todas as sessões (um único UPDATE)
+        db.query(Sessao).update(
+            {"qr_code": None, "qr_code_gerado_em": None, "status": "desconectado"},
+            synchronize_session=False
+        )
         db.commit()
+        _remover_arquivos(remover)
         print("\n✅ Todas as sessões foram limpas!")
         
     except Exception as e:
@@ -2,18 +2,74 @@
 Serviço de integração LLM que gerencia a escolha do provedor correto.
 """
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+import asyncio
 import httpx
 import json
 import time
+import weakref
+
+# Dependência opcional (pip install orjson)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from config.config_service import ConfiguracaoService
 from llm_providers.llm_providers_service import ProvedorLLMService
 from llm_providers.llm_providers_schema import RequisicaoLLM, ConfiguracaoProvedor
 
 
+# Prefixos de modelos que só existem no OpenRouter (tupla: str.startswith testa todos de uma vez)
+PREFIXOS_MODELOS_OPENROUTER = (
+    "google/gemini", "anthropic/claude", "openai/gpt",
+    "mistralai/mistral", "cohere/command"
+)
+
+
 class LLMIntegrationService:
     """Serviço para integrar diferentes provedores LLM de forma transparente."""
 
+    # Cache do provedor escolhido: (modelo, agente_id) -> (expira_em, provedor_info)
+    _cache_provedor: Dict[Tuple[str, Optional[int]], Tuple[float, Dict[str, Any]]] = {}
+    CACHE_PROVEDOR_TTL_SEGUNDOS = 30
+
+    # Cache da API key do OpenRouter: (expira_em, api_key)
+    _cache_api_key: Optional[Tuple[float, Optional[str]]] = None
+    CACHE_API_KEY_TTL_SEGUNDOS = 60
+
+    # Um cliente HTTP por event loop (conexões keep-alive com o OpenRouter): as respostas
+    # automáticas rodam na thread de cada mensagem, com loop próprio, e as conexões do
+    # pool ficam presas ao loop que as abriu
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """Obtém (criando sob demanda) o cliente HTTP do event loop atual."""
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=60.0,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+            )
+            cls._clients[loop] = client
+        return client
+
+    @classmethod
+    async def fechar_client(cls):
+        """Fecha o cliente HTTP do event loop atual (no shutdown e ao fim de cada mensagem)."""
+        client = cls._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    @staticmethod
+    def invalidar_cache():
+        """Descarta as decisões de provedor em cache (chamado quando a configuração muda)."""
+        LLMIntegrationService._cache_provedor.clear()
+        LLMIntegrationService._cache_api_key = None
+
     @staticmethod
     async def processar_mensagem_com_llm(
         db: Session,
@@ -26,7 +82,8 @@ class LLMIntegrationService:
         frequency_penalty: float = 0.0,
         presence_penalty: float = 0.0,
         tools: Optional[List[Dict]] = None,
-        stream: bool = False
+        stream: bool = False,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Processa mensagem usando o provedor LLM apropriado.
@@ -43,6 +100,7 @@ class LLMIntegrationService:
             presence_penalty: Penalidade de presença (-2.0 a 2.0)
             tools: Lista de ferramentas disponíveis
             stream: Se deve usar streaming
+            ao_receber_delta: Callback chamado com cada trecho de texto (quando stream=True)
             
         Returns:
             Dict com resposta do LLM
@@ -60,13 +118,14 @@ class LLMIntegrationService:
                 # Usar provedor local via llm_providers
                 resultado = await LLMIntegrationService._usar_provedor_local(
                     db, provedor_info, messages, modelo, temperatura, 
-                    max_tokens, top_p, frequency_penalty, presence_penalty, tools, stream
+                    max_tokens, top_p, frequency_penalty, presence_penalty, tools, stream,
+                    ao_receber_delta
                 )
             elif provedor_info["tipo"] == "openrouter":
                 # Usar OpenRouter diretamente
                 resultado = await LLMIntegrationService._usar_openrouter(
                     db, messages, modelo, temperatura, max_tokens, top_p, 
-                    frequency_penalty, presence_penalty, tools, stream
+                    frequency_penalty, presence_penalty, tools, stream, ao_receber_delta
                 )
             else:
                 raise ValueError(f"Tipo de provedor não suportado: {provedor_info['tipo']}")
@@ -80,19 +139,15 @@ class LLMIntegrationService:
             
         except Exception as e:
             # 4. Fallback para OpenRouter se configurado E disponível
-            fallback_habilitado = ConfiguracaoService.obter_valor(
-                db, "llm_fallback_openrouter", True
-            )
-            openrouter_disponivel = LLMIntegrationService._openrouter_disponivel(db)
-            
-            if (provedor_info["tipo"] != "openrouter" and 
-                fallback_habilitado and 
-                openrouter_disponivel):
+            # (checagem barata primeiro: se o principal já era o OpenRouter, não há fallback)
+            if (provedor_info["tipo"] != "openrouter" and
+                ConfiguracaoService.obter_valor(db, "llm_fallback_openrouter", True) and
+                LLMIntegrationService._openrouter_disponivel(db)):
                 print(f"⚠️ Erro com provedor {provedor_info['tipo']}, tentando OpenRouter: {e}")
                 try:
                     resultado = await LLMIntegrationService._usar_openrouter(
                         db, messages, modelo, temperatura, max_tokens, top_p,
-                        frequency_penalty, presence_penalty, tools, stream
+                        frequency_penalty, presence_penalty, tools, stream, ao_receber_delta
                     )
                     resultado["provedor_usado"] = "openrouter_fallback"
                     resultado["erro_original"] = str(e)
@@ -109,7 +164,31 @@ class LLMIntegrationService:
         modelo: str, 
         agente_id: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Determina qual provedor usar baseado no modelo e configurações."""
+        """
+        Determina qual provedor usar baseado no modelo e configurações.
+        A decisão fica em cache por alguns segundos para mensagens seguidas da mesma conversa.
+        """
+        chave = (modelo, agente_id)
+        item = LLMIntegrationService._cache_provedor.get(chave)
+        if item is not None and item[0] > time.monotonic():
+            return dict(item[1])
+        
+        provedor_info = await LLMIntegrationService._resolver_provedor(db, modelo, agente_id)
+        # O objeto ORM do provedor pertence à sessão atual; guardar apenas dados simples
+        provedor_info.pop("provedor", None)
+        LLMIntegrationService._cache_provedor[chave] = (
+            time.monotonic() + LLMIntegrationService.CACHE_PROVEDOR_TTL_SEGUNDOS,
+            provedor_info
+        )
+        return dict(provedor_info)
+
+    @staticmethod
+    async def _resolver_provedor(
+        db: Session, 
+        modelo: str, 
+        agente_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Escolhe o provedor consultando configurações e provedores ativos (sem cache)."""
         
         # 1. Verificar configuração global primeiro
         provedor_padrao = ConfiguracaoService.obter_valor(db, "llm_provedor_padrao", "auto")
@@ -145,12 +224,7 @@ class LLMIntegrationService:
             }
         
         # 4.2 Verificar se modelo é específico do OpenRouter (Gemini, Claude, etc.)
-        modelos_openrouter = [
-            "google/gemini", "anthropic/claude", "openai/gpt", 
-            "mistralai/mistral", "cohere/command"
-        ]
-        
-        if any(modelo.startswith(prefix) for prefix in modelos_openrouter):
+        if modelo.startswith(PREFIXOS_MODELOS_OPENROUTER):
             if LLMIntegrationService._openrouter_disponivel(db):
                 return {"tipo": "openrouter", "motivo": "modelo_especifico_openrouter"}
             else:
@@ -172,8 +246,22 @@ class LLMIntegrationService:
     @staticmethod
     def _openrouter_disponivel(db: Session) -> bool:
         """Verifica se o OpenRouter está disponível (tem chave configurada)."""
-        api_key = ConfiguracaoService.obter_valor(db, "openrouter_api_key")
+        api_key = LLMIntegrationService._obter_openrouter_api_key(db)
         return api_key is not None and api_key.strip() != ""
+
+    @staticmethod
+    def _obter_openrouter_api_key(db: Session) -> Optional[str]:
+        """Obtém a API key do OpenRouter, com cache curto (invalidado quando a chave é alterada)."""
+        item = LLMIntegrationService._cache_api_key
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        
+        api_key = ConfiguracaoService.obter_valor(db, "openrouter_api_key")
+        LLMIntegrationService._cache_api_key = (
+            time.monotonic() + LLMIntegrationService.CACHE_API_KEY_TTL_SEGUNDOS,
+            api_key
+        )
+        return api_key
     
     @staticmethod
     async def _usar_provedor_local(
@@ -187,7 +275,8 @@ class LLMIntegrationService:
         frequency_penalty: float,
         presence_penalty: float,
         tools: Optional[List[Dict]],
-        stream: bool
+        stream: bool,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """Usa um provedor local via llm_providers."""
         
@@ -212,7 +301,7 @@ class LLMIntegrationService:
         
         # Enviar requisição
         resposta = await ProvedorLLMService.enviar_requisicao(
-            db, provedor_info["id"], requisicao
+            db, provedor_info["id"], requisicao, ao_receber_delta
         )
         
         # Log de debug
@@ -242,10 +331,17 @@ class LLMIntegrationService:
         frequency_penalty: float,
         presence_penalty: float,
         tools: Optional[List[Dict]],
-        stream: bool
+        stream: bool,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
-        """Usa OpenRouter diretamente."""
-        
+        """
+        Usa OpenRouter diretamente.
+        Com stream=True a resposta (SSE) é lida conforme chega e cada trecho de texto é
+        repassado a ao_receber_delta; o retorno continua sendo o dict completo.
+        """
+        api_key = LLMIntegrationService._obter_openrouter_api_key(db)
+        if not api_key or not api_key.strip():
+            raise ValueError("API Key do OpenRouter não configurada")
 
         # Preparar payload
         payload = {
@@ -263,39 +359,124 @@ class LLMIntegrationService:
             payload["tools"] = tools
             print(f"🔧 [OPENROUTER] Enviando {len(tools)} tools para API")
         
+        # Serializar o payload uma vez, direto para bytes (históricos longos pesam no json padrão)
+        if ORJSON_AVAILABLE:
+            corpo = orjson.dumps(payload)
+        else:
+            corpo = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        
         # Fazer requisição
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        client = await LLMIntegrationService._get_client()
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        if stream:
+            async with client.stream(
+                "POST",
                 "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=payload,
+                headers=headers,
+                content=corpo,
                 timeout=60.0
-            )
-            
-            if response.status_code != 200:
-                raise ValueError(f"Erro na API OpenRouter: {response.status_code} - {response.text}")
-            
-            data = response.json()
-            
-            # Extrair resposta
-            choice = data.get("choices", [{}])[0]
-            message_response = choice.get("message", {})
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise ValueError(f"Erro na API OpenRouter: {response.status_code} - {response.text}")
+                return await LLMIntegrationService._ler_stream_openrouter(response, modelo, ao_receber_delta)
+        
+        response = await client.post(
+            "https://openrouter.ai/api/v1/chat/completions",
+            headers=headers,
+            content=corpo,
+            timeout=60.0
+        )
+        
+        if response.status_code != 200:
+            raise ValueError(f"Erro na API OpenRouter: {response.status_code} - {response.text}")
+        
+        data = response.json()
+        
+        # Extrair resposta
+        choice = data.get("choices", [{}])[0]
+        message_response = choice.get("message", {})
+        
+        # Extrair uso de tokens
+        usage = data.get("usage", {})
+        
+        return {
+            "conteudo": message_response.get("content", ""),
+            "modelo": modelo,
+            "tokens_input": usage.get("prompt_tokens", 0),
+            "tokens_output": usage.get("completion_tokens", 0),
+            "tool_calls": message_response.get("tool_calls"),
+            "finish_reason": choice.get("finish_reason"),
+            "finalizado": True
+        }
+
+    @staticmethod
+    async def _ler_stream_openrouter(
+        response: httpx.Response,
+        modelo: str,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """Consome a resposta SSE do OpenRouter, juntando texto e tool_calls parciais."""
+        partes_conteudo = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        finish_reason = None
+        usage = {}
+        
+        async for linha in response.aiter_lines():
+            # Linhas que não são "data:" são comentários/keep-alive do SSE
+            if not linha.startswith("data:"):
+                continue
+            dado = linha[5:].strip()
+            if dado == "[DONE]":
+                break
+            if not dado:
+                continue
             
-            # Extrair uso de tokens
-            usage = data.get("usage", {})
+            chunk = orjson.loads(dado) if ORJSON_AVAILABLE else json.loads(dado)
+            if chunk.get("usage"):
+                usage = chunk["usage"]
             
-            return {
-                "conteudo": message_response.get("content", ""),
-                "modelo": modelo,
-                "tokens_input": usage.get("prompt_tokens", 0),
-                "tokens_output": usage.get("completion_tokens", 0),
-                "tool_calls": message_response.get("tool_calls"),
-                "finish_reason": choice.get("finish_reason"),
-                "finalizado": True
-            }
+            for choice in chunk.get("choices") or ():
+                delta = choice.get("delta") or {}
+                
+                texto = delta.get("content")
+                if texto:
+                    partes_conteudo.append(texto)
+                    if ao_receber_delta is not None:
+                        await ao_receber_delta(texto)
+                
+                for parcial in delta.get("tool_calls") or ():
+                    tool_call = tool_calls.setdefault(parcial.get("index", 0), {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if parcial.get("id"):
+                        tool_call["id"] = parcial["id"]
+                    if parcial.get("type"):
+                        tool_call["type"] = parcial["type"]
+                    funcao = parcial.get("function") or {}
+                    if funcao.get("name"):
+                        tool_call["function"]["name"] += funcao["name"]
+                    if funcao.get("arguments"):
+                        tool_call["function"]["arguments"] += funcao["arguments"]
+                
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+        
+        return {
+            "conteudo": "".join(partes_conteudo),
+            "modelo": modelo,
+            "tokens_input": usage.get("prompt_tokens", 0),
+            "tokens_output": usage.get("completion_tokens", 0),
+            "tool_calls": [tool_calls[indice] for indice in sorted(tool_calls)] or None,
+            "finish_reason": finish_reason,
+            "finalizado": True
+        }
 
     @staticmethod
     def obter_modelos_disponiveis(db: Session) -> Dict[str, List[str]]:
@@ -318,11 +499,11 @@ class LLMIntegrationService:
         ]
         
         # Modelos locais (buscar dos provedores ativos)
-        provedores_locais = ProvedorLLMService.listar_ativos(db)
+        provedores_locais = ProvedorLLMService.listar_ativos_com_modelos(db)
         for provedor in provedores_locais:
-            modelos_provedor = ProvedorLLMService.obter_modelos(db, provedor.id)
-            for modelo in modelos_provedor:
-                modelos["local"].append(f"{provedor.nome}:{modelo.nome}")
+            for modelo in provedor.modelos:
+                if modelo.ativo:
+                    modelos["local"].append(f"{provedor.nome}:{modelo.nome}")
         
         return modelos
 
@@ -344,3 +525,5 @@ class LLMIntegrationService:
             ConfiguracaoService.definir_valor(db, "llm_provedor_local_id", str(provedor_id))
         elif tipo in ["openrouter", "auto"]:
             ConfiguracaoService.definir_valor(db, "llm_provedor_local_id", None)
+        
+        LLMIntegrationService.invalidar_cache()
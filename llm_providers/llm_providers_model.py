@@ -2,6 +2,7 @@
 Modelo de dados para provedores LLM.
 """
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON, Enum
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 import enum
@@ -40,6 +41,21 @@ class ProvedorLLM(Base):
     criado_em = Column(DateTime(timezone=True), server_default=func.now())
     atualizado_em = Column(DateTime(timezone=True), onupdate=func.now())
 
+    # Somente leitura: as tabelas filhas são gravadas/removidas explicitamente pelo serviço
+    estatisticas = relationship(
+        "EstatisticasProvedor",
+        primaryjoin="ProvedorLLM.id == foreign(EstatisticasProvedor.provedor_id)",
+        back_populates="provedor",
+        uselist=False,
+        viewonly=True
+    )
+    modelos = relationship(
+        "ModeloProvedor",
+        primaryjoin="ProvedorLLM.id == foreign(ModeloProvedor.provedor_id)",
+        back_populates="provedor",
+        viewonly=True
+    )
+
     def __repr__(self):
         return f"<ProvedorLLM(nome='{self.nome}', base_url='{self.base_url}')>"
 
@@ -62,6 +78,13 @@ class EstatisticasProvedor(Base):
     criado_em = Column(DateTime(timezone=True), server_default=func.now())
     atualizado_em = Column(DateTime(timezone=True), onupdate=func.now())
 
+    provedor = relationship(
+        "ProvedorLLM",
+        primaryjoin="ProvedorLLM.id == foreign(EstatisticasProvedor.provedor_id)",
+        back_populates="estatisticas",
+        viewonly=True
+    )
+
     def __repr__(self):
         return f"<EstatisticasProvedor(provedor_id={self.provedor_id}, total={self.total_requisicoes})>"
 
@@ -86,5 +109,12 @@ class ModeloProvedor(Base):
     ultima_verificacao = Column(DateTime(timezone=True), server_default=func.now())
     criado_em = Column(DateTime(timezone=True), server_default=func.now())
 
+    provedor = relationship(
+        "ProvedorLLM",
+        primaryjoin="ProvedorLLM.id == foreign(ModeloProvedor.provedor_id)",
+        back_populates="modelos",
+        viewonly=True
+    )
+
     def __repr__(self):
         return f"<ModeloProvedor(provedor_id={self.provedor_id}, modelo='{self.nome}')>"
@@ -1,12 +1,22 @@
 """
 Serviço de lógica de negócio para provedores LLM.
 """
-from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
+from sqlalchemy import update, func, or_
+from sqlalchemy.orm import Session, selectinload, raiseload
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Tuple, Union, Callable, Awaitable
+import asyncio
 import httpx
 import json
+import os
+import queue
+import random
+import threading
 import time
+import weakref
 from datetime import datetime
+from llm_providers.rate_limit import AsyncTokenBucket, LimiteConcorrencia
 from llm_providers.llm_providers_model import ProvedorLLM, EstatisticasProvedor, ModeloProvedor, StatusProvedorEnum
 from llm_providers.llm_providers_schema import (
     ProvedorLLMCriar,
@@ -20,24 +30,189 @@ from llm_providers.llm_providers_schema import (
 )
 
 
+# Dependência opcional (pip install orjson): decodifica direto dos bytes, mais rápido que json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _json_loads(valor: Union[str, bytes]) -> Any:
+    """Decodifica JSON com orjson quando disponível."""
+    return orjson.loads(valor) if ORJSON_AVAILABLE else json.loads(valor)
+
+
+def _json_dumps(valor: Any) -> bytes:
+    """Serializa para bytes JSON com orjson quando disponível."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(valor)
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Com SQL_RAISELOAD=true, acessos a relacionamentos não carregados explicitamente levantam
+# erro (denuncia N+1 acidentais em vez de fazer SELECTs silenciosos). Desligado por padrão.
+RAISELOAD_ATIVO = os.getenv("SQL_RAISELOAD", "False").lower() == "true"
+
+
+def _opcoes_carga(*opcoes) -> tuple:
+    """Opções de carga da query, acrescidas de raiseload('*') quando SQL_RAISELOAD está ativo."""
+    return (*opcoes, raiseload("*")) if RAISELOAD_ATIVO else opcoes
+
+
+@dataclass(frozen=True, slots=True)
+class UrlsProvedor:
+    """Endpoints derivados do base_url de um provedor."""
+    
+    openai_chat: str
+    openai_models: str
+    ollama_chat: str
+    ollama_tags: str
+
+
+@lru_cache(maxsize=128)
+def urls_provedor(base_url: str) -> UrlsProvedor:
+    """Deriva (uma vez por base_url) os endpoints OpenAI-compatível e Ollama."""
+    base_url = str(base_url).rstrip('/')
+    # Verificar se base_url já contém os caminhos para evitar duplicação
+    if base_url.endswith('/v1') or '/v1/' in base_url:
+        raiz_openai = base_url
+    else:
+        raiz_openai = f"{base_url}/v1"
+    if base_url.endswith('/api') or '/api/' in base_url:
+        url_tags = f"{base_url}/tags"
+    else:
+        url_tags = f"{base_url}/api/tags"
+    
+    return UrlsProvedor(
+        openai_chat=f"{raiz_openai}/chat/completions",
+        openai_models=f"{raiz_openai}/models",
+        ollama_chat=f"{base_url}/api/chat",
+        ollama_tags=url_tags
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class ProvedorSnapshot:
+    """Dados do provedor usados para enviar requisições (cacheáveis entre sessões)."""
+    
+    id: int
+    nome: str
+    base_url: str
+    api_key: Optional[str]
+    ativo: bool
+    configuracao: Dict[str, Any]
+    contextos: Dict[str, int]  # modelo_id -> janela de contexto (modelos em cache com contexto conhecido)
+    headers: Tuple[Tuple[str, str], ...]  # cabeçalhos das requisições (montados uma vez por snapshot)
+    
+    @classmethod
+    def de_provedor(cls, provedor: ProvedorLLM, contextos: Optional[Dict[str, int]] = None) -> "ProvedorSnapshot":
+        headers = [("Content-Type", "application/json")]
+        if provedor.api_key:
+            headers.append(("Authorization", f"Bearer {provedor.api_key}"))
+        return cls(
+            id=provedor.id,
+            nome=provedor.nome,
+            base_url=str(provedor.base_url),
+            api_key=provedor.api_key,
+            ativo=bool(provedor.ativo),
+            configuracao=dict(provedor.configuracao or {}),
+            contextos=contextos or {},
+            headers=tuple(headers)
+        )
+
+
 class ProvedorLLMService:
     """Serviço para gerenciar provedores LLM."""
 
+    # Um cliente HTTP por event loop (reaproveita conexões entre requisições do mesmo loop).
+    # As mensagens do WhatsApp rodam cada uma numa thread com loop próprio, e as conexões
+    # do pool ficam presas ao loop que as abriu. Não há await entre a consulta e a criação,
+    # então nenhum lock é necessário
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """Obtém (criando sob demanda) o cliente HTTP do event loop atual."""
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0, connect=5.0, write=10.0, pool=5.0),
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+            )
+            cls._clients[loop] = client
+        return client
+
+    @classmethod
+    async def fechar_client(cls):
+        """Fecha o cliente HTTP do event loop atual (no shutdown e ao fim de cada mensagem)."""
+        client = cls._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    @staticmethod
+    def _query_listagem(db: Session):
+        """Query base das listagens de provedores (sem relacionamentos: nenhuma listagem os lê)."""
+        return db.query(ProvedorLLM).options(*_opcoes_carga())
+
     @staticmethod
     def listar_todos(db: Session) -> List[ProvedorLLM]:
         """Lista todos os provedores."""
-        return db.query(ProvedorLLM).all()
+        return ProvedorLLMService._query_listagem(db).all()
 
     @staticmethod
     def listar_ativos(db: Session) -> List[ProvedorLLM]:
         """Lista apenas provedores ativos."""
-        return db.query(ProvedorLLM).filter(ProvedorLLM.ativo == True).all()
+        return ProvedorLLMService._query_listagem(db).filter(ProvedorLLM.ativo == True).all()
+
+    @staticmethod
+    def listar_ativos_com_modelos(db: Session) -> List[ProvedorLLM]:
+        """Lista provedores ativos com os modelos carregados em lote (uma query extra, sem N+1)."""
+        return db.query(ProvedorLLM).options(*_opcoes_carga(
+            selectinload(ProvedorLLM.modelos)
+        )).filter(ProvedorLLM.ativo == True).all()
 
     @staticmethod
     def obter_por_id(db: Session, provedor_id: int) -> Optional[ProvedorLLM]:
         """Obtém um provedor por ID."""
-        return db.query(ProvedorLLM).filter(ProvedorLLM.id == provedor_id).first()
+        return db.query(ProvedorLLM).options(*_opcoes_carga()).filter(ProvedorLLM.id == provedor_id).first()
 
+    # Cache dos provedores usados em enviar_requisicao: provedor_id -> (expira_em, snapshot)
+    _cache_snapshot: Dict[int, Tuple[float, ProvedorSnapshot]] = {}
+    CACHE_PROVEDOR_TTL_SEGUNDOS = 30
+
+    @staticmethod
+    def _obter_snapshot(db: Session, provedor_id: int) -> Optional[ProvedorSnapshot]:
+        """Obtém os dados do provedor para requisições, usando o cache quando válido."""
+        item = ProvedorLLMService._cache_snapshot.get(provedor_id)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        
+        provedor = ProvedorLLMService.obter_por_id(db, provedor_id)
+        if not provedor:
+            return None
+        
+        contextos = dict(
+            db.query(ModeloProvedor.modelo_id, ModeloProvedor.contexto).filter(
+                ModeloProvedor.provedor_id == provedor_id,
+                ModeloProvedor.contexto.isnot(None)
+            ).all()
+        )
+        snapshot = ProvedorSnapshot.de_provedor(provedor, contextos)
+        ProvedorLLMService._cache_snapshot[provedor_id] = (
+            time.monotonic() + ProvedorLLMService.CACHE_PROVEDOR_TTL_SEGUNDOS,
+            snapshot
+        )
+        return snapshot
+
+
+    @staticmethod
+    def _invalidar_escolha_provedor():
+        """Descarta os provedores em cache (aqui e a escolha de provedor no LLMIntegrationService)."""
+        from llm_providers.llm_integration_service import LLMIntegrationService
+        ProvedorLLMService._cache_snapshot.clear()
+        LLMIntegrationService.invalidar_cache()
 
     @staticmethod
     def criar(db: Session, provedor: ProvedorLLMCriar) -> ProvedorLLM:
@@ -55,6 +230,7 @@ class ProvedorLLMService:
         stats = EstatisticasProvedor(provedor_id=db_provedor.id)
         db.add(stats)
         db.commit()
+        ProvedorLLMService._invalidar_escolha_provedor()
         
         return db_provedor
 
@@ -72,67 +248,80 @@ class ProvedorLLMService:
             if campo == 'base_url' and hasattr(valor, '__str__'):
                 valor = str(valor)
             setattr(db_provedor, campo, valor)
+        
+        # Nova URL: o tipo de API detectado para a antiga não vale mais
+        if 'base_url' in update_data and db_provedor.configuracao:
+            db_provedor.configuracao = {
+                chave: valor for chave, valor in db_provedor.configuracao.items()
+                if chave not in ("tipo_api", "tipo_api_verificado_em")
+            }
 
         db.commit()
         db.refresh(db_provedor)
+        ProvedorLLMService._invalidar_escolha_provedor()
         return db_provedor
 
     @staticmethod
     def deletar(db: Session, provedor_id: int) -> bool:
         """Deleta um provedor."""
-        db_provedor = ProvedorLLMService.obter_por_id(db, provedor_id)
-        if not db_provedor:
+        # Só o nome é necessário: nada de carregar o objeto ORM inteiro
+        nome = db.query(ProvedorLLM.nome).filter(ProvedorLLM.id == provedor_id).scalar()
+        if nome is None:
             return False
 
-        # Verificar se há agentes vinculados a este provedor
+        # Verificar se há agentes vinculados a este provedor: agentes cujo modelo é um
+        # dos modelos deste provedor (ou que referenciam o provedor pelo nome).
+        # Comparação por igualdade (usa índice), sem LIKE '%nome%' varrendo a tabela.
         from agente.agente_model import Agente
-        agentes_vinculados = db.query(Agente).filter(Agente.modelo_llm.contains(db_provedor.nome)).count()
+        modelos_do_provedor = db.query(ModeloProvedor.modelo_id).filter(
+            ModeloProvedor.provedor_id == provedor_id
+        )
+        agentes_vinculados = db.query(func.count(Agente.id)).filter(
+            or_(Agente.modelo_llm.in_(modelos_do_provedor.scalar_subquery()), Agente.modelo_llm == nome)
+        ).scalar()
         
         if agentes_vinculados > 0:
-            raise ValueError(f"Não é possível remover o provedor '{db_provedor.nome}' pois ele está sendo usado por {agentes_vinculados} agente(s). Remova os vínculos primeiro.")
+            raise ValueError(f"Não é possível remover o provedor '{nome}' pois ele está sendo usado por {agentes_vinculados} agente(s). Remova os vínculos primeiro.")
 
         # Deletar estatísticas relacionadas
         db.query(EstatisticasProvedor).filter(EstatisticasProvedor.provedor_id == provedor_id).delete()
         db.query(ModeloProvedor).filter(ModeloProvedor.provedor_id == provedor_id).delete()
         
-        db.delete(db_provedor)
+        db.query(ProvedorLLM).filter(ProvedorLLM.id == provedor_id).delete(synchronize_session=False)
         db.commit()
+        ProvedorLLMService._semaforos.pop(provedor_id, None)
+        ProvedorLLMService._limitadores.pop(provedor_id, None)
+        ProvedorLLMService._invalidar_escolha_provedor()
         return True
 
     @staticmethod
     async def buscar_modelos_api(provedor: ProvedorLLM) -> List[str]:
         """Busca modelos disponíveis na API do provedor."""
-        import httpx
-        
         try:
             headers = {}
             if provedor.api_key:
                 headers["Authorization"] = f"Bearer {provedor.api_key}"
             
-            base_url = str(provedor.base_url).rstrip('/')
-            # Verificar se base_url já contém /v1 para evitar duplicação
-            if base_url.endswith('/v1') or '/v1/' in base_url:
-                models_url = f"{base_url}/models"
-            else:
-                models_url = f"{base_url}/v1/models"
+            models_url = urls_provedor(str(provedor.base_url)).openai_models
+            
+            client = await ProvedorLLMService._get_client()
+            response = await client.get(
+                models_url,
+                headers=headers,
+                timeout=10.0
+            )
+            response.raise_for_status()
+            
+            data = _json_loads(response.content)
+            modelos = []
+            
+            if "data" in data:
+                for model in data["data"]:
+                    if "id" in model:
+                        modelos.append(model["id"])
+            
+            return modelos
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(
-                    models_url,
-                    headers=headers
-                )
-                response.raise_for_status()
-                
-                data = response.json()
-                modelos = []
-                
-                if "data" in data:
-                    for model in data["data"]:
-                        if "id" in model:
-                            modelos.append(model["id"])
-                
-                return modelos
-                
         except Exception as e:
             print(f"Erro ao buscar modelos: {e}")
             return []
@@ -150,107 +339,103 @@ class ProvedorLLMService:
         inicio_teste = time.time()
         
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Construir URL base
-                base_url = str(provedor.base_url).rstrip('/')
-                headers = {"Content-Type": "application/json"}
-                if provedor.api_key:
-                    headers["Authorization"] = f"Bearer {provedor.api_key}"
+            client = await ProvedorLLMService._get_client()
+            headers = {"Content-Type": "application/json"}
+            if provedor.api_key:
+                headers["Authorization"] = f"Bearer {provedor.api_key}"
                 
-                # Tentar detectar tipo de provedor automaticamente
-                # Primeiro tenta OpenAI-compatível (LM Studio, llama.cpp, etc.)
-                # Verificar se base_url já contém os caminhos para evitar duplicação
-                if base_url.endswith('/v1') or '/v1/' in base_url:
-                    url_openai = f"{base_url}/models"
-                else:
-                    url_openai = f"{base_url}/v1/models"
+            # Tentar detectar tipo de provedor automaticamente: OpenAI-compatível
+            # (LM Studio, llama.cpp, etc.) e Ollama são testados ao mesmo tempo
+            urls = urls_provedor(str(provedor.base_url))
+            tarefas = {
+                asyncio.create_task(client.get(urls.openai_models, headers=headers, timeout=10.0)): "openai",
+                asyncio.create_task(client.get(urls.ollama_tags, headers=headers, timeout=10.0)): "ollama"
+            }
+            respostas = {}
+            tipo_detectado = None
+            pendentes = set(tarefas)
+            
+            try:
+                # Fica com o primeiro 200; se os dois chegarem juntos, OpenAI tem preferência
+                while pendentes and tipo_detectado is None:
+                    concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                    for tarefa in sorted(concluidas, key=lambda t: tarefas[t] != "openai"):
+                        if tarefa.exception() is not None:
+                            continue
+                        respostas[tarefas[tarefa]] = tarefa.result()
+                        if tipo_detectado is None and tarefa.result().status_code == 200:
+                            tipo_detectado = tarefas[tarefa]
+            finally:
+                # A sonda que perdeu a corrida não é mais necessária
+                for tarefa in pendentes:
+                    tarefa.cancel()
+            
+            if tipo_detectado:
+                response = respostas[tipo_detectado]
+            else:
+                response = respostas.get("ollama") or respostas.get("openai")
                 
-                if base_url.endswith('/api') or '/api/' in base_url:
-                    url_ollama = f"{base_url}/tags"
+            tempo_resposta = (time.time() - inicio_teste) * 1000
+
+            if response and response.status_code == 200:
+                data = _json_loads(response.content)
+                modelos = []
+
+                if tipo_detectado == "ollama":
+                    # Ollama retorna estrutura diferente
+                    for modelo_data in data.get("models", []):
+                        modelo = ModeloLLM(
+                            id=modelo_data.get("name", ""),
+                            nome=modelo_data.get("name", ""),
+                            contexto=modelo_data.get("details", {}).get("parameter_size"),
+                            suporta_imagens="llava" in modelo_data.get("name", "").lower() or 
+                                          "bakllava" in modelo_data.get("name", "").lower(),
+                            suporta_ferramentas=False,  # Ollama não suporta nativamente
+                            tamanho=modelo_data.get("size"),
+                            quantizacao=modelo_data.get("details", {}).get("quantization_level")
+                        )
+                        modelos.append(modelo)
                 else:
-                    url_ollama = f"{base_url}/api/tags"
-                
-                response = None
-                tipo_detectado = None
-                
-                # Tenta endpoint OpenAI primeiro
-                try:
-                    response = await client.get(url_openai, headers=headers)
-                    if response.status_code == 200:
-                        tipo_detectado = "openai"
-                except:
-                    pass
+                    # LM Studio e llama.cpp usam formato OpenAI
+                    for modelo_data in data.get("data", []):
+                        modelo = ModeloLLM(
+                            id=modelo_data.get("id", ""),
+                            nome=modelo_data.get("id", ""),
+                            contexto=modelo_data.get("context_length"),
+                            suporta_imagens="vision" in modelo_data.get("id", "").lower(),
+                            suporta_ferramentas="tools" in str(modelo_data.get("capabilities", [])),
+                            tamanho=None,
+                            quantizacao=None
+                        )
+                        modelos.append(modelo)
+
+                # Atualizar status do provedor (e o tipo de API redetectado)
+                provedor.status = StatusProvedorEnum.ATIVO
+                provedor.ultimo_teste = datetime.now()
+                ProvedorLLMService._registrar_tipo_api(db, provedor, tipo_detectado)
+
+                # Salvar/cachear modelos
+                ProvedorLLMService._salvar_modelos(db, provedor_id, modelos)
+
+                return TesteConexaoResposta(
+                    sucesso=True,
+                    mensagem=f"Conexão bem-sucedida ({tipo_detectado}). {len(modelos)} modelos encontrados",
+                    modelos=modelos,
+                    tempo_resposta_ms=tempo_resposta
+                )
+            else:
+                provedor.status = StatusProvedorEnum.ERRO
+                provedor.ultimo_teste = datetime.now()
+                db.commit()
                 
-                # Se falhou, tenta endpoint Ollama
-                if not response or response.status_code != 200:
-                    try:
-                        response = await client.get(url_ollama, headers=headers)
-                        if response.status_code == 200:
-                            tipo_detectado = "ollama"
-                    except:
-                        pass
+                erro_msg = response.text if response else "Nenhuma resposta do servidor"
+                status_code = response.status_code if response else "N/A"
                 
-                tempo_resposta = (time.time() - inicio_teste) * 1000
-
-                if response and response.status_code == 200:
-                    data = response.json()
-                    modelos = []
-
-                    if tipo_detectado == "ollama":
-                        # Ollama retorna estrutura diferente
-                        for modelo_data in data.get("models", []):
-                            modelo = ModeloLLM(
-                                id=modelo_data.get("name", ""),
-                                nome=modelo_data.get("name", ""),
-                                contexto=modelo_data.get("details", {}).get("parameter_size"),
-                                suporta_imagens="llava" in modelo_data.get("name", "").lower() or 
-                                              "bakllava" in modelo_data.get("name", "").lower(),
-                                suporta_ferramentas=False,  # Ollama não suporta nativamente
-                                tamanho=modelo_data.get("size"),
-                                quantizacao=modelo_data.get("details", {}).get("quantization_level")
-                            )
-                            modelos.append(modelo)
-                    else:
-                        # LM Studio e llama.cpp usam formato OpenAI
-                        for modelo_data in data.get("data", []):
-                            modelo = ModeloLLM(
-                                id=modelo_data.get("id", ""),
-                                nome=modelo_data.get("id", ""),
-                                contexto=modelo_data.get("context_length"),
-                                suporta_imagens="vision" in modelo_data.get("id", "").lower(),
-                                suporta_ferramentas="tools" in str(modelo_data.get("capabilities", [])),
-                                tamanho=None,
-                                quantizacao=None
-                            )
-                            modelos.append(modelo)
-
-                    # Atualizar status do provedor
-                    provedor.status = StatusProvedorEnum.ATIVO
-                    provedor.ultimo_teste = datetime.now()
-                    db.commit()
-
-                    # Salvar/cachear modelos
-                    ProvedorLLMService._salvar_modelos(db, provedor_id, modelos)
-
-                    return TesteConexaoResposta(
-                        sucesso=True,
-                        mensagem=f"Conexão bem-sucedida ({tipo_detectado}). {len(modelos)} modelos encontrados",
-                        modelos=modelos,
-                        tempo_resposta_ms=tempo_resposta
-                    )
-                else:
-                    provedor.status = StatusProvedorEnum.ERRO
-                    provedor.ultimo_teste = datetime.now()
-                    db.commit()
-                    
-                    erro_msg = response.text if response else "Nenhuma resposta do servidor"
-                    status_code = response.status_code if response else "N/A"
-                    
-                    return TesteConexaoResposta(
-                        sucesso=False,
-                        mensagem=f"Erro HTTP {status_code}: {erro_msg}",
-                        tempo_resposta_ms=tempo_resposta
-                    )
+                return TesteConexaoResposta(
+                    sucesso=False,
+                    mensagem=f"Erro HTTP {status_code}: {erro_msg}",
+                    tempo_resposta_ms=tempo_resposta
+                )
 
         except httpx.TimeoutException:
             provedor.status = StatusProvedorEnum.ERRO
@@ -275,191 +460,550 @@ class ProvedorLLMService:
     def _salvar_modelos(db: Session, provedor_id: int, modelos: List[ModeloLLM]):
         """Salva modelos no cache do banco."""
         # Limpar modelos antigos
-        db.query(ModeloProvedor).filter(ModeloProvedor.provedor_id == provedor_id).delete()
+        db.query(ModeloProvedor).filter(
+            ModeloProvedor.provedor_id == provedor_id
+        ).delete(synchronize_session=False)
         
-        # Salvar novos modelos
-        for modelo in modelos:
-            db_modelo = ModeloProvedor(
-                provedor_id=provedor_id,
-                modelo_id=modelo.id,
-                nome=modelo.nome,
-                contexto=modelo.contexto,
-                suporta_imagens=modelo.suporta_imagens,
-                suporta_ferramentas=modelo.suporta_ferramentas,
-                tamanho=modelo.tamanho,
-                quantizacao=modelo.quantizacao
-            )
-            db.add(db_modelo)
+        # Salvar novos modelos em um único INSERT em lote (sem montar objetos ORM)
+        if modelos:
+            db.bulk_insert_mappings(ModeloProvedor, [
+                {
+                    "provedor_id": provedor_id,
+                    "modelo_id": modelo.id,
+                    "nome": modelo.nome,
+                    "contexto": modelo.contexto,
+                    "suporta_imagens": modelo.suporta_imagens,
+                    "suporta_ferramentas": modelo.suporta_ferramentas,
+                    "tamanho": modelo.tamanho,
+                    "quantizacao": modelo.quantizacao
+                }
+                for modelo in modelos
+            ])
         
         db.commit()
+        ProvedorLLMService._cache_snapshot.pop(provedor_id, None)
 
     @staticmethod
     def obter_modelos(db: Session, provedor_id: int) -> List[ModeloProvedor]:
         """Obtém modelos disponíveis para um provedor."""
-        return db.query(ModeloProvedor).filter(
+        return db.query(ModeloProvedor).options(*_opcoes_carga()).filter(
             ModeloProvedor.provedor_id == provedor_id,
             ModeloProvedor.ativo == True
         ).all()
 
+    # Limite de requisições simultâneas por provedor (servidores locais costumam ter uma GPU só)
+    MAX_CONCORRENCIA_PADRAO = 8
+    # (vale entre as threads de mensagem, cada uma com seu event loop)
+    _semaforos: Dict[int, tuple] = {}  # provedor_id -> (limite, LimiteConcorrencia)
+
     @staticmethod
-    async def enviar_requisicao(db: Session, provedor_id: int, requisicao: RequisicaoLLM) -> RespostaLLM:
-        """Envia uma requisição para um provedor LLM."""
-        provedor = ProvedorLLMService.obter_por_id(db, provedor_id)
+    def _obter_semaforo(provedor: Union[ProvedorLLM, ProvedorSnapshot]) -> LimiteConcorrencia:
+        """Limite de concorrência do provedor (criado sob demanda; recriado se o limite mudar)."""
+        limite = (provedor.configuracao or {}).get("max_concorrencia") or ProvedorLLMService.MAX_CONCORRENCIA_PADRAO
+        entrada = ProvedorLLMService._semaforos.get(provedor.id)
+        if entrada is None or entrada[0] != limite:
+            entrada = (limite, LimiteConcorrencia(limite))
+            ProvedorLLMService._semaforos[provedor.id] = entrada
+        return entrada[1]
+
+    # Cotas por minuto (configuracao["requisicoes_por_minuto"] / ["tokens_por_minuto"])
+    _limitadores: Dict[int, tuple] = {}  # provedor_id -> ((rpm, tpm), balde_rpm, balde_tpm)
+
+    @staticmethod
+    def _obter_limitadores(provedor: Union[ProvedorLLM, ProvedorSnapshot]) -> tuple:
+        """Baldes de requisições e de tokens do provedor (None quando não há cota)."""
+        config = provedor.configuracao or {}
+        limites = (config.get("requisicoes_por_minuto"), config.get("tokens_por_minuto"))
+        entrada = ProvedorLLMService._limitadores.get(provedor.id)
+        if entrada is None or entrada[0] != limites:
+            rpm, tpm = limites
+            entrada = (
+                limites,
+                AsyncTokenBucket.por_minuto(rpm) if rpm else None,
+                AsyncTokenBucket.por_minuto(tpm) if tpm else None
+            )
+            ProvedorLLMService._limitadores[provedor.id] = entrada
+        return entrada[1], entrada[2]
+
+    # max_tokens usado quando a requisição não traz configuração (evita geração sem limite)
+    MAX_TOKENS_PADRAO = 1024
+    # Folga para tokens de formatação do chat template ao comparar com a janela de contexto
+    MARGEM_CONTEXTO_TOKENS = 64
+
+    @staticmethod
+    def _max_tokens(requisicao: RequisicaoLLM) -> int:
+        """max_tokens efetivo da requisição."""
+        if requisicao.configuracao and requisicao.configuracao.max_tokens:
+            return requisicao.configuracao.max_tokens
+        return ProvedorLLMService.MAX_TOKENS_PADRAO
+
+    @staticmethod
+    def _validar_contexto(provedor: ProvedorSnapshot, requisicao: RequisicaoLLM) -> int:
+        """
+        Estima os tokens do prompt e rejeita (ValueError) requisições que não cabem
+        na janela de contexto do modelo, antes de gastar rede e processamento do backend.
+        Retorna a estimativa de tokens do prompt.
+        """
+        tokens_prompt = ProvedorLLMService._estimar_tokens_prompt(requisicao.mensagens)
+        contexto = provedor.contextos.get(requisicao.modelo)
+        if contexto:
+            max_tokens = ProvedorLLMService._max_tokens(requisicao)
+            if tokens_prompt + max_tokens > contexto - ProvedorLLMService.MARGEM_CONTEXTO_TOKENS:
+                raise ValueError(
+                    f"Prompt grande demais para o modelo '{requisicao.modelo}': "
+                    f"~{tokens_prompt} tokens + max_tokens {max_tokens} excedem o contexto de {contexto} tokens"
+                )
+        return tokens_prompt
+
+    @staticmethod
+    def _estimar_tokens_prompt(mensagens: List[Dict[str, Any]]) -> int:
+        """Estimativa barata de tokens do prompt (~4 caracteres por token)."""
+        caracteres = 0
+        for mensagem in mensagens:
+            conteudo = mensagem.get("content")
+            if isinstance(conteudo, str):
+                caracteres += len(conteudo)
+            elif isinstance(conteudo, list):
+                # Conteúdo multimodal: conta só as partes de texto
+                for parte in conteudo:
+                    if isinstance(parte, dict) and isinstance(parte.get("text"), str):
+                        caracteres += len(parte["text"])
+        return caracteres // 4
+
+    # Retentativas com backoff exponencial + jitter para falhas transitórias (rede, 429, 5xx)
+    RETRY_TENTATIVAS = 3
+    RETRY_ATRASO_INICIAL = 0.5
+    RETRY_ATRASO_MAX = 8.0
+    RETRY_STATUS = {429, 502, 503, 504}
+    RETRY_EXCECOES = (httpx.TimeoutException, httpx.ConnectError, httpx.ReadError)
+
+    @staticmethod
+    def _atraso_retry(tentativa: int, response: Optional[httpx.Response] = None) -> float:
+        """Calcula o atraso antes da próxima tentativa (respeitando Retry-After, se houver)."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), ProvedorLLMService.RETRY_ATRASO_MAX)
+                except ValueError:
+                    pass
+        
+        atraso = ProvedorLLMService.RETRY_ATRASO_INICIAL * (2 ** tentativa)
+        atraso += random.uniform(0, ProvedorLLMService.RETRY_ATRASO_INICIAL)
+        return min(atraso, ProvedorLLMService.RETRY_ATRASO_MAX)
+
+    @staticmethod
+    async def _post_com_retry(
+        client: httpx.AsyncClient,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Union[Dict[str, str], Tuple[Tuple[str, str], ...]],
+        stream: bool = False
+    ) -> httpx.Response:
+        """
+        POST ao provedor, repetindo em erros de rede/timeout e em 429/502/503/504.
+        
+        Com stream=True o corpo só é lido pelo chamador quando o status é 200 (e ele
+        deve fechar a resposta); respostas de erro já voltam lidas e fechadas.
+        """
+        # Serializa uma vez só (o histórico da conversa pode ser grande), reaproveitando nas retentativas
+        corpo = _json_dumps(payload)
+        headers = dict(headers)
+        headers.setdefault("Content-Type", "application/json")
+        
+        for tentativa in range(ProvedorLLMService.RETRY_TENTATIVAS):
+            ultima = tentativa == ProvedorLLMService.RETRY_TENTATIVAS - 1
+            try:
+                response = await client.send(
+                    client.build_request("POST", url, content=corpo, headers=headers),
+                    stream=stream
+                )
+            except ProvedorLLMService.RETRY_EXCECOES:
+                if ultima:
+                    raise
+                await asyncio.sleep(ProvedorLLMService._atraso_retry(tentativa))
+                continue
+            
+            if stream and response.status_code != 200:
+                # Corpo de erro é pequeno: lê (para response.text) e libera a conexão
+                await response.aread()
+                await response.aclose()
+            
+            if response.status_code in ProvedorLLMService.RETRY_STATUS and not ultima:
+                print(f"🔁 [PROVEDOR_LOCAL] Provedor retornou {response.status_code}, tentando novamente...")
+                await asyncio.sleep(ProvedorLLMService._atraso_retry(tentativa, response))
+                continue
+            
+            return response
+
+    # Validade do tipo de API detectado (openai/ollama) antes de redetectar
+    TIPO_API_VALIDADE_SEGUNDOS = 24 * 3600
+
+    @staticmethod
+    def _obter_tipo_api(provedor: Union[ProvedorLLM, ProvedorSnapshot]) -> Optional[str]:
+        """Tipo de API detectado anteriormente ("openai"/"ollama"), se ainda válido."""
+        config = provedor.configuracao or {}
+        verificado_em = config.get("tipo_api_verificado_em")
+        if not verificado_em or time.time() - verificado_em > ProvedorLLMService.TIPO_API_VALIDADE_SEGUNDOS:
+            return None
+        return config.get("tipo_api")
+
+    @staticmethod
+    def _registrar_tipo_api(db: Session, provedor: ProvedorLLM, tipo: str):
+        """Guarda o tipo de API detectado na configuração do provedor."""
+        # Reatribuir o dict para o SQLAlchemy detectar a alteração na coluna JSON
+        provedor.configuracao = {
+            **(provedor.configuracao or {}),
+            "tipo_api": tipo,
+            "tipo_api_verificado_em": time.time()
+        }
+        db.commit()
+        ProvedorLLMService._cache_snapshot.pop(provedor.id, None)
+
+    @staticmethod
+    def _payload_openai(requisicao: RequisicaoLLM) -> Dict[str, Any]:
+        """Monta o payload para o endpoint OpenAI-compatível (/v1/chat/completions)."""
+        payload = {
+            "model": requisicao.modelo,
+            "messages": requisicao.mensagens,
+            "stream": requisicao.stream
+        }
+        
+        # Adicionar tools se disponíveis
+        if requisicao.tools:
+            payload["tools"] = requisicao.tools
+            print(f"🔧 [PROVEDOR_LOCAL] Enviando {len(requisicao.tools)} tools para API OpenAI-compatível")
+        
+        if requisicao.configuracao:
+            payload.update({
+                "temperature": requisicao.configuracao.temperatura,
+                "max_tokens": requisicao.configuracao.max_tokens,
+                "top_p": requisicao.configuracao.top_p,
+                "stop": requisicao.configuracao.stop
+            })
+        else:
+            payload["max_tokens"] = ProvedorLLMService.MAX_TOKENS_PADRAO
+        return payload
+
+    @staticmethod
+    def _payload_ollama(requisicao: RequisicaoLLM) -> Dict[str, Any]:
+        """Monta o payload para o endpoint do Ollama (/api/chat)."""
+        payload = {
+            "model": requisicao.modelo,
+            "messages": requisicao.mensagens,
+            "stream": requisicao.stream
+        }
+        
+        # Adicionar tools para Ollama
+        if requisicao.tools:
+            payload["tools"] = requisicao.tools
+            print(f"🔧 [PROVEDOR_LOCAL] Enviando {len(requisicao.tools)} tools para API Ollama")
+        
+        if requisicao.configuracao:
+            payload["options"] = {
+                "temperature": requisicao.configuracao.temperatura,
+                "num_predict": requisicao.configuracao.max_tokens,
+                "top_p": requisicao.configuracao.top_p,
+                "top_k": requisicao.configuracao.top_k,
+                "repeat_penalty": requisicao.configuracao.repeat_penalty,
+                "stop": requisicao.configuracao.stop
+            }
+        else:
+            payload["options"] = {"num_predict": ProvedorLLMService.MAX_TOKENS_PADRAO}
+        return payload
+
+    @staticmethod
+    def _extrair_resposta(data: Dict[str, Any], tipo: str) -> Dict[str, Any]:
+        """Extrai conteúdo, tokens, tool_calls e finish_reason de uma resposta completa."""
+        # Os {} de fallback só são criados quando o campo falta (ou vem null)
+        if tipo == "ollama":
+            message = data.get("message") or {}
+            return {
+                "conteudo": message.get("content", ""),
+                "tokens_usados": data.get("eval_count"),
+                "tool_calls": message.get("tool_calls"),
+                "finish_reason": data.get("done_reason")
+            }
+        
+        # OpenAI-compatível
+        choices = data.get("choices")
+        choice = choices[0] if choices else {}
+        message = choice.get("message") or {}
+        usage = data.get("usage")
+        return {
+            "conteudo": message.get("content", ""),
+            "tokens_usados": usage.get("total_tokens") if usage else None,
+            "tool_calls": message.get("tool_calls"),
+            "finish_reason": choice.get("finish_reason")
+        }
+
+    @staticmethod
+    async def _ler_stream(
+        response: httpx.Response,
+        tipo: str,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """Consome uma resposta em streaming, no mesmo formato de _extrair_resposta."""
+        if tipo != "ollama":
+            # SSE no formato OpenAI: mesmo leitor usado para o OpenRouter
+            from llm_providers.llm_integration_service import LLMIntegrationService
+            resultado = await LLMIntegrationService._ler_stream_openrouter(response, "", ao_receber_delta)
+            return {
+                "conteudo": resultado["conteudo"],
+                "tokens_usados": (resultado["tokens_input"] + resultado["tokens_output"]) or None,
+                "tool_calls": resultado["tool_calls"],
+                "finish_reason": resultado["finish_reason"]
+            }
+        
+        # Ollama: uma linha JSON por trecho, a última com done=true e as contagens
+        partes_conteudo = []
+        tool_calls = []
+        tokens_usados = None
+        finish_reason = None
+        
+        async for linha in response.aiter_lines():
+            if not linha.strip():
+                continue
+            chunk = _json_loads(linha)
+            message = chunk.get("message") or {}
+            
+            texto = message.get("content")
+            if texto:
+                partes_conteudo.append(texto)
+                if ao_receber_delta is not None:
+                    await ao_receber_delta(texto)
+            if message.get("tool_calls"):
+                tool_calls.extend(message["tool_calls"])
+            
+            if chunk.get("done"):
+                tokens_usados = chunk.get("eval_count")
+                finish_reason = chunk.get("done_reason")
+                break
+        
+        return {
+            "conteudo": "".join(partes_conteudo),
+            "tokens_usados": tokens_usados,
+            "tool_calls": tool_calls or None,
+            "finish_reason": finish_reason
+        }
+
+    @staticmethod
+    async def enviar_requisicao(
+        db: Session,
+        provedor_id: int,
+        requisicao: RequisicaoLLM,
+        ao_receber_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> RespostaLLM:
+        """
+        Envia uma requisição para um provedor LLM.
+        
+        Com requisicao.stream=True a resposta é lida conforme é gerada (SSE no formato
+        OpenAI, NDJSON no Ollama) e cada trecho de texto é repassado a ao_receber_delta;
+        o retorno continua sendo a RespostaLLM completa.
+        """
+        provedor = ProvedorLLMService._obter_snapshot(db, provedor_id)
         if not provedor:
             raise ValueError("Provedor não encontrado")
 
         if not provedor.ativo:
             raise ValueError("Provedor não está ativo")
 
+        tokens_prompt = ProvedorLLMService._validar_contexto(provedor, requisicao)
+
         inicio_requisicao = time.time()
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                base_url = str(provedor.base_url).rstrip('/')
-                headers = {"Content-Type": "application/json"}
-                if provedor.api_key:
-                    headers["Authorization"] = f"Bearer {provedor.api_key}"
-                
-                # Tentar detectar tipo automaticamente pelo URL ou tentar ambos
-                tipo_detectado = None
-                response = None
-                
-                # Primeiro tenta endpoint OpenAI-compatível
-                # Verificar se base_url já contém /v1 para evitar duplicação
-                if base_url.endswith('/v1') or '/v1/' in base_url:
-                    url_openai = f"{base_url}/chat/completions"
-                else:
-                    url_openai = f"{base_url}/v1/chat/completions"
-                payload_openai = {
-                    "model": requisicao.modelo,
-                    "messages": requisicao.mensagens,
-                    "stream": requisicao.stream
-                }
-                
-                # Adicionar tools se disponíveis
-                if requisicao.tools:
-                    payload_openai["tools"] = requisicao.tools
-                    print(f"🔧 [PROVEDOR_LOCAL] Enviando {len(requisicao.tools)} tools para API OpenAI-compatível")
-                
-                if requisicao.configuracao:
-                    payload_openai.update({
-                        "temperature": requisicao.configuracao.temperatura,
-                        "max_tokens": requisicao.configuracao.max_tokens,
-                        "top_p": requisicao.configuracao.top_p,
-                        "stop": requisicao.configuracao.stop
-                    })
-                
-                try:
-                    response = await client.post(url_openai, json=payload_openai, headers=headers)
-                    if response.status_code == 200:
-                        tipo_detectado = "openai"
-                except:
-                    pass
-                
-                # Se falhou, tenta endpoint Ollama
-                if not response or response.status_code != 200:
-                    url_ollama = f"{base_url}/api/chat"
-                    payload_ollama = {
-                        "model": requisicao.modelo,
-                        "messages": requisicao.mensagens,
-                        "stream": requisicao.stream
-                    }
-                    
-                    # Adicionar tools para Ollama
-                    if requisicao.tools:
-                        payload_ollama["tools"] = requisicao.tools
-                        print(f"🔧 [PROVEDOR_LOCAL] Enviando {len(requisicao.tools)} tools para API Ollama")
-                    
-                    if requisicao.configuracao:
-                        payload_ollama["options"] = {
-                            "temperature": requisicao.configuracao.temperatura,
-                            "num_predict": requisicao.configuracao.max_tokens,
-                            "top_p": requisicao.configuracao.top_p,
-                            "top_k": requisicao.configuracao.top_k,
-                            "repeat_penalty": requisicao.configuracao.repeat_penalty,
-                            "stop": requisicao.configuracao.stop
-                        }
+            client = await ProvedorLLMService._get_client()
+            headers = provedor.headers
+            urls = urls_provedor(provedor.base_url)
+            
+            # Com o tipo de API já detectado, vai direto ao endpoint certo;
+            # o outro só é tentado se esse falhar (e aí o tipo é redetectado)
+            tipo_api = ProvedorLLMService._obter_tipo_api(provedor)
+            tipos = ("ollama", "openai") if tipo_api == "ollama" else ("openai", "ollama")
+            tipo_detectado = None
+            response = None
+            
+            # Respeitar as cotas do provedor antes de ocupar uma vaga de concorrência
+            balde_rpm, balde_tpm = ProvedorLLMService._obter_limitadores(provedor)
+            if balde_rpm:
+                await balde_rpm.adquirir(1)
+            if balde_tpm:
+                await balde_tpm.adquirir(tokens_prompt + ProvedorLLMService._max_tokens(requisicao))
+            
+            async with ProvedorLLMService._obter_semaforo(provedor):
+                for tipo in tipos:
+                    if tipo == "openai":
+                        url = urls.openai_chat
+                        payload = ProvedorLLMService._payload_openai(requisicao)
+                    else:
+                        url = urls.ollama_chat
+                        payload = ProvedorLLMService._payload_ollama(requisicao)
                     
                     try:
-                        response = await client.post(url_ollama, json=payload_ollama, headers=headers)
+                        response = await ProvedorLLMService._post_com_retry(
+                            client, url, payload, headers, stream=requisicao.stream
+                        )
                         if response.status_code == 200:
-                            tipo_detectado = "ollama"
+                            tipo_detectado = tipo
+                            break
                     except:
                         pass
+                
+                # O stream é consumido ainda dentro da vaga (o servidor está gerando)
+                dados = None
+                if tipo_detectado and requisicao.stream:
+                    try:
+                        dados = await ProvedorLLMService._ler_stream(response, tipo_detectado, ao_receber_delta)
+                    finally:
+                        await response.aclose()
+            
+            if tipo_detectado and tipo_detectado != tipo_api:
+                db_provedor = ProvedorLLMService.obter_por_id(db, provedor_id)
+                if db_provedor:
+                    ProvedorLLMService._registrar_tipo_api(db, db_provedor, tipo_detectado)
 
-                tempo_geracao = (time.time() - inicio_requisicao) * 1000
+            tempo_geracao = (time.time() - inicio_requisicao) * 1000
 
-                if response and response.status_code == 200:
-                    data = response.json()
-                    
-                    # Extrair resposta baseado no tipo
-                    tool_calls = None
-                    finish_reason = None
-                    
-                    if tipo_detectado == "ollama":
-                        message = data.get("message", {})
-                        conteudo = message.get("content", "")
-                        tokens_usados = data.get("eval_count")
-                        tool_calls = message.get("tool_calls")
-                        finish_reason = data.get("done_reason")
-                    else:
-                        # OpenAI-compatível
-                        choice = data.get("choices", [{}])[0]
-                        message = choice.get("message", {})
-                        conteudo = message.get("content", "")
-                        tokens_usados = data.get("usage", {}).get("total_tokens")
-                        tool_calls = message.get("tool_calls")
-                        finish_reason = choice.get("finish_reason")
-                    
-                    if tool_calls:
-                        print(f"🔧 [PROVEDOR_LOCAL] Resposta contém {len(tool_calls)} tool_calls")
-
-                    # Atualizar estatísticas
-                    ProvedorLLMService._atualizar_estatisticas(db, provedor_id, True, tempo_geracao)
-
-                    return RespostaLLM(
-                        conteudo=conteudo or "",
-                        modelo=requisicao.modelo,
-                        tokens_usados=tokens_usados,
-                        tempo_geracao_ms=tempo_geracao,
-                        tool_calls=tool_calls,
-                        finish_reason=finish_reason
-                    )
-                else:
-                    ProvedorLLMService._atualizar_estatisticas(db, provedor_id, False, tempo_geracao)
-                    erro_msg = response.text if response else "Nenhuma resposta do servidor"
-                    status_code = response.status_code if response else "N/A"
-                    raise Exception(f"Erro HTTP {status_code}: {erro_msg}")
+            if tipo_detectado:
+                if dados is None:
+                    dados = ProvedorLLMService._extrair_resposta(_json_loads(response.content), tipo_detectado)
+                tool_calls = dados["tool_calls"]
+                
+                if tool_calls:
+                    print(f"🔧 [PROVEDOR_LOCAL] Resposta contém {len(tool_calls)} tool_calls")
+
+                # Atualizar estatísticas
+                ProvedorLLMService._atualizar_estatisticas(provedor_id, True, tempo_geracao)
+
+                return RespostaLLM(
+                    conteudo=dados["conteudo"] or "",
+                    modelo=requisicao.modelo,
+                    tokens_usados=dados["tokens_usados"],
+                    tempo_geracao_ms=tempo_geracao,
+                    tool_calls=tool_calls,
+                    finish_reason=dados["finish_reason"]
+                )
+            else:
+                ProvedorLLMService._atualizar_estatisticas(provedor_id, False, tempo_geracao)
+                erro_msg = response.text if response else "Nenhuma resposta do servidor"
+                status_code = response.status_code if response else "N/A"
+                raise Exception(f"Erro HTTP {status_code}: {erro_msg}")
 
         except Exception as e:
-            ProvedorLLMService._atualizar_estatisticas(db, provedor_id, False, 0)
+            ProvedorLLMService._atualizar_estatisticas(provedor_id, False, 0)
             raise e
 
+    # Fila de estatísticas: gravadas em lote por uma thread de fundo, fora do caminho da
+    # resposta. As requisições chegam de várias threads (cada mensagem do WhatsApp tem
+    # o próprio event loop), por isso uma fila de threads em vez de uma asyncio.Queue
+    _fila_estatisticas: "queue.SimpleQueue[Optional[tuple]]" = queue.SimpleQueue()
+    _worker_estatisticas: Optional[threading.Thread] = None
+    _worker_lock = threading.Lock()
+    ESTATISTICAS_LOTE_MAX = 100
+    ESTATISTICAS_INTERVALO = 0.1
+
+    @classmethod
+    def iniciar_worker_estatisticas(cls):
+        """Inicia a thread de estatísticas (se ainda não estiver rodando)."""
+        with cls._worker_lock:
+            if cls._worker_estatisticas is not None and cls._worker_estatisticas.is_alive():
+                return
+            cls._worker_estatisticas = threading.Thread(
+                target=cls._worker, name="estatisticas-provedores", daemon=True
+            )
+            cls._worker_estatisticas.start()
+
+    @classmethod
+    def _worker(cls):
+        """Consome a fila de estatísticas, agregando por provedor e gravando em lote."""
+        fila = cls._fila_estatisticas
+        encerrar = False
+        while not encerrar:
+            lote = [fila.get()]
+            while len(lote) < cls.ESTATISTICAS_LOTE_MAX:
+                try:
+                    lote.append(fila.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # None é o sinal de encerramento (enviado por parar_worker_estatisticas)
+            encerrar = None in lote
+            lote = [item for item in lote if item is not None]
+            
+            if lote:
+                try:
+                    cls._gravar_estatisticas(lote)
+                except Exception as e:
+                    print(f"⚠️  Erro ao gravar estatísticas de provedores: {e}")
+            
+            if not encerrar:
+                time.sleep(cls.ESTATISTICAS_INTERVALO)
+
+    @classmethod
+    async def parar_worker_estatisticas(cls):
+        """Grava o que restou na fila e encerra a thread (chamado no shutdown da aplicação)."""
+        worker = cls._worker_estatisticas
+        if worker is not None and worker.is_alive():
+            cls._fila_estatisticas.put(None)
+            await asyncio.to_thread(worker.join)
+        cls._worker_estatisticas = None
+
     @staticmethod
-    def _atualizar_estatisticas(db: Session, provedor_id: int, sucesso: bool, tempo_ms: float):
-        """Atualiza estatísticas do provedor."""
-        stats = db.query(EstatisticasProvedor).filter(
-            EstatisticasProvedor.provedor_id == provedor_id
-        ).first()
-        
-        if not stats:
-            stats = EstatisticasProvedor(provedor_id=provedor_id)
-            db.add(stats)
-        
-        stats.total_requisicoes += 1
-        if sucesso:
-            stats.requisicoes_sucesso += 1
-        else:
-            stats.requisicoes_erro += 1
+    def _atualizar_estatisticas(provedor_id: int, sucesso: bool, tempo_ms: float):
+        """Enfileira uma requisição para as estatísticas do provedor (não bloqueia)."""
+        ProvedorLLMService.iniciar_worker_estatisticas()
+        ProvedorLLMService._fila_estatisticas.put((provedor_id, sucesso, tempo_ms))
+
+    @staticmethod
+    def _gravar_estatisticas(lote: List[tuple]):
+        """Grava um lote de (provedor_id, sucesso, tempo_ms): um UPDATE por provedor."""
+        from database import SessionLocal
         
-        # Calcular tempo médio
-        if stats.tempo_medio_ms == 0:
-            stats.tempo_medio_ms = tempo_ms
-        else:
-            stats.tempo_medio_ms = (stats.tempo_medio_ms + tempo_ms) / 2
+        # provedor_id -> [requisições, sucessos, soma dos tempos]
+        agregado: Dict[int, list] = {}
+        for provedor_id, sucesso, tempo_ms in lote:
+            acumulado = agregado.setdefault(provedor_id, [0, 0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += 1 if sucesso else 0
+            acumulado[2] += tempo_ms
         
-        stats.ultima_requisicao = datetime.now()
-        db.commit()
+        agora = datetime.now()
+        db = SessionLocal()
+        try:
+            for provedor_id, (n, sucessos, soma_ms) in agregado.items():
+                total = EstatisticasProvedor.total_requisicoes
+                media = EstatisticasProvedor.tempo_medio_ms
+                resultado = db.execute(
+                    update(EstatisticasProvedor)
+                    .where(EstatisticasProvedor.provedor_id == provedor_id)
+                    .values(
+                        total_requisicoes=total + n,
+                        requisicoes_sucesso=EstatisticasProvedor.requisicoes_sucesso + sucessos,
+                        requisicoes_erro=EstatisticasProvedor.requisicoes_erro + (n - sucessos),
+                        # Média incremental do lote: média += (soma - n * média) / (total + n)
+                        tempo_medio_ms=media + (soma_ms - n * media) / (total + n),
+                        ultima_requisicao=agora
+                    )
+                )
+                
+                # Sem linha de estatísticas: cria só se o provedor ainda existir
+                # (o lote pode ser gravado depois de um deletar, que remove as estatísticas)
+                criar_linha = resultado.rowcount == 0 and db.query(ProvedorLLM.id).filter(
+                    ProvedorLLM.id == provedor_id
+                ).first() is not None
+                if criar_linha:
+                    db.add(EstatisticasProvedor(
+                        provedor_id=provedor_id,
+                        total_requisicoes=n,
+                        requisicoes_sucesso=sucessos,
+                        requisicoes_erro=n - sucessos,
+                        tempo_medio_ms=soma_ms / n,
+                        ultima_requisicao=agora
+                    ))
+            db.commit()
+        finally:
+            db.close()
 
     @staticmethod
     def obter_estatisticas(db: Session, provedor_id: int) -> Optional[EstatisticasProvedorSchema]:
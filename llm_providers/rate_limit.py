@@ -0,0 +1,70 @@
+"""
+Limitador de taxa (token bucket) para provedores com cota de requisições/tokens por minuto.
+"""
+import asyncio
+import threading
+import time
+
+
+class AsyncTokenBucket:
+    """
+    Balde de tokens assíncrono.
+    Enche a `taxa` tokens por segundo até `capacidade`; quem pede mais do que há
+    disponível espera (em processo) até o balde reabastecer.
+    
+    Pode ser usado por vários event loops ao mesmo tempo (cada mensagem do WhatsApp
+    roda numa thread com loop próprio): o estado é protegido por um threading.Lock
+    e a espera acontece fora dele.
+    """
+
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = capacidade
+        self._atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def por_minuto(cls, limite: float) -> "AsyncTokenBucket":
+        """Cria um balde para um limite por minuto (permite rajada de até um minuto de cota)."""
+        return cls(taxa=limite / 60.0, capacidade=limite)
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado_em) * self.taxa)
+        self._atualizado_em = agora
+
+    async def adquirir(self, n: float = 1):
+        """Consome `n` tokens, aguardando o reabastecimento se necessário."""
+        # Um pedido maior que o balde nunca seria atendido: limita à capacidade
+        n = min(n, self.capacidade)
+        # Os tokens são reservados na hora (o saldo pode ficar negativo) e cada um espera
+        # só pelo próprio déficit: os pedidos são atendidos em ordem de chegada
+        with self._lock:
+            self._reabastecer()
+            self._tokens -= n
+            espera = -self._tokens / self.taxa if self._tokens < 0 else 0.0
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class LimiteConcorrencia:
+    """
+    Limite de execuções simultâneas (uso com `async with`) válido entre threads:
+    ao contrário de um asyncio.Semaphore, não fica preso a um event loop.
+    Quem não encontra vaga espera em intervalos curtos, sem bloquear o loop.
+    """
+
+    ESPERA_SEGUNDOS = 0.05
+
+    def __init__(self, limite: int):
+        self.limite = limite
+        self._semaforo = threading.BoundedSemaphore(limite)
+
+    async def __aenter__(self) -> "LimiteConcorrencia":
+        while not self._semaforo.acquire(blocking=False):
+            await asyncio.sleep(self.ESPERA_SEGUNDOS)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaforo.release()
@@ -1,13 +1,21 @@
 """
 Configuração de logging para o sistema RAG.
 """
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 from datetime import datetime
 
+# Thread que escreve os registros no console/arquivo (ver setup_logging)
+_listener = None
+
 def setup_logging():
     """Configura o sistema de logging."""
     
+    global _listener
+    
     # Criar logger principal
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
@@ -26,13 +34,20 @@ def setup_logging():
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
     
     # Handler para arquivo (logs específicos do RAG)
     file_handler = logging.FileHandler('rag_processing.log', encoding='utf-8')
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    
+    # Quem loga só enfileira o registro; a escrita (stdout e arquivo) acontece numa
+    # thread de fundo, fora do caminho das requisições e do processamento de mensagens
+    if _listener is not None:
+        _listener.stop()
+    fila = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(fila))
+    _listener = logging.handlers.QueueListener(fila, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
     
     # Configurar loggers específicos
     rag_logger = logging.getLogger('rag')
@@ -50,5 +65,14 @@ def setup_logging():
     
     return logger
 
+def parar_logging():
+    """Descarrega os registros pendentes e encerra a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 # Configurar logging ao importar
 setup_logging()
+atexit.register(parar_logging)
@@ -3,6 +3,7 @@ Fluxi - Seu Assistente Pessoal WhatsApp
 Aplicação principal FastAPI
 """
 import os
+import asyncio
 from fastapi import FastAPI, Request, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -44,6 +45,8 @@ from config.config_service import ConfiguracaoService
 from ferramenta.ferramenta_service import FerramentaService
 from metrica.metrica_service import MetricaService
 from sessao.sessao_service import SessaoService
+from llm_providers.llm_integration_service import LLMIntegrationService
+from llm_providers.llm_providers_service import ProvedorLLMService
 
 # Criar aplicação FastAPI
 app = FastAPI(
@@ -93,6 +96,9 @@ def startup_event():
         ConfiguracaoService.inicializar_configuracoes_padrao(db)
         print("✅ Configurações padrão inicializadas")
         
+        # Pré-carregar configurações no cache
+        ConfiguracaoService.aquecer_cache(db)
+        
         # Inicializar ferramentas padrão
         FerramentaService.criar_ferramentas_padrao(db)
         print("✅ Ferramentas padrão criadas")
@@ -122,6 +128,54 @@ def startup_event():
         db.close()
 
 
+@app.on_event("startup")
+async def iniciar_worker_estatisticas():
+    """Inicia o worker de estatísticas dos provedores."""
+    ProvedorLLMService.iniciar_worker_estatisticas()
+
+
+async def _verificar_provedores():
+    """Testa a conexão com OpenRouter e com o provedor de transcrição em paralelo."""
+    from database import SessionLocal
+    from audio.transcription_service import TranscriptionService
+    
+    db_openrouter = SessionLocal()
+    try:
+        async with asyncio.TaskGroup() as tg:
+            openrouter = tg.create_task(ConfiguracaoService.testar_conexao_openrouter(db_openrouter))
+            transcricao = tg.create_task(TranscriptionService.testar_conexao())
+        
+        resultado = openrouter.result()
+        print(f"{'✅' if resultado.sucesso else '⚠️ '} OpenRouter: {resultado.mensagem}")
+        resultado = transcricao.result()
+        print(f"{'✅' if resultado['sucesso'] else '⚠️ '} Transcrição: {resultado['mensagem']}")
+    except Exception as e:
+        print(f"⚠️  Erro ao verificar provedores: {e}")
+    finally:
+        db_openrouter.close()
+
+
+@app.on_event("startup")
+async def verificar_provedores():
+    """Dispara a verificação dos provedores em segundo plano (não atrasa o startup)."""
+    app.state.verificacao_provedores = asyncio.create_task(_verificar_provedores())
+
+
+# Evento de encerramento
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Libera recursos compartilhados ao encerrar a aplicação."""
+    from audio.transcription_service import TranscriptionService
+    verificacao = getattr(app.state, "verificacao_provedores", None)
+    if verificacao is not None and not verificacao.done():
+        verificacao.cancel()
+    await TranscriptionService.fechar_client()
+    await ConfiguracaoService.fechar_client()
+    await LLMIntegrationService.fechar_client()
+    await ProvedorLLMService.parar_worker_estatisticas()
+    await ProvedorLLMService.fechar_client()
+
+
 # Registrar routers API
 app.include_router(config_api_router)
 app.include_router(sessao_api_router)
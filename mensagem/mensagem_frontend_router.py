@@ -5,6 +5,7 @@ from fastapi import APIRouter, Depends, Request, Query
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+from typing import Optional
 from database import get_db
 from mensagem.mensagem_service import MensagemService
 from sessao.sessao_service import SessaoService
@@ -12,6 +13,9 @@ from sessao.sessao_service import SessaoService
 router = APIRouter(prefix="/mensagens", tags=["Frontend - Mensagens"])
 templates = Jinja2Templates(directory="templates")
 
+# Mensagens por página na tela de conversa
+MENSAGENS_POR_PAGINA = 50
+
 
 @router.get("/sessao/{sessao_id}", response_class=HTMLResponse)
 def pagina_historico_sessao(
@@ -47,6 +51,7 @@ def pagina_conversa_cliente(
     sessao_id: int,
     telefone: str,
     request: Request,
+    antes_de: Optional[int] = Query(None, description="Cursor: id da mensagem mais antiga já exibida"),
     db: Session = Depends(get_db)
 ):
     """Página de conversa com um cliente específico (estilo chat)."""
@@ -58,16 +63,16 @@ def pagina_conversa_cliente(
             "titulo": "Erro"
         })
     
-    # Listar mensagens em ordem cronológica (mais antigas primeiro)
-    mensagens = MensagemService.listar_conversa_completa(db, sessao_id, telefone, limite=200)
+    # Página de mensagens em ordem cronológica (as mais recentes antes do cursor)
+    mensagens = MensagemService.listar_conversa_pagina(
+        db, sessao_id, telefone, antes_de_id=antes_de, limite=MENSAGENS_POR_PAGINA
+    )
+    
+    # Página cheia: pode haver mensagens mais antigas
+    proximo_cursor = mensagens[0].id if len(mensagens) == MENSAGENS_POR_PAGINA else None
     
     # Obter nome do cliente (se disponível)
-    nome_cliente = None
-    if mensagens:
-        for msg in mensagens:
-            if msg.nome_cliente:
-                nome_cliente = msg.nome_cliente
-                break
+    nome_cliente = MensagemService.obter_nome_cliente(db, sessao_id, telefone)
     
     return templates.TemplateResponse("mensagem/conversa.html", {
         "request": request,
@@ -75,5 +80,6 @@ def pagina_conversa_cliente(
         "telefone": telefone,
         "nome_cliente": nome_cliente,
         "mensagens": mensagens,
+        "proximo_cursor": proximo_cursor,
         "titulo": f"Conversa - {nome_cliente or telefone}"
     })
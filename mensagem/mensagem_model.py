@@ -1,10 +1,10 @@
 """
 Modelo de dados para mensagens.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-from database import Base
+from database import Base, extensao_pg_instalada
 
 
 class Mensagem(Base):
@@ -56,6 +56,21 @@ class Mensagem(Base):
     processado_em = Column(DateTime(timezone=True), nullable=True)
     respondido_em = Column(DateTime(timezone=True), nullable=True)
     
+    __table_args__ = (
+        # Filtros por sessão (e cliente) ordenados por data viram varredura de índice, sem ordenação extra
+        Index("ix_msg_sess_tel_criado", sessao_id, telefone_cliente, criado_em.desc()),
+        Index("ix_msg_sess_criado", sessao_id, criado_em.desc()),
+        # Busca por trecho (ILIKE '%termo%'): só o PostgreSQL com pg_trgm indexa isso;
+        # nos outros bancos o índice seria um b-tree inútil sobre texto longo.
+        # Sem a extensão instalada, o índice é pulado (o restante do schema é criado)
+        Index(
+            "ix_msg_conteudo_trgm",
+            conteudo_texto,
+            postgresql_using="gin",
+            postgresql_ops={"conteudo_texto": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql", callable_=extensao_pg_instalada("pg_trgm")),
+    )
+    
     # Relacionamentos
     sessao = relationship("Sessao", back_populates="mensagens")
 
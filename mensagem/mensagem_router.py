@@ -2,8 +2,10 @@
 Rotas da API para mensagens.
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from typing import List
+from pathlib import Path
 from database import get_db
 from mensagem.mensagem_schema import MensagemResposta, MensagemEnviar, HistoricoMensagens
 from mensagem.mensagem_service import MensagemService
@@ -39,6 +41,17 @@ def listar_mensagens_cliente(
     )
 
 
+@router.get("/sessao/{sessao_id}/busca", response_model=List[MensagemResposta])
+def buscar_mensagens_sessao(
+    sessao_id: int,
+    q: str = Query(..., min_length=3),
+    limite: int = Query(default=50, le=200),
+    db: Session = Depends(get_db)
+):
+    """Busca mensagens de uma sessão por trecho do texto."""
+    return MensagemService.buscar_texto(db, sessao_id, q, limite)
+
+
 @router.get("/{mensagem_id}", response_model=MensagemResposta)
 def obter_mensagem(mensagem_id: int, db: Session = Depends(get_db)):
     """Obtém uma mensagem específica."""
@@ -48,6 +61,15 @@ def obter_mensagem(mensagem_id: int, db: Session = Depends(get_db)):
     return mensagem
 
 
+@router.get("/{mensagem_id}/imagem")
+def obter_imagem_mensagem(mensagem_id: int, db: Session = Depends(get_db)):
+    """Retorna o arquivo da imagem de uma mensagem."""
+    mensagem = MensagemService.obter_por_id(db, mensagem_id)
+    if not mensagem or not mensagem.conteudo_imagem_path or not Path(mensagem.conteudo_imagem_path).is_file():
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    return FileResponse(mensagem.conteudo_imagem_path, media_type="image/jpeg")
+
+
 @router.post("/enviar")
 def enviar_mensagem(mensagem: MensagemEnviar, db: Session = Depends(get_db)):
     """Envia uma mensagem através de uma sessão."""
@@ -1,19 +1,194 @@
 """
 Serviço de lógica de negócio para mensagens.
 """
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, load_only
 from typing import Optional, List
 from datetime import datetime, timedelta
 import os
+import asyncio
 import base64
+import itertools
+import logging
+import time
 from pathlib import Path
 from PIL import Image
 import io
+import httpx
 from neonize.events import MessageEv
 from mensagem.mensagem_model import Mensagem
 from mensagem.mensagem_schema import MensagemCriar
 from config.config_service import ConfiguracaoService
 
+# libvips (libjpeg-turbo com SIMD) para recodificar imagens; opcional, com fallback para o Pillow
+try:
+    import pyvips
+    PYVIPS_AVAILABLE = True
+except (ImportError, OSError):
+    PYVIPS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+# Campos de mídia do protobuf e o tipo correspondente, na ordem de prioridade
+# (áudio ANTES de imagem: áudio pode ter campos parecidos)
+_CAMPOS_TIPO_MENSAGEM = (
+    ('extendedTextMessage', "texto"),
+    ('audioMessage', "audio"),
+    ('imageMessage', "imagem"),
+    ('videoMessage', "video"),
+    ('stickerMessage', "sticker"),
+    ('locationMessage', "localizacao"),
+    ('documentMessage', "documento"),
+)
+
+
+# Sufixo sequencial dos nomes de arquivo (next() é atômico sob o GIL)
+_CONTADOR_ARQUIVOS = itertools.count()
+
+
+def _nome_arquivo(prefixo: str, ext: str) -> str:
+    """
+    Nome único para um arquivo de mídia recebido.
+    Duas mensagens no mesmo segundo não colidem.
+    """
+    return f"{prefixo}_{time.time_ns()}_{next(_CONTADOR_ARQUIVOS)}.{ext}"
+
+
+# Blocos de leitura múltiplos de 3: cada bloco vira base64 sem padding intermediário
+_BASE64_BLOCO = 48 * 1024
+
+
+def _base64_arquivo(caminho: Path) -> str:
+    """
+    Codifica um arquivo em base64 lendo em blocos, sem carregar os bytes
+    brutos inteiros na memória (a saída é pré-alocada no tamanho final).
+    """
+    tamanho = caminho.stat().st_size
+    saida = bytearray(((tamanho + 2) // 3) * 4)
+    pos = 0
+    with open(caminho, 'rb') as arquivo:
+        while bloco := arquivo.read(_BASE64_BLOCO):
+            codificado = base64.b64encode(bloco)
+            saida[pos:pos + len(codificado)] = codificado
+            pos += len(codificado)
+    # Se o arquivo mudou de tamanho durante a leitura, descarta a sobra
+    del saida[pos:]
+    return saida.decode('ascii')
+
+
+_ERRO_CONFIGURACAO = (
+    "⚙️ O sistema não está configurado corretamente.\n"
+    "Por favor, contate o administrador."
+)
+_ERRO_CONEXAO = (
+    "🌐 Problema de conexão com o servidor.\n"
+    "Tente novamente em alguns instantes."
+)
+_ERRO_LIMITE = (
+    "⏱️ Muitas requisições.\n"
+    "Aguarde um momento e tente novamente."
+)
+
+# Erros identificados pelo tipo (o AgenteService relança como ValueError,
+# então a causa original é procurada na cadeia __cause__/__context__)
+_ERROS_POR_TIPO = {
+    httpx.TransportError: _ERRO_CONEXAO,  # timeouts, falhas de conexão e de rede
+}
+
+
+def _mensagem_erro_usuario(erro: Exception) -> str:
+    """Monta a mensagem de erro amigável enviada ao cliente do WhatsApp."""
+    erro_msg = "❌ *Erro ao processar sua mensagem*\n\n"
+    
+    causa, profundidade = erro, 0
+    while causa is not None and profundidade < 5:
+        for tipo, texto in _ERROS_POR_TIPO.items():
+            if isinstance(causa, tipo):
+                return erro_msg + texto
+        causa = causa.__cause__ or causa.__context__
+        profundidade += 1
+    
+    # Erros sem tipo próprio (ValueError com a descrição): identificar pelo texto
+    erro_str = str(erro).lower()
+    if "api key" in erro_str or "openrouter" in erro_str:
+        return erro_msg + _ERRO_CONFIGURACAO
+    if "timeout" in erro_str or "connection" in erro_str:
+        return erro_msg + _ERRO_CONEXAO
+    if "rate limit" in erro_str:
+        return erro_msg + _ERRO_LIMITE
+    return erro_msg + f"🔧 Erro técnico: {str(erro)[:100]}\nPor favor, tente novamente ou contate o suporte."
+
+
+def _enviar_async(cliente, jid, texto: str) -> asyncio.Task:
+    """
+    Envia uma mensagem de texto numa thread (o send_message do neonize é bloqueante),
+    liberando o loop enquanto o envio está em andamento.
+    """
+    return asyncio.create_task(asyncio.to_thread(cliente.send_message, jid, message=texto))
+
+
+async def _fechar_clients_do_loop():
+    """
+    Fecha os clientes HTTP abertos no event loop desta mensagem: o loop da thread
+    é fechado ao final, e as conexões presas a ele não servem para nenhum outro.
+    """
+    from audio.transcription_service import TranscriptionService
+    from llm_providers.llm_integration_service import LLMIntegrationService
+    from llm_providers.llm_providers_service import ProvedorLLMService
+    
+    resultados = await asyncio.gather(
+        TranscriptionService.fechar_client(),
+        LLMIntegrationService.fechar_client(),
+        ProvedorLLMService.fechar_client(),
+        return_exceptions=True
+    )
+    for resultado in resultados:
+        if isinstance(resultado, Exception):
+            logger.error("Erro ao fechar cliente HTTP: %s", resultado)
+
+
+# Diretórios de upload já criados: (base, sessao_id, telefone)
+_DIRETORIOS_CRIADOS: set = set()
+
+
+def _diretorio_uploads(upload_base: str, sessao_id: int, telefone: str) -> str:
+    """
+    Diretório de uploads de um cliente, criado na primeira vez que é usado.
+    Depois disso não há mais makedirs (nem syscall) por mensagem.
+    """
+    diretorio = os.path.join(upload_base, f"sessao_{sessao_id}", telefone)
+    chave = (upload_base, sessao_id, telefone)
+    if chave not in _DIRETORIOS_CRIADOS:
+        os.makedirs(diretorio, exist_ok=True)
+        _DIRETORIOS_CRIADOS.add(chave)
+    return diretorio
+
+
+def _gravar_bytes(caminho: str, dados: bytes):
+    """Grava um arquivo, recriando o diretório se ele foi removido depois de memorizado."""
+    try:
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(dados)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(dados)
+
+
+def _tem_campo(message, campo: str) -> bool:
+    """
+    Verifica se o submessage `campo` está presente na mensagem.
+    HasField é um teste de presença (O(1)); ByteSize() serializaria o conteúdo
+    inteiro só para medir o tamanho.
+    """
+    try:
+        return message.HasField(campo)
+    except (ValueError, AttributeError):
+        # Campo não declarado com presença (ou objeto que não é protobuf)
+        valor = getattr(message, campo, None)
+        return bool(valor and (getattr(valor, 'mimetype', None) or getattr(valor, 'url', None)))
+
 
 class MensagemService:
     """Serviço para gerenciar mensagens."""
@@ -50,6 +225,36 @@ class MensagemService:
             .limit(limite)\
             .all()
 
+    @staticmethod
+    def listar_historico_para_agente(
+        db: Session,
+        sessao_id: int,
+        telefone_cliente: str,
+        limite: int = 10
+    ) -> List[Mensagem]:
+        """
+        Histórico de um cliente para montar o prompt do agente.
+        Carrega só as colunas usadas em AgenteService.construir_historico_mensagens;
+        o base64 legado (coluna grande) fica adiado e só é lido para mensagens de imagem.
+        """
+        return db.query(Mensagem)\
+            .options(load_only(
+                Mensagem.direcao,
+                Mensagem.tipo,
+                Mensagem.conteudo_texto,
+                Mensagem.resposta_texto,
+                Mensagem.conteudo_imagem_path,
+                Mensagem.conteudo_mime_type,
+                Mensagem.criado_em
+            ))\
+            .filter(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.telefone_cliente == telefone_cliente
+            )\
+            .order_by(Mensagem.criado_em.desc())\
+            .limit(limite)\
+            .all()
+
     @staticmethod
     def obter_por_id(db: Session, mensagem_id: int) -> Optional[Mensagem]:
         """Obtém uma mensagem pelo ID."""
@@ -65,92 +270,157 @@ class MensagemService:
         return db_mensagem
 
     @staticmethod
-    def salvar_imagem(imagem_bytes: bytes, telefone: str, sessao_id: int, db: Session = None) -> tuple[str, str]:
+    def _precisa_recodificar(imagem_bytes: bytes) -> bool:
+        """
+        Identifica o formato pelos bytes mágicos, sem instanciar o Pillow.
+        
+        JPEG é gravado como está; PNG, WebP, GIF (e formatos desconhecidos)
+        passam pelo Pillow para virar JPEG.
+        """
+        # Marcador SOI do JPEG (JPEG não tem canal alfa, então não precisa de conversão)
+        return imagem_bytes[:3] != b'\xff\xd8\xff'
+
+    @staticmethod
+    def salvar_imagem(
+        imagem_bytes: bytes,
+        telefone: str,
+        sessao_id: int,
+        db: Session = None,
+        need_base64: bool = False
+    ) -> tuple[str, Optional[str]]:
         """
-        Salva uma imagem localmente e retorna o caminho e base64.
+        Salva uma imagem localmente e retorna o caminho (e o base64, se pedido).
+        
+        O base64 só é calculado com need_base64=True; nos demais casos ele é
+        obtido sob demanda a partir do arquivo (ver obter_base64).
         
         Returns:
-            tuple: (caminho_arquivo, base64_string)
+            tuple: (caminho_arquivo, base64_string ou None)
         """
         # Obter diretório de uploads configurável
         if db:
-            upload_base = ConfiguracaoService.obter_valor(db, "sistema_diretorio_uploads", "./uploads")
-            qualidade_jpeg = ConfiguracaoService.obter_valor(db, "sistema_qualidade_jpeg", 85)
+            # Uma única consulta quando as chaves não estão no cache de configurações
+            valores = ConfiguracaoService.obter_valores_bulk(
+                db,
+                ["sistema_diretorio_uploads", "sistema_qualidade_jpeg"],
+                {"sistema_diretorio_uploads": "./uploads", "sistema_qualidade_jpeg": 85}
+            )
+            upload_base = valores["sistema_diretorio_uploads"]
+            qualidade_jpeg = valores["sistema_qualidade_jpeg"]
         else:
             upload_base = "./uploads"
             qualidade_jpeg = 85
         
-        # Criar diretório se não existir
-        upload_dir = Path(upload_base) / f"sessao_{sessao_id}" / telefone
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Gerar nome único para arquivo
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"img_{timestamp}.jpg"
-        filepath = upload_dir / filename
+        # Criar diretório se não existir e gerar nome único para arquivo
+        upload_dir = _diretorio_uploads(upload_base, sessao_id, telefone)
+        filepath = os.path.join(upload_dir, _nome_arquivo("img", "jpg"))
         
         # Salvar imagem
         try:
-            # Abrir e converter para RGB (caso seja RGBA)
+            try:
+                MensagemService._gravar_imagem(imagem_bytes, filepath, int(qualidade_jpeg))
+            except FileNotFoundError:
+                # Diretório removido depois de ter sido criado (e memorizado): recria e tenta de novo
+                os.makedirs(upload_dir, exist_ok=True)
+                MensagemService._gravar_imagem(imagem_bytes, filepath, int(qualidade_jpeg))
+            
+            base64_string = base64.b64encode(imagem_bytes).decode('utf-8') if need_base64 else None
+            
+            return filepath, base64_string
+        except Exception as e:
+            logger.error("Erro ao salvar imagem: %s", e)
+            return None, None
+
+    @staticmethod
+    def _gravar_imagem(imagem_bytes: bytes, filepath: str, qualidade_jpeg: int):
+        """Grava a imagem como JPEG em `filepath` (recodificando só quando necessário)."""
+        if not MensagemService._precisa_recodificar(imagem_bytes):
+            # Já é JPEG (caso comum no WhatsApp): grava os bytes sem decodificar/recodificar
+            with open(filepath, 'wb') as arquivo:
+                arquivo.write(imagem_bytes)
+        elif PYVIPS_AVAILABLE:
+            # PNG/WebP/GIF via libvips: remove o alfa e grava JPEG progressivo com Huffman otimizado
+            img = pyvips.Image.new_from_buffer(imagem_bytes, "")
+            if img.hasalpha():
+                img = img.flatten()
+            img.write_to_file(
+                filepath,
+                Q=qualidade_jpeg,
+                optimize_coding=True,
+                interlace=True,
+                strip=True
+            )
+        else:
+            # PNG/WebP/GIF: abrir e converter para RGB (caso tenha alfa/paleta)
             img = Image.open(io.BytesIO(imagem_bytes))
             if img.mode in ('RGBA', 'LA', 'P'):
                 img = img.convert('RGB')
             
             # Salvar com qualidade configurável
-            img.save(filepath, 'JPEG', quality=int(qualidade_jpeg))
-            
-            # Converter para base64
-            base64_string = base64.b64encode(imagem_bytes).decode('utf-8')
-            
-            return str(filepath), base64_string
-        except Exception as e:
-            print(f"Erro ao salvar imagem: {e}")
-            return None, None
+            img.save(filepath, 'JPEG', quality=qualidade_jpeg, optimize=True, progressive=True)
+
+    @staticmethod
+    def obter_base64(mensagem: Mensagem) -> Optional[str]:
+        """
+        Retorna o base64 da imagem de uma mensagem.
+        
+        Mensagens antigas ainda trazem o base64 gravado no banco; as novas só
+        guardam o caminho, e o arquivo é lido e codificado quando necessário.
+        """
+        if mensagem.conteudo_imagem_base64:
+            return mensagem.conteudo_imagem_base64
+        if not mensagem.conteudo_imagem_path:
+            return None
+        try:
+            return _base64_arquivo(Path(mensagem.conteudo_imagem_path))
+        except OSError as e:
+            logger.error("Erro ao ler imagem %s: %s", mensagem.conteudo_imagem_path, e)
+            return None
+
+    @staticmethod
+    def obter_data_url_imagem(mensagem: Mensagem) -> Optional[str]:
+        """Monta a data URL (data:<mime>;base64,...) da imagem de uma mensagem."""
+        base64_string = MensagemService.obter_base64(mensagem)
+        if not base64_string:
+            return None
+        if mensagem.conteudo_imagem_base64:
+            mime_type = mensagem.conteudo_mime_type or "image/jpeg"
+        else:
+            # O arquivo salvo é sempre JPEG (repassado ou recodificado)
+            mime_type = "image/jpeg"
+        return f"data:{mime_type};base64,{base64_string}"
 
     @staticmethod
     def _detectar_tipo_mensagem(message) -> str:
         """Detecta o tipo de uma mensagem do WhatsApp."""
-        # Função auxiliar para verificar se campo protobuf tem conteúdo
-        def tem_conteudo(campo):
-            if not campo:
-                return False
-            # Verificar se tem algum campo preenchido (mime_type, url, etc.)
-            if hasattr(campo, 'mimetype') and campo.mimetype:
-                return True
-            if hasattr(campo, 'url') and campo.url:
-                return True
-            if hasattr(campo, 'fileSha256') and campo.fileSha256:
-                return True
-            # Para protobuf, verificar se não está vazio
-            try:
-                return campo.ByteSize() > 0
-            except:
-                return bool(campo)
-        
-        # Verificar texto primeiro
-        if hasattr(message, 'conversation') and message.conversation:
-            return "texto"
-        if hasattr(message, 'extendedTextMessage') and tem_conteudo(message.extendedTextMessage):
+        # Verificar texto primeiro (campo escalar, dispensa a checagem de conteúdo)
+        if getattr(message, 'conversation', None):
             return "texto"
         
-        # Verificar áudio ANTES de imagem (áudio pode ter campos parecidos)
-        if hasattr(message, 'audioMessage') and tem_conteudo(message.audioMessage):
-            return "audio"
-        
-        # Verificar outros tipos de mídia
-        if hasattr(message, 'imageMessage') and tem_conteudo(message.imageMessage):
-            return "imagem"
-        if hasattr(message, 'videoMessage') and tem_conteudo(message.videoMessage):
-            return "video"
-        if hasattr(message, 'stickerMessage') and tem_conteudo(message.stickerMessage):
-            return "sticker"
-        if hasattr(message, 'locationMessage') and tem_conteudo(message.locationMessage):
-            return "localizacao"
-        if hasattr(message, 'documentMessage') and tem_conteudo(message.documentMessage):
-            return "documento"
+        for campo, tipo in _CAMPOS_TIPO_MENSAGEM:
+            if _tem_campo(message, campo):
+                return tipo
         
         return "texto"  # Default
     
+    @staticmethod
+    def _extrair_telefone(message_source) -> str:
+        """
+        Extrai o telefone do cliente da origem da mensagem.
+        Prioridade: SenderAlt (número real) > Sender (pode ser "lid" interno).
+        """
+        sender_alt = getattr(message_source, 'SenderAlt', None)
+        if sender_alt and getattr(sender_alt, 'Server', None) == "s.whatsapp.net":
+            usuario = getattr(sender_alt, 'User', None)
+            if usuario:
+                return usuario
+        
+        sender_jid = message_source.Sender
+        usuario = getattr(sender_jid, 'User', None)
+        if usuario is not None:
+            return usuario
+        return str(sender_jid).partition('@')[0]
+    
     @staticmethod
     async def processar_mensagem_recebida(
         db: Session,
@@ -160,6 +430,28 @@ class MensagemService:
         """
         Processa uma mensagem recebida do WhatsApp.
         """
+        envios: List[asyncio.Task] = []
+        try:
+            await MensagemService._processar_mensagem(db, sessao_id, event, envios)
+        finally:
+            # Aguarda os envios disparados em segundo plano antes de o loop da thread ser fechado
+            if envios:
+                for resultado in await asyncio.gather(*envios, return_exceptions=True):
+                    if isinstance(resultado, Exception):
+                        logger.error("Erro ao enviar mensagem: %s", resultado)
+            await _fechar_clients_do_loop()
+    
+    @staticmethod
+    async def _processar_mensagem(
+        db: Session,
+        sessao_id: int,
+        event: MessageEv,
+        envios: List[asyncio.Task]
+    ):
+        """
+        Corpo de processar_mensagem_recebida. Respostas cujo resultado não importa
+        (comandos, respostas fixas) são enviadas em segundo plano e entram em `envios`.
+        """
         from sessao.sessao_service import SessaoService
         from sessao.sessao_tipo_mensagem_service import SessaoTipoMensagemService
         from agente.agente_service import AgenteService
@@ -167,25 +459,9 @@ class MensagemService:
         # Obter informações da mensagem
         message = event.Message
         info = event.Info
-        message_source = info.MessageSource
-        sender_jid = message_source.Sender
         
         # Extrair telefone do cliente
-        # Prioridade: SenderAlt (número real) > Sender (pode ser "lid" interno)
-        if hasattr(message_source, 'SenderAlt') and message_source.SenderAlt:
-            sender_alt = message_source.SenderAlt
-            if hasattr(sender_alt, 'Server') and sender_alt.Server == "s.whatsapp.net":
-                if hasattr(sender_alt, 'User') and sender_alt.User:
-                    telefone_cliente = sender_alt.User
-                else:
-                    telefone_cliente = sender_jid.User if hasattr(sender_jid, 'User') else str(sender_jid)
-            else:
-                telefone_cliente = sender_jid.User if hasattr(sender_jid, 'User') else str(sender_jid)
-        else:
-            if hasattr(sender_jid, 'User'):
-                telefone_cliente = sender_jid.User
-            else:
-                telefone_cliente = str(sender_jid).split('@')[0] if '@' in str(sender_jid) else str(sender_jid)
+        telefone_cliente = MensagemService._extrair_telefone(info.MessageSource)
         
         # Obter sessão
         sessao = SessaoService.obter_por_id(db, sessao_id)
@@ -198,7 +474,7 @@ class MensagemService:
         
         # Se for ignorar e não for texto, retornar
         if tipo_mensagem != "texto" and config_tipo["acao"] == "ignorar":
-            print(f"🚫 Ignorando mensagem do tipo: {tipo_mensagem}")
+            logger.debug("🚫 Ignorando mensagem do tipo: %s", tipo_mensagem)
             return
         
         # Se for resposta fixa, enviar e retornar
@@ -208,10 +484,13 @@ class MensagemService:
             cliente = gerenciador_sessoes.obter_cliente(sessao_id)
             if cliente:
                 jid = build_jid(telefone_cliente)
-                cliente.send_message(jid, message=config_tipo["resposta_fixa"])
-                print(f"📤 Resposta fixa enviada para {tipo_mensagem}")
+                envios.append(_enviar_async(cliente, jid, config_tipo["resposta_fixa"]))
+                logger.debug("📤 Resposta fixa enviada para %s", tipo_mensagem)
             return
         
+        # Falso quando a mensagem já foi tratada e só precisa ser gravada
+        processar_com_agente = True
+        
         # Criar registro de mensagem
         db_mensagem = Mensagem(
             sessao_id=sessao_id,
@@ -228,11 +507,13 @@ class MensagemService:
             # Mensagem de texto
             db_mensagem.conteudo_texto = message.conversation
             db_mensagem.tipo = "texto"
-            print(f"📝 Mensagem de texto: {message.conversation[:50]}...")
+            logger.debug("📝 Mensagem de texto: %.50s...", message.conversation)
             
             # Verificar comandos personalizáveis
             from sessao.sessao_comando_service import SessaoComandoService
-            comando_encontrado = SessaoComandoService.obter_por_gatilho(db, sessao_id, message.conversation.strip())
+            # Uma leitura do campo protobuf e um strip para o despacho inteiro
+            texto_comando = message.conversation.strip()
+            comando_encontrado = SessaoComandoService.obter_por_gatilho(db, sessao_id, texto_comando)
             
             if comando_encontrado:
                 from sessao.sessao_service import gerenciador_sessoes
@@ -242,27 +523,27 @@ class MensagemService:
                 
                 # Processar comando baseado no tipo
                 if comando_encontrado.comando_id == "ativar":
-                    print(f"🤖 Comando {comando_encontrado.gatilho} - Ativando IA")
+                    logger.debug("🤖 Comando %s - Ativando IA", comando_encontrado.gatilho)
                     sessao.auto_responder = True
                     db.commit()
                     
                     if cliente and jid:
                         resposta = comando_encontrado.resposta or "🤖 *IA Ativada!*"
-                        cliente.send_message(jid, message=resposta)
+                        envios.append(_enviar_async(cliente, jid, resposta))
                     return
                 
                 elif comando_encontrado.comando_id == "desativar":
-                    print(f"😴 Comando {comando_encontrado.gatilho} - Desativando IA")
+                    logger.debug("😴 Comando %s - Desativando IA", comando_encontrado.gatilho)
                     sessao.auto_responder = False
                     db.commit()
                     
                     if cliente and jid:
                         resposta = comando_encontrado.resposta or "😴 *IA Desativada!*"
-                        cliente.send_message(jid, message=resposta)
+                        envios.append(_enviar_async(cliente, jid, resposta))
                     return
                 
                 elif comando_encontrado.comando_id == "limpar":
-                    print(f"🧹 Comando {comando_encontrado.gatilho} recebido de {telefone_cliente}")
+                    logger.debug("🧹 Comando %s recebido de %s", comando_encontrado.gatilho, telefone_cliente)
                     
                     # Deletar histórico
                     mensagens_deletadas = db.query(Mensagem)\
@@ -272,22 +553,22 @@ class MensagemService:
                         )\
                         .delete()
                     db.commit()
-                    print(f"✅ {mensagens_deletadas} mensagem(ns) deletada(s)")
+                    logger.debug("✅ %s mensagem(ns) deletada(s)", mensagens_deletadas)
                     
                     if cliente and jid:
                         resposta = comando_encontrado.resposta or "🧹 *Histórico limpo!*\n\nSeu histórico de conversas foi apagado."
-                        cliente.send_message(jid, message=resposta)
+                        envios.append(_enviar_async(cliente, jid, resposta))
                     return
                 
                 elif comando_encontrado.comando_id == "ajuda":
-                    print(f"ℹ️  Comando {comando_encontrado.gatilho} recebido de {telefone_cliente}")
+                    logger.debug("ℹ️  Comando %s recebido de %s", comando_encontrado.gatilho, telefone_cliente)
                     if cliente and jid:
                         ajuda_texto = SessaoComandoService.gerar_texto_ajuda(db, sessao_id)
-                        cliente.send_message(jid, message=ajuda_texto)
+                        envios.append(_enviar_async(cliente, jid, ajuda_texto))
                     return
                 
                 elif comando_encontrado.comando_id == "status":
-                    print(f"📊 Comando {comando_encontrado.gatilho} recebido de {telefone_cliente}")
+                    logger.debug("📊 Comando %s recebido de %s", comando_encontrado.gatilho, telefone_cliente)
                     if cliente and jid:
                         from agente.agente_service import AgenteService
                         total_msgs = db.query(Mensagem).filter(
@@ -303,19 +584,18 @@ class MensagemService:
                         
                         ia_status = "🟢 Ativada" if sessao.auto_responder else "🔴 Desativada"
                         status_texto = f"📊 *Status da Sessão:*\n\n🤖 IA: {ia_status}\n💬 Mensagens: {total_msgs}\n👤 Agente: {agente_nome}"
-                        cliente.send_message(jid, message=status_texto)
+                        envios.append(_enviar_async(cliente, jid, status_texto))
                     return
                 
                 elif comando_encontrado.comando_id == "listar":
-                    print(f"📋 Comando {comando_encontrado.gatilho} recebido de {telefone_cliente}")
+                    logger.debug("📋 Comando %s recebido de %s", comando_encontrado.gatilho, telefone_cliente)
                     if cliente and jid:
                         from agente.agente_service import AgenteService
                         agentes = AgenteService.listar_por_sessao_ativos(db, sessao_id)
                         
                         if agentes:
-                            comandos = SessaoComandoService.obter_comandos_dict(db, sessao_id)
-                            prefixo = comandos.get("trocar_agente", {})
-                            prefixo = prefixo.gatilho if hasattr(prefixo, 'gatilho') else "#"
+                            cmd_trocar = SessaoComandoService.obter_comando(db, sessao_id, "trocar_agente")
+                            prefixo = cmd_trocar.gatilho if cmd_trocar else "#"
                             
                             lista_texto = "🤖 *Agentes Disponíveis:*\n\n"
                             for agente in agentes:
@@ -327,15 +607,15 @@ class MensagemService:
                         else:
                             lista_texto = "⚠️ *Nenhum agente disponível*"
                         
-                        cliente.send_message(jid, message=lista_texto)
+                        envios.append(_enviar_async(cliente, jid, lista_texto))
                     return
                 
                 elif comando_encontrado.comando_id == "trocar_agente":
                     codigo_agente = SessaoComandoService.extrair_codigo_agente(
-                        message.conversation.strip(), 
+                        texto_comando,
                         comando_encontrado.gatilho
                     )
-                    print(f"🔄 Comando de troca de agente: {codigo_agente}")
+                    logger.debug("🔄 Comando de troca de agente: %s", codigo_agente)
                     
                     from agente.agente_service import AgenteService
                     agente = AgenteService.obter_por_codigo(db, sessao_id, codigo_agente)
@@ -358,17 +638,17 @@ class MensagemService:
                                 confirmacao = f"✅ *Agente Ativado!*\n\n🤖 *{agente.nome}*"
                                 if agente.descricao:
                                     confirmacao += f"\n_{agente.descricao}_"
-                            cliente.send_message(jid, message=confirmacao)
-                        print(f"✅ Agente {agente.codigo} ativado")
+                            envios.append(_enviar_async(cliente, jid, confirmacao))
+                        logger.debug("✅ Agente %s ativado", agente.codigo)
                     elif cliente and jid:
-                        cliente.send_message(jid, message=f"❌ Agente *{codigo_agente}* não encontrado")
+                        envios.append(_enviar_async(cliente, jid, f"❌ Agente *{codigo_agente}* não encontrado"))
                     return
             
         
         elif tipo_mensagem == "audio":
             # Mensagem com áudio
             db_mensagem.tipo = "audio"
-            print(f"🎵 Mensagem com áudio")
+            logger.debug("🎵 Mensagem com áudio")
             
             # Baixar e transcrever áudio
             try:
@@ -393,62 +673,59 @@ class MensagemService:
                         
                         # Salvar áudio localmente
                         upload_base = ConfiguracaoService.obter_valor(db, "sistema_diretorio_uploads", "./uploads")
-                        audio_dir = Path(upload_base) / f"sessao_{sessao_id}" / telefone_cliente
-                        audio_dir.mkdir(parents=True, exist_ok=True)
+                        audio_dir = _diretorio_uploads(upload_base, sessao_id, telefone_cliente)
+                        audio_path = os.path.join(audio_dir, _nome_arquivo("audio", ext))
                         
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        audio_path = audio_dir / f"audio_{timestamp}.{ext}"
+                        # Gravação em disco (numa thread) em paralelo com a transcrição.
+                        # Os mesmos bytes são compartilhados pelas duas (sem cópia), e a
+                        # transcrição precisa deles em memória para VAD, transcodificação,
+                        # retentativas e fallback de provedor.
+                        gravacao = asyncio.create_task(asyncio.to_thread(_gravar_bytes, audio_path, audio_bytes))
+                        try:
+                            config_transcricao = await TranscriptionService.carregar_config_async()
+                            resultado_transcricao = await TranscriptionService.transcrever(
+                                audio_bytes,
+                                filename=f"audio.{ext}",
+                                mime_type=mime_type,
+                                config=config_transcricao
+                            )
+                        finally:
+                            await gravacao
+                        del audio_bytes
                         
-                        with open(audio_path, "wb") as f:
-                            f.write(audio_bytes)
-                        
-                        print(f"💾 Áudio salvo: {audio_path}")
-                        
-                        # Transcrever áudio
-                        resultado_transcricao = await TranscriptionService.transcrever(
-                            db,
-                            audio_bytes,
-                            filename=f"audio.{ext}",
-                            mime_type=mime_type
-                        )
+                        logger.debug("💾 Áudio salvo: %s", audio_path)
                         
                         if resultado_transcricao["sucesso"]:
                             texto_transcrito = resultado_transcricao["texto"]
                             db_mensagem.conteudo_texto = f"[Áudio transcrito]: {texto_transcrito}"
-                            print(f"📝 Transcrição: {texto_transcrito[:100]}...")
+                            logger.debug("📝 Transcrição: %.100s...", texto_transcrito)
                             
                             # Verificar se deve apenas responder com transcrição
                             if config_tipo["acao"] == "transcricao_apenas":
                                 from neonize.utils import build_jid
                                 jid = build_jid(telefone_cliente)
-                                cliente.send_message(jid, message=f"📝 *Transcrição do áudio:*\n\n{texto_transcrito}")
-                                print(f"📤 Transcrição enviada ao usuário")
-                                # Salvar mensagem sem processar com IA
-                                db_mensagem.conteudo_imagem_path = str(audio_path)
-                                db_mensagem.conteudo_mime_type = mime_type
-                                db.add(db_mensagem)
-                                db.commit()
-                                return
+                                envios.append(_enviar_async(cliente, jid, f"📝 *Transcrição do áudio:*\n\n{texto_transcrito}"))
+                                logger.debug("📤 Transcrição enviada ao usuário")
+                                # Salvar mensagem sem processar com IA (gravada no commit único abaixo)
+                                processar_com_agente = False
                         else:
                             # Transcrição falhou
                             db_mensagem.conteudo_texto = "[Áudio não transcrito]"
-                            print(f"⚠️ Erro na transcrição: {resultado_transcricao.get('erro')}")
+                            logger.warning("⚠️ Erro na transcrição: %s", resultado_transcricao.get('erro'))
                         
                         # Guardar path do áudio
                         db_mensagem.conteudo_imagem_path = str(audio_path)
                         db_mensagem.conteudo_mime_type = mime_type
                         
             except Exception as e:
-                print(f"Erro ao processar áudio: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Erro ao processar áudio: %s", e)
                 db_mensagem.conteudo_texto = "[Erro ao processar áudio]"
         
         elif tipo_mensagem == "imagem":
             # Mensagem com imagem
             db_mensagem.tipo = "imagem"
             db_mensagem.conteudo_texto = message.imageMessage.caption if hasattr(message.imageMessage, 'caption') and message.imageMessage.caption else ""
-            print(f"🖼️  Mensagem com imagem")
+            logger.debug("🖼️  Mensagem com imagem")
             
             # Baixar imagem
             try:
@@ -461,7 +738,8 @@ class MensagemService:
                     
                     if imagem_bytes:
                         # Salvar imagem
-                        caminho, base64_str = MensagemService.salvar_imagem(
+                        # O base64 é gerado sob demanda (obter_base64) por quem precisar dele
+                        caminho, _ = MensagemService.salvar_imagem(
                             imagem_bytes,
                             telefone_cliente,
                             sessao_id,
@@ -470,22 +748,25 @@ class MensagemService:
                         
                         if caminho:
                             db_mensagem.conteudo_imagem_path = caminho
-                            db_mensagem.conteudo_imagem_base64 = base64_str
                             db_mensagem.conteudo_mime_type = message.imageMessage.mimetype if hasattr(message.imageMessage, 'mimetype') else "image/jpeg"
             except Exception as e:
-                print(f"Erro ao baixar imagem: {e}")
+                logger.error("Erro ao baixar imagem: %s", e)
         
-        # Salvar mensagem
+        # Lido antes do commit: depois dele a sessão expira e exigiria outro SELECT
+        auto_responder = processar_com_agente and sessao.auto_responder
+        
+        # Salvar mensagem (sem refresh: a consulta do histórico abaixo já traz
+        # esta mensagem e recarrega seus atributos expirados pelo commit)
         db.add(db_mensagem)
         db.commit()
-        db.refresh(db_mensagem)
         
         # Se auto-responder está ativo, processar com agente
-        if sessao.auto_responder:
+        if auto_responder:
+            envio = None
             try:
                 # Obter histórico de mensagens do cliente (limite configurável)
                 limite_historico = ConfiguracaoService.obter_valor(db, "agente_historico_mensagens", 10)
-                historico = MensagemService.listar_por_cliente(
+                historico = MensagemService.listar_historico_para_agente(
                     db,
                     sessao_id,
                     telefone_cliente,
@@ -519,15 +800,25 @@ class MensagemService:
                         from neonize.utils import build_jid
                         jid = build_jid(telefone_cliente)
                         # Parâmetro correto: message (str ou Message object)
-                        cliente.send_message(jid, message=resposta["texto"])
+                        envio = _enviar_async(cliente, jid, resposta["texto"])
                         
                         db_mensagem.respondida = True
                         db_mensagem.respondido_em = datetime.now()
                 
+                # O envio segue em andamento enquanto a resposta é gravada; se falhar,
+                # o except abaixo desfaz a marcação de respondida
                 db.commit()
+                if envio is not None:
+                    await envio
                 
             except Exception as e:
-                print(f"Erro ao processar mensagem com agente: {e}")
+                logger.error("Erro ao processar mensagem com agente: %s", e)
+                
+                db_mensagem.respondida = False
+                db_mensagem.respondido_em = None
+                if envio is not None and not envio.done():
+                    # Falha antes de o envio terminar (ex.: no commit): aguardado em processar_mensagem_recebida
+                    envios.append(envio)
                 
                 # Salvar erro no banco
                 db_mensagem.resposta_erro = str(e)
@@ -544,39 +835,24 @@ class MensagemService:
                         jid = build_jid(telefone_cliente)
                         
                         # Mensagem de erro amigável
-                        erro_msg = f"❌ *Erro ao processar sua mensagem*\n\n"
-                        
-                        # Identificar tipo de erro
-                        erro_str = str(e).lower()
-                        if "api key" in erro_str or "openrouter" in erro_str:
-                            erro_msg += "⚙️ O sistema não está configurado corretamente.\n"
-                            erro_msg += "Por favor, contate o administrador."
-                        elif "timeout" in erro_str or "connection" in erro_str:
-                            erro_msg += "🌐 Problema de conexão com o servidor.\n"
-                            erro_msg += "Tente novamente em alguns instantes."
-                        elif "rate limit" in erro_str:
-                            erro_msg += "⏱️ Muitas requisições.\n"
-                            erro_msg += "Aguarde um momento e tente novamente."
-                        else:
-                            erro_msg += f"🔧 Erro técnico: {str(e)[:100]}\n"
-                            erro_msg += "Por favor, tente novamente ou contate o suporte."
+                        erro_msg = _mensagem_erro_usuario(e)
                         
-                        cliente.send_message(jid, message=erro_msg)
-                        print(f"📤 Mensagem de erro enviada ao usuário")
+                        await _enviar_async(cliente, jid, erro_msg)
+                        logger.debug("📤 Mensagem de erro enviada ao usuário")
                         
                         db_mensagem.respondida = True
                         db_mensagem.respondido_em = datetime.now()
                 except Exception as send_error:
-                    print(f"❌ Erro ao enviar mensagem de erro: {send_error}")
+                    logger.error("❌ Erro ao enviar mensagem de erro: %s", send_error)
                 
                 db.commit()
 
     @staticmethod
     def contar_mensagens_por_sessao(db: Session, sessao_id: int) -> int:
         """Conta total de mensagens de uma sessão."""
-        return db.query(Mensagem)\
+        return db.query(func.count(Mensagem.id))\
             .filter(Mensagem.sessao_id == sessao_id)\
-            .count()
+            .scalar()
 
     @staticmethod
     def contar_mensagens_por_periodo(
@@ -586,21 +862,40 @@ class MensagemService:
     ) -> int:
         """Conta mensagens dos últimos N dias."""
         data_inicio = datetime.now() - timedelta(days=dias)
-        return db.query(Mensagem)\
+        return db.query(func.count(Mensagem.id))\
             .filter(
                 Mensagem.sessao_id == sessao_id,
                 Mensagem.criado_em >= data_inicio
             )\
-            .count()
+            .scalar()
 
     @staticmethod
     def obter_clientes_unicos(db: Session, sessao_id: int) -> List[str]:
         """Obtém lista de telefones únicos que enviaram mensagens."""
-        result = db.query(Mensagem.telefone_cliente)\
-            .filter(Mensagem.sessao_id == sessao_id)\
-            .distinct()\
-            .all()
-        return [r[0] for r in result]
+        # scalars() devolve os telefones direto, sem montar uma Row por linha
+        return db.scalars(
+            select(Mensagem.telefone_cliente)
+            .where(Mensagem.sessao_id == sessao_id)
+            .distinct()
+        ).all()
+
+    @staticmethod
+    def buscar_texto(db: Session, sessao_id: int, termo: str, limite: int = 50) -> List[Mensagem]:
+        """
+        Busca mensagens da sessão cujo texto contém o termo (sem diferenciar maiúsculas).
+        No PostgreSQL a busca usa o índice trigram ix_msg_conteudo_trgm.
+        """
+        # % e _ digitados pelo usuário são literais, não curingas
+        termo = termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return db.scalars(
+            select(Mensagem)
+            .where(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.conteudo_texto.ilike(f"%{termo}%", escape="\\"),
+            )
+            .order_by(Mensagem.criado_em.desc())
+            .limit(limite)
+        ).all()
 
     @staticmethod
     def obter_conversas_resumo(db: Session, sessao_id: int) -> List[dict]:
@@ -608,50 +903,106 @@ class MensagemService:
         Obtém resumo de todas as conversas de uma sessão.
         Retorna lista de dicts com telefone, última mensagem, total de mensagens, etc.
         """
-        from sqlalchemy import func, desc
+        from sqlalchemy import case
         
-        # Subquery para última mensagem de cada cliente
-        subquery = db.query(
+        # Totais por cliente (agregação condicional para as não respondidas)
+        totais = db.query(
             Mensagem.telefone_cliente,
             func.max(Mensagem.criado_em).label('ultima_msg'),
-            func.count(Mensagem.id).label('total_msgs')
+            func.count(Mensagem.id).label('total_msgs'),
+            func.sum(
+                case(
+                    ((Mensagem.direcao == "recebida") & (Mensagem.respondida == False), 1),
+                    else_=0
+                )
+            ).label('nao_respondidas')
         ).filter(
             Mensagem.sessao_id == sessao_id
         ).group_by(
             Mensagem.telefone_cliente
         ).subquery()
         
-        # Query principal
-        conversas = []
-        clientes = db.query(subquery).order_by(desc(subquery.c.ultima_msg)).all()
+        # Última mensagem de cada cliente via ROW_NUMBER() (sem uma consulta por cliente)
+        ranqueadas = db.query(
+            Mensagem.telefone_cliente,
+            Mensagem.nome_cliente,
+            Mensagem.conteudo_texto,
+            Mensagem.criado_em,
+            Mensagem.tipo,
+            func.row_number().over(
+                partition_by=Mensagem.telefone_cliente,
+                order_by=(Mensagem.criado_em.desc(), Mensagem.id.desc())
+            ).label('rn')
+        ).filter(
+            Mensagem.sessao_id == sessao_id
+        ).subquery()
         
-        for cliente in clientes:
-            # Buscar última mensagem
-            ultima = db.query(Mensagem).filter(
-                Mensagem.sessao_id == sessao_id,
-                Mensagem.telefone_cliente == cliente.telefone_cliente
-            ).order_by(Mensagem.criado_em.desc()).first()
-            
-            # Contar mensagens não respondidas
-            nao_respondidas = db.query(Mensagem).filter(
-                Mensagem.sessao_id == sessao_id,
-                Mensagem.telefone_cliente == cliente.telefone_cliente,
-                Mensagem.direcao == "recebida",
-                Mensagem.respondida == False
-            ).count()
-            
+        linhas = db.query(
+            totais.c.telefone_cliente,
+            totais.c.total_msgs,
+            totais.c.nao_respondidas,
+            ranqueadas.c.nome_cliente,
+            ranqueadas.c.conteudo_texto,
+            ranqueadas.c.criado_em,
+            ranqueadas.c.tipo
+        ).join(
+            ranqueadas,
+            (ranqueadas.c.telefone_cliente == totais.c.telefone_cliente) & (ranqueadas.c.rn == 1)
+        ).order_by(
+            totais.c.ultima_msg.desc()
+        ).yield_per(200)
+        
+        conversas = []
+        for linha in linhas:
             conversas.append({
-                "telefone": cliente.telefone_cliente,
-                "nome": ultima.nome_cliente if ultima and ultima.nome_cliente else None,
-                "ultima_mensagem": ultima.conteudo_texto[:100] if ultima and ultima.conteudo_texto else "📷 Imagem",
-                "ultima_data": ultima.criado_em if ultima else None,
-                "total_mensagens": cliente.total_msgs,
-                "nao_respondidas": nao_respondidas,
-                "tipo_ultima": ultima.tipo if ultima else "texto"
+                "telefone": linha.telefone_cliente,
+                "nome": linha.nome_cliente or None,
+                "ultima_mensagem": linha.conteudo_texto[:100] if linha.conteudo_texto else "📷 Imagem",
+                "ultima_data": linha.criado_em,
+                "total_mensagens": linha.total_msgs,
+                "nao_respondidas": linha.nao_respondidas or 0,
+                "tipo_ultima": linha.tipo or "texto"
             })
         
         return conversas
 
+    @staticmethod
+    def listar_conversa_pagina(
+        db: Session,
+        sessao_id: int,
+        telefone_cliente: str,
+        antes_de_id: Optional[int] = None,
+        limite: int = 50
+    ) -> List[Mensagem]:
+        """
+        Lista uma página da conversa (paginação por cursor/keyset no id).
+        Retorna as `limite` mensagens mais recentes anteriores a `antes_de_id`,
+        em ordem cronológica.
+        """
+        query = db.query(Mensagem).filter(
+            Mensagem.sessao_id == sessao_id,
+            Mensagem.telefone_cliente == telefone_cliente
+        )
+        if antes_de_id is not None:
+            query = query.filter(Mensagem.id < antes_de_id)
+        
+        mensagens = query.order_by(Mensagem.id.desc()).limit(limite).all()
+        mensagens.reverse()
+        return mensagens
+
+    @staticmethod
+    def obter_nome_cliente(db: Session, sessao_id: int, telefone_cliente: str) -> Optional[str]:
+        """Obtém o nome mais recente registrado para o cliente (se houver)."""
+        return db.query(Mensagem.nome_cliente)\
+            .filter(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.telefone_cliente == telefone_cliente,
+                Mensagem.nome_cliente.isnot(None)
+            )\
+            .order_by(Mensagem.id.desc())\
+            .limit(1)\
+            .scalar()
+
     @staticmethod
     def listar_conversa_completa(
         db: Session,
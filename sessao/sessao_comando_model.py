@@ -2,7 +2,7 @@
 Modelo de comandos personalizáveis por sessão.
 Permite configurar atalhos e mensagens de resposta.
 """
-from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -15,7 +15,7 @@ class SessaoComando(Base):
     __tablename__ = "sessao_comandos"
 
     id = Column(Integer, primary_key=True, index=True)
-    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False, index=True)
+    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False)
     
     # Identificador do comando (limpar, ajuda, status, listar, trocar_agente)
     comando_id = Column(String(30), nullable=False)
@@ -33,7 +33,15 @@ class SessaoComando(Base):
     descricao = Column(String(200), nullable=True)
     
     # Relacionamento com sessão
-    sessao = relationship("Sessao", back_populates="comandos")
+    # O despacho de comandos nunca precisa da sessão pai: carregá-la sem querer
+    # (ex.: num template) vira erro em vez de um SELECT por comando.
+    # Quem precisar usa options(joinedload(SessaoComando.sessao)).
+    sessao = relationship("Sessao", back_populates="comandos", lazy="raise_on_sql")
+
+    __table_args__ = (
+        # Um comando por sessão; também atende as buscas só por sessao_id (coluna inicial)
+        Index("uq_sessao_comando", "sessao_id", "comando_id", unique=True),
+    )
 
     def __repr__(self):
         return f"<SessaoComando(sessao_id={self.sessao_id}, comando='{self.comando_id}', gatilho='{self.gatilho}')>"
@@ -1,35 +1,167 @@
 """
 Serviço para gerenciar comandos personalizáveis por sessão.
 """
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm import Session
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import re
+import time
 from sessao.sessao_comando_model import SessaoComando, COMANDOS_PADRAO
 
 
+_IDS_PADRAO = frozenset(COMANDOS_PADRAO)
+
+# COMANDOS_PADRAO achatado na ordem original: (comando_id, gatilho, ativo, resposta, descricao)
+_COMANDOS_PADRAO_LINHAS: Tuple[Tuple[str, str, bool, Optional[str], Optional[str]], ...] = tuple(
+    (comando_id, config["gatilho"], config["ativo"], config["resposta"], config["descricao"])
+    for comando_id, config in COMANDOS_PADRAO.items()
+)
+
+# Posição de exibição no #ajuda: a ordem de COMANDOS_PADRAO (outros comandos vão ao fim)
+_ORDEM_EXIBICAO = {comando_id: posicao for posicao, comando_id in enumerate(COMANDOS_PADRAO)}
+
+# Variáveis nas respostas dos comandos: {agente_nome}, {total_mensagens}...
+_VARIAVEL_RE = re.compile(r"\{(\w+)\}")
+
+
+@dataclass(frozen=True)
+class ComandoSnapshot:
+    """Cópia imutável de um comando (segura para guardar em cache entre sessões do banco)."""
+    comando_id: str
+    gatilho: str
+    ativo: bool
+    resposta: Optional[str]
+    descricao: Optional[str]
+
+
+@dataclass(frozen=True)
+class ComandosSessao:
+    """
+    Comandos de uma sessão já preparados para o despacho por mensagem:
+    gatilhos em minúsculas indexados (match exato O(1)) e o prefixo de troca de agente.
+    """
+    por_id: Dict[str, ComandoSnapshot]
+    por_gatilho: Dict[str, ComandoSnapshot]  # só comandos ativos
+    trocar_agente: Optional[ComandoSnapshot]  # só se ativo
+    trocar_gatilho: Optional[str]  # gatilho do trocar_agente em minúsculas
+    trocar_tamanho: int  # len(trocar_gatilho), 0 sem troca de agente
+    ativos: Tuple[ComandoSnapshot, ...]  # comandos ativos na ordem de exibição
+    texto_ajuda: str  # resposta do #ajuda já montada
+    
+    @classmethod
+    def de_snapshots(cls, comandos: List[ComandoSnapshot]) -> "ComandosSessao":
+        por_id = {cmd.comando_id: cmd for cmd in comandos}
+        por_gatilho = {}
+        ativos = []
+        for cmd in por_id.values():
+            if not cmd.ativo:
+                continue
+            ativos.append(cmd)
+            # setdefault: com gatilhos repetidos vale o primeiro, como na busca sequencial
+            por_gatilho.setdefault(cmd.gatilho.lower(), cmd)
+            if cmd.comando_id == "ajuda":
+                # Alias para ajuda
+                por_gatilho.setdefault("#help", cmd)
+        
+        trocar = por_id.get("trocar_agente")
+        if trocar is not None and not trocar.ativo:
+            trocar = None
+        trocar_gatilho = trocar.gatilho.lower() if trocar else None
+        # Ordem fixa, independente da ordem em que o banco devolve as linhas (sort estável)
+        ativos.sort(key=lambda cmd: _ORDEM_EXIBICAO.get(cmd.comando_id, len(_ORDEM_EXIBICAO)))
+        ativos = tuple(ativos)
+        return cls(
+            por_id=por_id,
+            por_gatilho=por_gatilho,
+            trocar_agente=trocar,
+            trocar_gatilho=trocar_gatilho,
+            trocar_tamanho=len(trocar_gatilho) if trocar_gatilho else 0,
+            ativos=ativos,
+            texto_ajuda=cls._montar_ajuda(ativos)
+        )
+    
+    @staticmethod
+    def _montar_ajuda(ativos: Tuple[ComandoSnapshot, ...]) -> str:
+        """Monta o texto de ajuda a partir dos comandos ativos (já ordenados)."""
+        linhas = ["📚 *Comandos Disponíveis:*", ""]
+        for cmd in ativos:
+            if cmd.comando_id == "trocar_agente":
+                linhas.append(f"🔄 *{cmd.gatilho}01, {cmd.gatilho}02...* - {cmd.descricao}")
+            else:
+                linhas.append(f"▪️ *{cmd.gatilho}* - {cmd.descricao}")
+        
+        linhas.append("")
+        linhas.append("💬 Para conversar normalmente, basta enviar sua mensagem!")
+        return "\n".join(linhas)
+
+
 class SessaoComandoService:
     """Serviço para gerenciar comandos por sessão."""
     
+    # Cache em memória: sessao_id -> (expira_em, ComandosSessao)
+    # Toda escrita nos comandos passa por este serviço e invalida o cache,
+    # então o TTL só cobre alterações feitas por fora (ex.: direto no banco)
+    _cache_comandos: Dict[int, Tuple[float, ComandosSessao]] = {}
+    CACHE_TTL_SEGUNDOS = 3600
+    
+    # Sessões cujos comandos já foram sincronizados com COMANDOS_PADRAO neste processo
+    _sessoes_sincronizadas: set = set()
+    
+    @staticmethod
+    def invalidar_cache(sessao_id: Optional[int] = None):
+        """Invalida o cache de comandos de uma sessão (ou de todas)."""
+        if sessao_id is None:
+            SessaoComandoService._cache_comandos.clear()
+        else:
+            SessaoComandoService._cache_comandos.pop(sessao_id, None)
+    
+    @staticmethod
+    def _obter_comandos_cache(db: Session, sessao_id: int) -> ComandosSessao:
+        """Comandos da sessão a partir do cache (consulta o banco só quando expirado)."""
+        item = SessaoComandoService._cache_comandos.get(sessao_id)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        
+        snapshots = SessaoComandoService.listar_por_sessao_lite(db, sessao_id)
+        if SessaoComandoService._sincronizar_padroes(db, sessao_id, {cmd.comando_id for cmd in snapshots}):
+            snapshots = SessaoComandoService.listar_por_sessao_lite(db, sessao_id)
+        comandos = ComandosSessao.de_snapshots(snapshots)
+        SessaoComandoService._cache_comandos[sessao_id] = (
+            time.monotonic() + SessaoComandoService.CACHE_TTL_SEGUNDOS,
+            comandos
+        )
+        return comandos
+    
     @staticmethod
     def criar_comandos_padrao(db: Session, sessao_id: int) -> List[SessaoComando]:
         """
         Cria comandos padrão para uma nova sessão.
         """
-        comandos_criados = []
-        
-        for comando_id, config in COMANDOS_PADRAO.items():
-            comando = SessaoComando(
-                sessao_id=sessao_id,
-                comando_id=comando_id,
-                gatilho=config["gatilho"],
-                ativo=config["ativo"],
-                resposta=config["resposta"],
-                descricao=config["descricao"]
-            )
-            db.add(comando)
-            comandos_criados.append(comando)
-        
+        SessaoComandoService._inserir_padroes(db, sessao_id)
+        return SessaoComandoService.listar_por_sessao(db, sessao_id)
+    
+    @staticmethod
+    def _inserir_padroes(db: Session, sessao_id: int, comando_ids: Optional[set] = None):
+        """
+        Insere comandos padrão (todos, ou só os de `comando_ids`) numa única operação em lote.
+        (Com db.add, o commit expiraria cada objeto e cada um seria recarregado
+        com um SELECT próprio ao ser lido.)
+        """
+        db.bulk_insert_mappings(SessaoComando, [
+            {
+                "sessao_id": sessao_id,
+                "comando_id": comando_id,
+                "gatilho": gatilho,
+                "ativo": ativo,
+                "resposta": resposta,
+                "descricao": descricao
+            }
+            for comando_id, gatilho, ativo, resposta, descricao in _COMANDOS_PADRAO_LINHAS
+            if comando_ids is None or comando_id in comando_ids
+        ])
         db.commit()
-        return comandos_criados
+        SessaoComandoService.invalidar_cache(sessao_id)
     
     @staticmethod
     def listar_por_sessao(db: Session, sessao_id: int) -> List[SessaoComando]:
@@ -38,6 +170,46 @@ class SessaoComandoService:
             SessaoComando.sessao_id == sessao_id
         ).all()
     
+    @staticmethod
+    def listar_por_sessao_lite(db: Session, sessao_id: int) -> List[ComandoSnapshot]:
+        """
+        Lista os comandos de uma sessão só com as colunas usadas no despacho.
+        Select de colunas: sem objetos ORM nem identity map (para montar o cache).
+        """
+        linhas = db.execute(
+            select(
+                SessaoComando.comando_id,
+                SessaoComando.gatilho,
+                SessaoComando.ativo,
+                SessaoComando.resposta,
+                SessaoComando.descricao
+            ).where(SessaoComando.sessao_id == sessao_id)
+        ).all()
+        return [
+            ComandoSnapshot(comando_id, gatilho, bool(ativo), resposta, descricao)
+            for comando_id, gatilho, ativo, resposta, descricao in linhas
+        ]
+    
+    @staticmethod
+    def _sincronizar_padroes(db: Session, sessao_id: int, existentes: set) -> bool:
+        """
+        Cria os comandos padrão de uma sessão sem comandos ou, uma vez por processo,
+        adiciona os comandos novos de COMANDOS_PADRAO. Retorna True se inseriu algum.
+        """
+        inseriu = False
+        if not existentes:
+            SessaoComandoService._inserir_padroes(db, sessao_id)
+            inseriu = True
+        elif sessao_id not in SessaoComandoService._sessoes_sincronizadas:
+            faltantes = _IDS_PADRAO - existentes
+            if faltantes:
+                # A inserção segue a ordem de COMANDOS_PADRAO (usada no #ajuda)
+                SessaoComandoService._inserir_padroes(db, sessao_id, faltantes)
+                inseriu = True
+        
+        SessaoComandoService._sessoes_sincronizadas.add(sessao_id)
+        return inseriu
+    
     @staticmethod
     def obter_comandos_dict(db: Session, sessao_id: int) -> Dict[str, SessaoComando]:
         """
@@ -45,66 +217,40 @@ class SessaoComandoService:
         Cria comandos padrão se não existirem e sincroniza novos.
         """
         comandos = SessaoComandoService.listar_por_sessao(db, sessao_id)
-        
-        # Se não tem comandos, criar todos os padrões
-        if not comandos:
-            comandos = SessaoComandoService.criar_comandos_padrao(db, sessao_id)
-        else:
-            # Sincronizar: adicionar comandos novos que não existem
-            comandos_dict = {cmd.comando_id: cmd for cmd in comandos}
-            for comando_id, config in COMANDOS_PADRAO.items():
-                if comando_id not in comandos_dict:
-                    novo_cmd = SessaoComando(
-                        sessao_id=sessao_id,
-                        comando_id=comando_id,
-                        gatilho=config["gatilho"],
-                        ativo=config["ativo"],
-                        resposta=config["resposta"],
-                        descricao=config["descricao"]
-                    )
-                    db.add(novo_cmd)
-                    comandos.append(novo_cmd)
-            db.commit()
-        
+        if SessaoComandoService._sincronizar_padroes(db, sessao_id, {cmd.comando_id for cmd in comandos}):
+            comandos = SessaoComandoService.listar_por_sessao(db, sessao_id)
         return {cmd.comando_id: cmd for cmd in comandos}
     
     @staticmethod
-    def obter_por_gatilho(db: Session, sessao_id: int, texto: str) -> Optional[SessaoComando]:
+    def obter_por_gatilho(db: Session, sessao_id: int, texto: str) -> Optional[ComandoSnapshot]:
         """
         Encontra um comando pelo gatilho.
         Retorna None se não encontrar ou se estiver inativo.
+        Chamado a cada mensagem recebida, por isso usa o cache de comandos.
         """
         texto_lower = texto.strip().lower()
         
-        # Buscar comandos da sessão
-        comandos = SessaoComandoService.obter_comandos_dict(db, sessao_id)
+        # Buscar comandos da sessão (cache)
+        comandos = SessaoComandoService._obter_comandos_cache(db, sessao_id)
         
-        # PRIMEIRO: verificar comandos com match exato (prioridade sobre prefixo)
-        for cmd in comandos.values():
-            if not cmd.ativo:
-                continue
-            
-            gatilho = cmd.gatilho.lower()
-            
-            # Match exato
-            if texto_lower == gatilho:
-                return cmd
-            # Alias para ajuda
-            elif cmd.comando_id == "ajuda" and texto_lower == "#help":
-                return cmd
+        # PRIMEIRO: match exato (prioridade sobre prefixo)
+        cmd = comandos.por_gatilho.get(texto_lower)
+        if cmd is not None:
+            return cmd
         
         # DEPOIS: verificar comando de troca de agente (prefixo)
-        cmd_trocar = comandos.get("trocar_agente")
-        if cmd_trocar and cmd_trocar.ativo:
-            gatilho = cmd_trocar.gatilho.lower()
-            if texto_lower.startswith(gatilho) and len(texto_lower) > len(gatilho):
-                return cmd_trocar
+        # O teste de tamanho descarta quase todas as mensagens antes do startswith
+        if comandos.trocar_tamanho and len(texto_lower) > comandos.trocar_tamanho \
+                and texto_lower.startswith(comandos.trocar_gatilho):
+            return comandos.trocar_agente
         
         return None
     
     @staticmethod
     def extrair_codigo_agente(texto: str, gatilho: str) -> str:
         """Extrai o código do agente do comando de troca."""
+        # Fatia pelo tamanho em vez de removeprefix: o gatilho casa sem diferenciar
+        # maiúsculas ("#Agente01" com gatilho "#agente"), e removeprefix exigiria igualdade exata
         return texto.strip()[len(gatilho):]
     
     @staticmethod
@@ -115,39 +261,76 @@ class SessaoComandoService:
         gatilho: Optional[str] = None,
         ativo: Optional[bool] = None,
         resposta: Optional[str] = None,
-        descricao: Optional[str] = None
+        descricao: Optional[str] = None,
+        autocommit: bool = True
     ) -> Optional[SessaoComando]:
-        """Atualiza um comando específico."""
-        comando = db.query(SessaoComando).filter(
+        """
+        Atualiza um comando específico.
+        Com autocommit=False só faz flush, para agrupar várias alterações numa transação:
+        quem chama faz o commit e depois chama invalidar_cache(sessao_id).
+        """
+        SessaoComandoService._aplicar_atualizacao(db, sessao_id, comando_id, gatilho, ativo, resposta, descricao)
+        if autocommit:
+            db.commit()
+            SessaoComandoService.invalidar_cache(sessao_id)
+        else:
+            db.flush()
+        return db.query(SessaoComando).filter(
             SessaoComando.sessao_id == sessao_id,
             SessaoComando.comando_id == comando_id
         ).first()
+    
+    @staticmethod
+    def _aplicar_atualizacao(
+        db: Session,
+        sessao_id: int,
+        comando_id: str,
+        gatilho: Optional[str],
+        ativo: Optional[bool],
+        resposta: Optional[str],
+        descricao: Optional[str]
+    ):
+        """
+        Atualiza o comando com um único UPDATE (pela chave sessao_id + comando_id),
+        criando-o se não existir. Não faz commit.
+        """
+        filtro = (SessaoComando.sessao_id == sessao_id, SessaoComando.comando_id == comando_id)
+        valores = {
+            campo: valor
+            for campo, valor in (("gatilho", gatilho), ("ativo", ativo), ("resposta", resposta), ("descricao", descricao))
+            if valor is not None
+        }
         
-        if not comando:
-            # Criar se não existir
-            config = COMANDOS_PADRAO.get(comando_id, {})
-            comando = SessaoComando(
-                sessao_id=sessao_id,
-                comando_id=comando_id,
-                gatilho=gatilho or config.get("gatilho", f"#{comando_id}"),
-                ativo=ativo if ativo is not None else True,
-                resposta=resposta or config.get("resposta"),
-                descricao=descricao or config.get("descricao")
-            )
-            db.add(comando)
+        if valores:
+            existe = db.execute(
+                update(SessaoComando).where(*filtro).values(**valores)
+            ).rowcount > 0
         else:
-            if gatilho is not None:
-                comando.gatilho = gatilho
-            if ativo is not None:
-                comando.ativo = ativo
-            if resposta is not None:
-                comando.resposta = resposta
-            if descricao is not None:
-                comando.descricao = descricao
+            existe = db.query(SessaoComando.id).filter(*filtro).first() is not None
         
-        db.commit()
-        db.refresh(comando)
-        return comando
+        if not existe:
+            # Criar se não existir
+            db.add(SessaoComandoService._novo_comando(sessao_id, comando_id, gatilho, ativo, resposta, descricao))
+    
+    @staticmethod
+    def _novo_comando(
+        sessao_id: int,
+        comando_id: str,
+        gatilho: Optional[str],
+        ativo: Optional[bool],
+        resposta: Optional[str],
+        descricao: Optional[str]
+    ) -> SessaoComando:
+        """Monta um comando novo, completando com os valores padrão o que não foi informado."""
+        config = COMANDOS_PADRAO.get(comando_id, {})
+        return SessaoComando(
+            sessao_id=sessao_id,
+            comando_id=comando_id,
+            gatilho=gatilho or config.get("gatilho", f"#{comando_id}"),
+            ativo=ativo if ativo is not None else True,
+            resposta=resposta or config.get("resposta"),
+            descricao=descricao or config.get("descricao")
+        )
     
     @staticmethod
     def atualizar_todos(
@@ -156,28 +339,56 @@ class SessaoComandoService:
         comandos_config: Dict[str, Dict]
     ) -> List[SessaoComando]:
         """
-        Atualiza todos os comandos de uma sessão.
+        Atualiza todos os comandos de uma sessão (numa única transação).
         
         Args:
             comandos_config: Dict no formato {
                 comando_id: {gatilho, ativo, resposta, descricao}
             }
         """
-        atualizados = []
+        existentes = set(db.scalars(
+            select(SessaoComando.comando_id).where(SessaoComando.sessao_id == sessao_id)
+        ).all())
         
+        parametros = []
         for comando_id, config in comandos_config.items():
-            cmd = SessaoComandoService.atualizar(
-                db,
-                sessao_id,
-                comando_id,
-                gatilho=config.get("gatilho"),
-                ativo=config.get("ativo"),
-                resposta=config.get("resposta"),
-                descricao=config.get("descricao")
+            if comando_id in existentes:
+                parametros.append({
+                    "b_cid": comando_id,
+                    "b_gatilho": config.get("gatilho"),
+                    "b_ativo": config.get("ativo"),
+                    "b_resposta": config.get("resposta"),
+                    "b_descricao": config.get("descricao")
+                })
+            else:
+                db.add(SessaoComandoService._novo_comando(
+                    sessao_id,
+                    comando_id,
+                    gatilho=config.get("gatilho"),
+                    ativo=config.get("ativo"),
+                    resposta=config.get("resposta"),
+                    descricao=config.get("descricao")
+                ))
+        
+        if parametros:
+            # Um único UPDATE executado em lote (executemany); campo None mantém o valor atual.
+            # Vai pela Table e não pelo modelo: com vários parâmetros o update() do ORM
+            # exigiria a chave primária em vez do filtro sessao_id + comando_id
+            tabela = SessaoComando.__table__
+            db.execute(
+                update(tabela)
+                .where(tabela.c.sessao_id == sessao_id, tabela.c.comando_id == bindparam("b_cid"))
+                .values({
+                    coluna: func.coalesce(bindparam(f"b_{coluna}", type_=tabela.c[coluna].type), tabela.c[coluna])
+                    for coluna in ("gatilho", "ativo", "resposta", "descricao")
+                }),
+                parametros
             )
-            atualizados.append(cmd)
+        db.commit()
+        SessaoComandoService.invalidar_cache(sessao_id)
         
-        return atualizados
+        comandos = {cmd.comando_id: cmd for cmd in SessaoComandoService.listar_por_sessao(db, sessao_id)}
+        return [comandos[comando_id] for comando_id in comandos_config if comando_id in comandos]
     
     @staticmethod
     def formatar_resposta(resposta: str, variaveis: Dict[str, str]) -> str:
@@ -188,27 +399,24 @@ class SessaoComandoService:
         if not resposta:
             return ""
         
-        for var, valor in variaveis.items():
-            resposta = resposta.replace(f"{{{var}}}", str(valor or ""))
+        # Uma única passada pelo texto; variáveis desconhecidas ficam como estão
+        def substituir(match):
+            var = match.group(1)
+            if var not in variaveis:
+                return match.group(0)
+            return str(variaveis[var] or "")
         
-        return resposta
+        return _VARIAVEL_RE.sub(substituir, resposta)
+    
+    @staticmethod
+    def obter_comando(db: Session, sessao_id: int, comando_id: str) -> Optional[ComandoSnapshot]:
+        """Obtém um comando da sessão pelo comando_id (ativo ou não), a partir do cache."""
+        return SessaoComandoService._obter_comandos_cache(db, sessao_id).por_id.get(comando_id)
     
     @staticmethod
     def gerar_texto_ajuda(db: Session, sessao_id: int) -> str:
-        """Gera o texto de ajuda com todos os comandos ativos."""
-        comandos = SessaoComandoService.obter_comandos_dict(db, sessao_id)
-        
-        texto = "📚 *Comandos Disponíveis:*\n\n"
-        
-        for cmd in comandos.values():
-            if not cmd.ativo:
-                continue
-            
-            if cmd.comando_id == "trocar_agente":
-                texto += f"🔄 *{cmd.gatilho}01, {cmd.gatilho}02...* - {cmd.descricao}\n"
-            else:
-                texto += f"▪️ *{cmd.gatilho}* - {cmd.descricao}\n"
-        
-        texto += "\n💬 Para conversar normalmente, basta enviar sua mensagem!"
-        
-        return texto
+        """
+        Gera o texto de ajuda com todos os comandos ativos.
+        O texto é montado junto com o cache de comandos, então aqui é só uma leitura.
+        """
+        return SessaoComandoService._obter_comandos_cache(db, sessao_id).texto_ajuda
@@ -2,17 +2,118 @@
 Rotas do frontend para sessões.
 """
 from fastapi import APIRouter, Depends, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, joinedload
+import hashlib
+import logging
+import os
 from database import get_db
+from sessao.sessao_model import Sessao
 from sessao.sessao_service import SessaoService
 from sessao.sessao_schema import SessaoCriar, SessaoAtualizar
 from sessao.sessao_tipo_mensagem_service import SessaoTipoMensagemService
 from config.config_service import ConfiguracaoService
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/sessoes", tags=["Frontend - Sessões"])
 templates = Jinja2Templates(directory="templates")
+# Templates compilados ficam em disco (pasta temporária do usuário) e sobrevivem a reinícios;
+# fora do modo DEBUG não se confere a data dos arquivos a cada renderização
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = os.getenv("DEBUG", "True").lower() == "true"
+
+# HTML já renderizado de páginas que dependem só de poucos dados (chave = esses dados).
+# Só para templates que não usam `request`: o contexto renderizado não o inclui.
+_PAGINAS_RENDERIZADAS: dict = {}
+_PAGINAS_RENDERIZADAS_MAX = 256
+
+# Configurações lidas pelo formulário de nova sessão (chave -> padrão)
+PADROES_NOVA_SESSAO = {
+    "agente_papel_padrao": "assistente pessoal",
+    "agente_objetivo_padrao": "ajudar o usuário",
+    "agente_politicas_padrao": "ser educado e respeitoso",
+    "agente_tarefa_padrao": "responder perguntas",
+    "agente_objetivo_explicito_padrao": "fornecer informações úteis",
+    "agente_publico_padrao": "usuários em geral",
+    "agente_restricoes_padrao": "responder em português",
+    "openrouter_modelo_padrao": "google/gemini-2.0-flash-001",
+    "openrouter_temperatura": "0.7",
+    "openrouter_max_tokens": "2000",
+    "openrouter_top_p": "1.0",
+}
+CAMPOS_AGENTE_NOVA_SESSAO = {
+    "papel": "agente_papel_padrao",
+    "objetivo": "agente_objetivo_padrao",
+    "politicas": "agente_politicas_padrao",
+    "tarefa": "agente_tarefa_padrao",
+    "objetivo_explicito": "agente_objetivo_explicito_padrao",
+    "publico": "agente_publico_padrao",
+    "restricoes": "agente_restricoes_padrao",
+}
+
+TIPOS_MENSAGEM = ("audio", "imagem", "video", "sticker", "localizacao", "documento")
+
+
+def _renderizar_cacheado(nome_template: str, chave: tuple, contexto: dict) -> HTMLResponse:
+    """Renderiza o template uma vez por chave e reaproveita o HTML nas próximas requisições."""
+    chave = (nome_template,) + chave
+    html = _PAGINAS_RENDERIZADAS.get(chave)
+    if html is None:
+        if len(_PAGINAS_RENDERIZADAS) >= _PAGINAS_RENDERIZADAS_MAX:
+            _PAGINAS_RENDERIZADAS.clear()
+        html = templates.get_template(nome_template).render(contexto)
+        _PAGINAS_RENDERIZADAS[chave] = html
+    return HTMLResponse(html)
+
+
+def _etag(*valores) -> str:
+    """ETag fraco a partir dos valores que o template exibe."""
+    digest = hashlib.blake2b("\x1f".join(map(str, valores)).encode(), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _etag_confere(etag: str, if_none_match: str) -> bool:
+    """
+    Compara o ETag com cada valor do If-None-Match (lista separada por vírgulas ou "*").
+    A comparação é fraca, como manda o If-None-Match: o prefixo W/ é ignorado.
+    """
+    alvo = etag.removeprefix("W/")
+    for valor in if_none_match.split(","):
+        valor = valor.strip()
+        if valor == "*" or valor.removeprefix("W/") == alvo:
+            return True
+    return False
+
+
+def _redirecionar(url: str) -> Response:
+    """
+    Redirect 303 para um caminho da própria aplicação, sem o quote() do RedirectResponse.
+    Só para URLs montadas aqui; texto vindo do usuário (ex.: ?erro=) continua no RedirectResponse.
+    """
+    return Response(status_code=303, headers={"location": url})
+
+
+def _tipos_config(tipos) -> dict:
+    """
+    Monta {tipo: {acao, resposta_fixa}} a partir de triplas (tipo, acao, resposta) do formulário.
+    A resposta só é guardada quando a ação é resposta_fixa.
+    """
+    return {
+        tipo: {"acao": acao, "resposta_fixa": resposta if acao == "resposta_fixa" else None}
+        for tipo, acao, resposta in tipos
+    }
+
+
+def _pagina_erro(mensagem: str, titulo: str = "Erro") -> HTMLResponse:
+    """Página de erro; as mensagens são poucas e fixas, então cada uma é renderizada uma vez."""
+    return _renderizar_cacheado("shared/erro.html", (mensagem, titulo), {
+        "mensagem": mensagem,
+        "titulo": titulo
+    })
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -30,25 +131,18 @@ def pagina_sessoes(request: Request, db: Session = Depends(get_db)):
 @router.get("/nova", response_class=HTMLResponse)
 def pagina_nova_sessao(request: Request, db: Session = Depends(get_db)):
     """Página para criar nova sessão."""
-    # Buscar configurações padrão do agente
-    config_agente = {
-        "papel": ConfiguracaoService.obter_valor(db, "agente_papel_padrao", "assistente pessoal"),
-        "objetivo": ConfiguracaoService.obter_valor(db, "agente_objetivo_padrao", "ajudar o usuário"),
-        "politicas": ConfiguracaoService.obter_valor(db, "agente_politicas_padrao", "ser educado e respeitoso"),
-        "tarefa": ConfiguracaoService.obter_valor(db, "agente_tarefa_padrao", "responder perguntas"),
-        "objetivo_explicito": ConfiguracaoService.obter_valor(db, "agente_objetivo_explicito_padrao", "fornecer informações úteis"),
-        "publico": ConfiguracaoService.obter_valor(db, "agente_publico_padrao", "usuários em geral"),
-        "restricoes": ConfiguracaoService.obter_valor(db, "agente_restricoes_padrao", "responder em português")
-    }
+    # Configurações padrão do agente e do LLM numa única consulta
+    valores = ConfiguracaoService.obter_valores_bulk(db, list(PADROES_NOVA_SESSAO), PADROES_NOVA_SESSAO)
+    config_agente = {campo: valores[chave] for campo, chave in CAMPOS_AGENTE_NOVA_SESSAO.items()}
     
-    # Buscar configurações LLM
-    modelo_padrao = ConfiguracaoService.obter_valor(db, "openrouter_modelo_padrao", "google/gemini-2.0-flash-001")
-    temperatura_padrao = ConfiguracaoService.obter_valor(db, "openrouter_temperatura", "0.7")
-    max_tokens_padrao = ConfiguracaoService.obter_valor(db, "openrouter_max_tokens", "2000")
-    top_p_padrao = ConfiguracaoService.obter_valor(db, "openrouter_top_p", "1.0")
+    modelo_padrao = valores["openrouter_modelo_padrao"]
+    temperatura_padrao = valores["openrouter_temperatura"]
+    max_tokens_padrao = valores["openrouter_max_tokens"]
+    top_p_padrao = valores["openrouter_top_p"]
     
-    return templates.TemplateResponse("sessao/form.html", {
-        "request": request,
+    # O formulário de criação só muda quando as configurações padrão mudam
+    chave = tuple(config_agente.values()) + (modelo_padrao, temperatura_padrao, max_tokens_padrao, top_p_padrao)
+    return _renderizar_cacheado("sessao/form.html", chave, {
         "config_agente": config_agente,
         "modelo_padrao": modelo_padrao,
         "temperatura_padrao": temperatura_padrao,
@@ -64,11 +158,7 @@ def pagina_editar_sessao(sessao_id: int, request: Request, db: Session = Depends
     """Página para editar sessão."""
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
-        return templates.TemplateResponse("shared/erro.html", {
-            "request": request,
-            "mensagem": "Sessão não encontrada",
-            "titulo": "Erro"
-        })
+        return _pagina_erro("Sessão não encontrada")
     
     return templates.TemplateResponse("sessao/form.html", {
         "request": request,
@@ -83,11 +173,7 @@ def pagina_detalhes_sessao(sessao_id: int, request: Request, db: Session = Depen
     """Página de detalhes da sessão."""
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
-        return templates.TemplateResponse("shared/erro.html", {
-            "request": request,
-            "mensagem": "Sessão não encontrada",
-            "titulo": "Erro"
-        })
+        return _pagina_erro("Sessão não encontrada")
     
     return templates.TemplateResponse("sessao/detalhes.html", {
         "request": request,
@@ -103,11 +189,7 @@ def pagina_conectar_sessao(sessao_id: int, request: Request, db: Session = Depen
     
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
-        return templates.TemplateResponse("shared/erro.html", {
-            "request": request,
-            "mensagem": "Sessão não encontrada",
-            "titulo": "Erro"
-        })
+        return _pagina_erro("Sessão não encontrada")
     
     # Verificar se QR Code expirou (60 segundos)
     qr_code_expirado = False
@@ -115,7 +197,7 @@ def pagina_conectar_sessao(sessao_id: int, request: Request, db: Session = Depen
         tempo_decorrido = datetime.now() - sessao.qr_code_gerado_em
         if tempo_decorrido > timedelta(seconds=60):
             qr_code_expirado = True
-            print(f"⏰ QR Code expirado para sessão {sessao_id} ({tempo_decorrido.seconds}s)")
+            logger.debug("⏰ QR Code expirado para sessão %s (%ss)", sessao_id, tempo_decorrido.seconds)
             # Limpar QR Code expirado
             sessao.qr_code = None
             sessao.status = "desconectado"
@@ -126,14 +208,21 @@ def pagina_conectar_sessao(sessao_id: int, request: Request, db: Session = Depen
     if qr_code_gerenciador and not qr_code_expirado:
         # Sempre usar QR Code do gerenciador (mais recente)
         sessao.qr_code = qr_code_gerenciador
-        print(f"🔄 QR Code do gerenciador aplicado à sessão {sessao_id} ({len(qr_code_gerenciador)} chars)")
+        logger.debug("🔄 QR Code do gerenciador aplicado à sessão %s (%s chars)", sessao_id, len(qr_code_gerenciador))
+    
+    # A página se recarrega a cada 3s enquanto aguarda o QR Code; se nada mudou
+    # desde a última resposta, o navegador reaproveita a que já tem (304)
+    etag = _etag(sessao.id, sessao.nome, sessao.status, sessao.telefone, sessao.qr_code, qr_code_expirado)
+    cabecalhos = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_confere(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=cabecalhos)
     
     return templates.TemplateResponse("sessao/paircode.html", {
         "request": request,
         "sessao": sessao,
         "qr_code_expirado": qr_code_expirado,
         "titulo": f"Conectar - {sessao.nome}"
-    })
+    }, headers=cabecalhos)
 
 
 @router.post("/{sessao_id}/conectar")
@@ -143,18 +232,20 @@ def conectar_sessao_post(
 ):
     """Conecta uma sessão WhatsApp via QR Code."""
     try:
-        # Limpar QR Code antigo antes de gerar novo
-        sessao = SessaoService.obter_por_id(db, sessao_id)
-        if sessao:
-            sessao.qr_code = None
-            sessao.qr_code_gerado_em = None
-            db.commit()
-            print(f"🧹 QR Code antigo limpo para sessão {sessao_id}")
+        # Limpar QR Code antigo antes de gerar novo (UPDATE direto, sem carregar a sessão)
+        limpou = db.execute(
+            update(Sessao)
+            .where(Sessao.id == sessao_id)
+            .values(qr_code=None, qr_code_gerado_em=None)
+        ).rowcount
+        db.commit()
+        if limpou:
+            logger.debug("🧹 QR Code antigo limpo para sessão %s", sessao_id)
         
         SessaoService.conectar(db, sessao_id, usar_paircode=False)
     except Exception as e:
-        print(f"Erro ao conectar: {e}")
-    return RedirectResponse(url=f"/sessoes/{sessao_id}/conectar", status_code=303)
+        logger.error("Erro ao conectar: %s", e)
+    return _redirecionar(f"/sessoes/{sessao_id}/conectar")
 
 
 @router.post("/{sessao_id}/desconectar")
@@ -163,8 +254,8 @@ def desconectar_sessao_post(sessao_id: int, db: Session = Depends(get_db)):
     try:
         SessaoService.desconectar(db, sessao_id)
     except Exception as e:
-        print(f"Erro ao desconectar: {e}")
-    return RedirectResponse(url="/sessoes", status_code=303)
+        logger.error("Erro ao desconectar: %s", e)
+    return _redirecionar("/sessoes")
 
 
 @router.post("/{sessao_id}/deletar")
@@ -172,10 +263,10 @@ def deletar_sessao_post(sessao_id: int, db: Session = Depends(get_db)):
     """Deleta uma sessão WhatsApp."""
     try:
         SessaoService.deletar(db, sessao_id)
-        print(f"✅ Sessão {sessao_id} deletada com sucesso")
+        logger.info("✅ Sessão %s deletada com sucesso", sessao_id)
     except Exception as e:
-        print(f"Erro ao deletar: {e}")
-    return RedirectResponse(url="/sessoes", status_code=303)
+        logger.error("Erro ao deletar: %s", e)
+    return _redirecionar("/sessoes")
 
 
 @router.post("/criar")
@@ -236,17 +327,17 @@ def criar_sessao_post(
         sessao = SessaoService.criar(db, sessao_data)
         
         # Criar configurações de tipos de mensagem
-        tipos_config = {
-            "audio": {"acao": tipo_audio, "resposta_fixa": tipo_audio_resposta if tipo_audio == "resposta_fixa" else None},
-            "imagem": {"acao": tipo_imagem, "resposta_fixa": tipo_imagem_resposta if tipo_imagem == "resposta_fixa" else None},
-            "video": {"acao": tipo_video, "resposta_fixa": tipo_video_resposta if tipo_video == "resposta_fixa" else None},
-            "sticker": {"acao": tipo_sticker, "resposta_fixa": tipo_sticker_resposta if tipo_sticker == "resposta_fixa" else None},
-            "localizacao": {"acao": tipo_localizacao, "resposta_fixa": tipo_localizacao_resposta if tipo_localizacao == "resposta_fixa" else None},
-            "documento": {"acao": tipo_documento, "resposta_fixa": tipo_documento_resposta if tipo_documento == "resposta_fixa" else None},
-        }
+        tipos_config = _tipos_config((
+            ("audio", tipo_audio, tipo_audio_resposta),
+            ("imagem", tipo_imagem, tipo_imagem_resposta),
+            ("video", tipo_video, tipo_video_resposta),
+            ("sticker", tipo_sticker, tipo_sticker_resposta),
+            ("localizacao", tipo_localizacao, tipo_localizacao_resposta),
+            ("documento", tipo_documento, tipo_documento_resposta),
+        ))
         SessaoTipoMensagemService.atualizar_todos(db, sessao.id, tipos_config)
         
-        return RedirectResponse(url="/sessoes", status_code=303)
+        return _redirecionar("/sessoes")
     except ValueError as e:
         return RedirectResponse(url=f"/sessoes/nova?erro={str(e)}", status_code=303)
 
@@ -254,32 +345,33 @@ def criar_sessao_post(
 @router.get("/{sessao_id}/tipos-mensagem", response_class=HTMLResponse)
 def pagina_tipos_mensagem(sessao_id: int, request: Request, db: Session = Depends(get_db)):
     """Página para configurar tipos de mensagem da sessão."""
-    sessao = SessaoService.obter_por_id(db, sessao_id)
+    # Sessão e configurações atuais numa única consulta (JOIN)
+    sessao = db.scalars(
+        select(Sessao)
+        .options(joinedload(Sessao.tipos_mensagem))
+        .where(Sessao.id == sessao_id)
+    ).unique().first()
     if not sessao:
-        return templates.TemplateResponse("shared/erro.html", {
-            "request": request,
-            "mensagem": "Sessão não encontrada",
-            "titulo": "Erro"
-        })
-    
-    # Obter configurações atuais
-    configs = SessaoTipoMensagemService.listar_por_sessao(db, sessao_id)
+        return _pagina_erro("Sessão não encontrada")
     
     # Organizar por tipo
     tipos = {}
-    for config in configs:
+    for config in sessao.tipos_mensagem:
         tipos[config.tipo] = {
             "acao": config.acao,
             "resposta_fixa": config.resposta_fixa
         }
     
     # Garantir que todos os tipos existam
-    for tipo in ["audio", "imagem", "video", "sticker", "localizacao", "documento"]:
+    for tipo in TIPOS_MENSAGEM:
         if tipo not in tipos:
             tipos[tipo] = {"acao": "ignorar", "resposta_fixa": None}
     
-    return templates.TemplateResponse("sessao/tipos_mensagem.html", {
-        "request": request,
+    # O template usa só id e nome da sessão, além dos tipos
+    chave = (sessao.id, sessao.nome) + tuple(
+        (tipos[tipo]["acao"], tipos[tipo]["resposta_fixa"]) for tipo in TIPOS_MENSAGEM
+    )
+    return _renderizar_cacheado("sessao/tipos_mensagem.html", chave, {
         "sessao": sessao,
         "tipos": tipos,
         "titulo": f"Tipos de Mensagem - {sessao.nome}"
@@ -304,16 +396,16 @@ def salvar_tipos_mensagem(
     db: Session = Depends(get_db)
 ):
     """Salva configurações de tipos de mensagem."""
-    tipos_config = {
-        "audio": {"acao": tipo_audio, "resposta_fixa": tipo_audio_resposta if tipo_audio == "resposta_fixa" else None},
-        "imagem": {"acao": tipo_imagem, "resposta_fixa": tipo_imagem_resposta if tipo_imagem == "resposta_fixa" else None},
-        "video": {"acao": tipo_video, "resposta_fixa": tipo_video_resposta if tipo_video == "resposta_fixa" else None},
-        "sticker": {"acao": tipo_sticker, "resposta_fixa": tipo_sticker_resposta if tipo_sticker == "resposta_fixa" else None},
-        "localizacao": {"acao": tipo_localizacao, "resposta_fixa": tipo_localizacao_resposta if tipo_localizacao == "resposta_fixa" else None},
-        "documento": {"acao": tipo_documento, "resposta_fixa": tipo_documento_resposta if tipo_documento == "resposta_fixa" else None},
-    }
+    tipos_config = _tipos_config((
+        ("audio", tipo_audio, tipo_audio_resposta),
+        ("imagem", tipo_imagem, tipo_imagem_resposta),
+        ("video", tipo_video, tipo_video_resposta),
+        ("sticker", tipo_sticker, tipo_sticker_resposta),
+        ("localizacao", tipo_localizacao, tipo_localizacao_resposta),
+        ("documento", tipo_documento, tipo_documento_resposta),
+    ))
     SessaoTipoMensagemService.atualizar_todos(db, sessao_id, tipos_config)
-    return RedirectResponse(url=f"/sessoes/{sessao_id}/detalhes", status_code=303)
+    return _redirecionar(f"/sessoes/{sessao_id}/detalhes")
 
 
 # ===================== COMANDOS PERSONALIZÁVEIS =====================
@@ -325,7 +417,7 @@ def pagina_comandos(sessao_id: int, request: Request, db: Session = Depends(get_
     
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
-        return RedirectResponse(url="/sessoes/", status_code=303)
+        return _redirecionar("/sessoes/")
     
     # Obter comandos (cria padrões se não existirem)
     comandos = SessaoComandoService.obter_comandos_dict(db, sessao_id)
@@ -420,7 +512,7 @@ def salvar_comandos(
     }
     
     SessaoComandoService.atualizar_todos(db, sessao_id, comandos_config)
-    return RedirectResponse(url=f"/sessoes/{sessao_id}/detalhes", status_code=303)
+    return _redirecionar(f"/sessoes/{sessao_id}/detalhes")
 
 
 @router.post("/{sessao_id}/atualizar")
@@ -445,43 +537,32 @@ def atualizar_sessao_post(
 ):
     """Atualiza uma sessão via formulário."""
     try:
-        # Preparar dados de atualização
-        update_data = {}
-        
-        if nome:
-            update_data["nome"] = nome
-        if agente_papel:
-            update_data["agente_papel"] = agente_papel
-        if agente_objetivo:
-            update_data["agente_objetivo"] = agente_objetivo
-        if agente_politicas:
-            update_data["agente_politicas"] = agente_politicas
-        if agente_tarefa:
-            update_data["agente_tarefa"] = agente_tarefa
-        if agente_objetivo_explicito:
-            update_data["agente_objetivo_explicito"] = agente_objetivo_explicito
-        if agente_publico:
-            update_data["agente_publico"] = agente_publico
-        if agente_restricoes:
-            update_data["agente_restricoes"] = agente_restricoes
-        if modelo_llm:
-            update_data["modelo_llm"] = modelo_llm
-        if temperatura:
-            update_data["temperatura"] = temperatura
-        if max_tokens:
-            update_data["max_tokens"] = max_tokens
-        if top_p:
-            update_data["top_p"] = top_p
-        if auto_responder is not None:
-            update_data["auto_responder"] = auto_responder == "true"
-        if salvar_historico is not None:
-            update_data["salvar_historico"] = salvar_historico == "true"
-        if ativa is not None:
-            update_data["ativa"] = ativa == "true"
+        # Preparar dados de atualização: textos vazios e checkboxes ausentes não alteram nada
+        campos_texto = (
+            ("nome", nome),
+            ("agente_papel", agente_papel),
+            ("agente_objetivo", agente_objetivo),
+            ("agente_politicas", agente_politicas),
+            ("agente_tarefa", agente_tarefa),
+            ("agente_objetivo_explicito", agente_objetivo_explicito),
+            ("agente_publico", agente_publico),
+            ("agente_restricoes", agente_restricoes),
+            ("modelo_llm", modelo_llm),
+            ("temperatura", temperatura),
+            ("max_tokens", max_tokens),
+            ("top_p", top_p),
+        )
+        campos_bool = (
+            ("auto_responder", auto_responder),
+            ("salvar_historico", salvar_historico),
+            ("ativa", ativa),
+        )
+        update_data = {campo: valor for campo, valor in campos_texto if valor}
+        update_data.update({campo: valor == "true" for campo, valor in campos_bool if valor is not None})
         
         sessao_atualizar = SessaoAtualizar(**update_data)
         SessaoService.atualizar(db, sessao_id, sessao_atualizar)
         
-        return RedirectResponse(url=f"/sessoes/{sessao_id}/detalhes", status_code=303)
+        return _redirecionar(f"/sessoes/{sessao_id}/detalhes")
     except Exception as e:
         return RedirectResponse(url=f"/sessoes/{sessao_id}/editar?erro={str(e)}", status_code=303)
@@ -129,6 +129,12 @@ class SessaoService:
 
         db.delete(db_sessao)
         db.commit()
+
+        # O id pode ser reaproveitado por uma sessão nova (SQLite)
+        from sessao.sessao_comando_service import SessaoComandoService
+        from sessao.sessao_tipo_mensagem_service import SessaoTipoMensagemService
+        SessaoComandoService.invalidar_cache(sessao_id)
+        SessaoTipoMensagemService.invalidar_cache(sessao_id)
         return True
 
     @staticmethod
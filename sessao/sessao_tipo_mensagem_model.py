@@ -2,7 +2,7 @@
 Modelo de configuração de tipos de mensagem por sessão.
 Define como cada sessão trata diferentes tipos de mensagem recebida.
 """
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -34,7 +34,7 @@ class SessaoTipoMensagem(Base):
     __tablename__ = "sessao_tipo_mensagem"
 
     id = Column(Integer, primary_key=True, index=True)
-    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False, index=True)
+    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False)
     
     # Tipo de mensagem (audio, imagem, video, sticker, localizacao, documento)
     tipo = Column(String(20), nullable=False)
@@ -48,6 +48,12 @@ class SessaoTipoMensagem(Base):
     # Relacionamento com sessão
     sessao = relationship("Sessao", back_populates="tipos_mensagem")
 
+    __table_args__ = (
+        # Uma configuração por tipo em cada sessão (alvo do upsert em atualizar_todos);
+        # também atende as buscas só por sessao_id (coluna inicial)
+        Index("uq_sessao_tipo_mensagem", "sessao_id", "tipo", unique=True),
+    )
+
     def __repr__(self):
         return f"<SessaoTipoMensagem(sessao_id={self.sessao_id}, tipo='{self.tipo}', acao='{self.acao}')>"
 
@@ -107,3 +113,13 @@ CONFIGURACOES_PADRAO = {
         ]
     }
 }
+
+# Os mesmos padrões já como strings, indexados pelo valor do tipo (consulta direta no despacho)
+ACOES_PADRAO_STR = {
+    tipo.value: {"acao": config["acao"].value, "resposta_fixa": None}
+    for tipo, config in CONFIGURACOES_PADRAO.items()
+}
+OPCOES_DISPONIVEIS_STR = {
+    tipo.value: tuple(opcao.value for opcao in config["opcoes_disponiveis"])
+    for tipo, config in CONFIGURACOES_PADRAO.items()
+}
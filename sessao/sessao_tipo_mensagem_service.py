@@ -1,19 +1,68 @@
 """
 Serviço para gerenciar configurações de tipos de mensagem por sessão.
 """
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import Session
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+import time
+from database import insert_com_conflito
 from sessao.sessao_tipo_mensagem_model import (
     SessaoTipoMensagem,
     TipoMensagemEnum,
     AcaoTipoMensagem,
-    CONFIGURACOES_PADRAO
+    CONFIGURACOES_PADRAO,
+    ACOES_PADRAO_STR,
+    OPCOES_DISPONIVEIS_STR
 )
 
+_ACAO_IGNORAR = {"acao": AcaoTipoMensagem.IGNORAR.value, "resposta_fixa": None}
+_OPCOES_IGNORAR = (AcaoTipoMensagem.IGNORAR.value,)
+
 
 class SessaoTipoMensagemService:
     """Serviço para gerenciar tipos de mensagem por sessão."""
     
+    # Cache em memória: sessao_id -> (expira_em, {tipo: (acao, resposta_fixa)})
+    # Toda escrita nas configurações passa por este serviço e invalida o cache,
+    # então o TTL só cobre alterações feitas por fora (ex.: direto no banco)
+    _cache_acoes: Dict[int, Tuple[float, Dict[str, Tuple[str, Optional[str]]]]] = {}
+    CACHE_TTL_SEGUNDOS = 3600
+    
+    # Fica False se o índice único uq_sessao_tipo_mensagem não existir no banco
+    # (ex.: não pôde ser criado por haver linhas duplicadas antigas); aí o ON CONFLICT
+    # não tem alvo e atualizar_todos usa a atualização linha a linha
+    _upsert_disponivel = True
+    
+    @staticmethod
+    def invalidar_cache(sessao_id: Optional[int] = None):
+        """Invalida o cache de ações de uma sessão (ou de todas)."""
+        if sessao_id is None:
+            SessaoTipoMensagemService._cache_acoes.clear()
+        else:
+            SessaoTipoMensagemService._cache_acoes.pop(sessao_id, None)
+    
+    @staticmethod
+    def _obter_acoes_cache(db: Session, sessao_id: int) -> Dict[str, Tuple[str, Optional[str]]]:
+        """Ações de todos os tipos da sessão a partir do cache (uma consulta quando expirado)."""
+        item = SessaoTipoMensagemService._cache_acoes.get(sessao_id)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        
+        acoes = {}
+        for tipo, acao, resposta_fixa in db.execute(
+            select(SessaoTipoMensagem.tipo, SessaoTipoMensagem.acao, SessaoTipoMensagem.resposta_fixa)
+            .where(SessaoTipoMensagem.sessao_id == sessao_id)
+        ):
+            # setdefault: com linhas repetidas vale a primeira, como em obter_por_tipo
+            acoes.setdefault(tipo, (acao, resposta_fixa))
+        
+        SessaoTipoMensagemService._cache_acoes[sessao_id] = (
+            time.monotonic() + SessaoTipoMensagemService.CACHE_TTL_SEGUNDOS,
+            acoes
+        )
+        return acoes
+    
     @staticmethod
     def criar_configuracoes_padrao(db: Session, sessao_id: int) -> List[SessaoTipoMensagem]:
         """
@@ -35,21 +84,23 @@ class SessaoTipoMensagemService:
             configs_criadas.append(config)
         
         db.commit()
+        SessaoTipoMensagemService.invalidar_cache(sessao_id)
         return configs_criadas
     
     @staticmethod
     def listar_por_sessao(db: Session, sessao_id: int) -> List[SessaoTipoMensagem]:
         """Lista todas as configurações de tipos de mensagem de uma sessão."""
-        return db.query(SessaoTipoMensagem).filter(
-            SessaoTipoMensagem.sessao_id == sessao_id
+        return db.scalars(
+            select(SessaoTipoMensagem).where(SessaoTipoMensagem.sessao_id == sessao_id)
         ).all()
     
     @staticmethod
     def obter_por_tipo(db: Session, sessao_id: int, tipo: str) -> Optional[SessaoTipoMensagem]:
         """Obtém a configuração de um tipo específico de mensagem."""
-        return db.query(SessaoTipoMensagem).filter(
-            SessaoTipoMensagem.sessao_id == sessao_id,
-            SessaoTipoMensagem.tipo == tipo
+        return db.scalars(
+            select(SessaoTipoMensagem)
+            .where(SessaoTipoMensagem.sessao_id == sessao_id, SessaoTipoMensagem.tipo == tipo)
+            .limit(1)
         ).first()
     
     @staticmethod
@@ -58,9 +109,14 @@ class SessaoTipoMensagemService:
         sessao_id: int,
         tipo: str,
         acao: str,
-        resposta_fixa: Optional[str] = None
+        resposta_fixa: Optional[str] = None,
+        autocommit: bool = True
     ) -> Optional[SessaoTipoMensagem]:
-        """Atualiza a configuração de um tipo de mensagem."""
+        """
+        Atualiza a configuração de um tipo de mensagem.
+        Com autocommit=False só faz flush, para agrupar várias alterações numa transação:
+        quem chama faz o commit e depois chama invalidar_cache(sessao_id).
+        """
         config = SessaoTipoMensagemService.obter_por_tipo(db, sessao_id, tipo)
         
         if not config:
@@ -76,8 +132,12 @@ class SessaoTipoMensagemService:
             config.acao = acao
             config.resposta_fixa = resposta_fixa
         
-        db.commit()
-        db.refresh(config)
+        if autocommit:
+            db.commit()
+            SessaoTipoMensagemService.invalidar_cache(sessao_id)
+            db.refresh(config)
+        else:
+            db.flush()
         return config
     
     @staticmethod
@@ -92,19 +152,52 @@ class SessaoTipoMensagemService:
         Args:
             configuracoes: Dict no formato {tipo: {acao: str, resposta_fixa: str}}
         """
-        configs_atualizadas = []
+        if not configuracoes:
+            return SessaoTipoMensagemService.listar_por_sessao(db, sessao_id)
+        
+        linhas = [
+            {
+                "sessao_id": sessao_id,
+                "tipo": tipo,
+                "acao": dados.get("acao", "ignorar"),
+                "resposta_fixa": dados.get("resposta_fixa")
+            }
+            for tipo, dados in configuracoes.items()
+        ]
         
-        for tipo, dados in configuracoes.items():
-            config = SessaoTipoMensagemService.atualizar(
-                db,
-                sessao_id,
-                tipo,
-                dados.get("acao", "ignorar"),
-                dados.get("resposta_fixa")
+        insert = insert_com_conflito(db) if SessaoTipoMensagemService._upsert_disponivel else None
+        if insert is not None:
+            # Um único INSERT ... ON CONFLICT (sessao_id, tipo) DO UPDATE para todos os tipos
+            stmt = insert(SessaoTipoMensagem).values(linhas)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["sessao_id", "tipo"],
+                set_={"acao": stmt.excluded.acao, "resposta_fixa": stmt.excluded.resposta_fixa}
             )
-            configs_atualizadas.append(config)
+            try:
+                # Savepoint: no PostgreSQL o erro abortaria a transação inteira
+                with db.begin_nested():
+                    db.execute(stmt)
+            except (OperationalError, ProgrammingError) as e:
+                print(f"⚠️  Upsert de tipos de mensagem indisponível (índice uq_sessao_tipo_mensagem ausente?): {e}")
+                SessaoTipoMensagemService._upsert_disponivel = False
+                insert = None
+        if insert is None:
+            # Sem ON CONFLICT (outros bancos ou índice ausente): atualiza/cria linha a linha, com um único commit
+            # (linhas duplicadas antigas do mesmo tipo são todas atualizadas)
+            existentes: Dict[str, List[SessaoTipoMensagem]] = {}
+            for config in SessaoTipoMensagemService.listar_por_sessao(db, sessao_id):
+                existentes.setdefault(config.tipo, []).append(config)
+            for linha in linhas:
+                configs = existentes.get(linha["tipo"])
+                if not configs:
+                    db.add(SessaoTipoMensagem(**linha))
+                for config in configs or ():
+                    config.acao = linha["acao"]
+                    config.resposta_fixa = linha["resposta_fixa"]
         
-        return configs_atualizadas
+        db.commit()
+        SessaoTipoMensagemService.invalidar_cache(sessao_id)
+        return SessaoTipoMensagemService.listar_por_sessao(db, sessao_id)
     
     @staticmethod
     def obter_acao(db: Session, sessao_id: int, tipo: str) -> Dict:
@@ -112,40 +205,23 @@ class SessaoTipoMensagemService:
         Obtém a ação configurada para um tipo de mensagem.
         Retorna um dict com a ação e resposta fixa (se houver).
         
-        Usado pelo processamento de mensagens.
+        Usado pelo processamento de mensagens (a cada mensagem recebida), por isso usa o cache.
         """
-        config = SessaoTipoMensagemService.obter_por_tipo(db, sessao_id, tipo)
+        acao = SessaoTipoMensagemService._obter_acoes_cache(db, sessao_id).get(tipo)
         
-        if not config:
-            # Usar padrão se não houver configuração
-            try:
-                tipo_enum = TipoMensagemEnum(tipo)
-                padrao = CONFIGURACOES_PADRAO.get(tipo_enum, {})
-                return {
-                    "acao": padrao.get("acao", AcaoTipoMensagem.IGNORAR).value,
-                    "resposta_fixa": None
-                }
-            except ValueError:
-                return {
-                    "acao": AcaoTipoMensagem.IGNORAR.value,
-                    "resposta_fixa": None
-                }
+        if acao is None:
+            # Usar padrão se não houver configuração (tipos desconhecidos são ignorados)
+            return dict(ACOES_PADRAO_STR.get(tipo, _ACAO_IGNORAR))
         
         return {
-            "acao": config.acao,
-            "resposta_fixa": config.resposta_fixa
+            "acao": acao[0],
+            "resposta_fixa": acao[1]
         }
     
     @staticmethod
     def obter_opcoes_disponiveis(tipo: str) -> List[str]:
         """Retorna as opções de ação disponíveis para um tipo de mensagem."""
-        try:
-            tipo_enum = TipoMensagemEnum(tipo)
-            config = CONFIGURACOES_PADRAO.get(tipo_enum, {})
-            opcoes = config.get("opcoes_disponiveis", [AcaoTipoMensagem.IGNORAR])
-            return [o.value for o in opcoes]
-        except ValueError:
-            return [AcaoTipoMensagem.IGNORAR.value]
+        return list(OPCOES_DISPONIVEIS_STR.get(tipo, _OPCOES_IGNORAR))
     
     @staticmethod
     def deletar_por_sessao(db: Session, sessao_id: int) -> int:
@@ -154,4 +230,5 @@ class SessaoTipoMensagemService:
             SessaoTipoMensagem.sessao_id == sessao_id
         ).delete()
         db.commit()
+        SessaoTipoMensagemService.invalidar_cache(sessao_id)
         return count
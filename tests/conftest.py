@@ -0,0 +1,9 @@
+"""
+Configuração comum dos testes: banco SQLite em memória e a raiz do projeto no sys.path
+(os módulos são importados como na aplicação, ex.: `from database import ...`).
+"""
+import os
+import sys
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,96 @@
+"""
+Quantidade de queries dos caminhos quentes de provedores LLM (trava regressões de N+1).
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from database import Base, SessionLocal, engine, contar_queries
+from llm_providers.llm_providers_model import ProvedorLLM, EstatisticasProvedor, ModeloProvedor
+from llm_providers.llm_providers_schema import RequisicaoLLM
+from llm_providers.llm_providers_service import ProvedorLLMService
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    sessao = SessionLocal()
+    try:
+        yield sessao
+    finally:
+        sessao.close()
+        Base.metadata.drop_all(bind=engine)
+        ProvedorLLMService._cache_snapshot.clear()
+
+
+def _criar_provedor(db, nome: str) -> ProvedorLLM:
+    provedor = ProvedorLLM(
+        nome=nome,
+        base_url="http://provedor.local",
+        ativo=True,
+        # Tipo de API já detectado: a requisição vai direto ao endpoint OpenAI
+        configuracao={"tipo_api": "openai", "tipo_api_verificado_em": time.time()}
+    )
+    db.add(provedor)
+    db.flush()
+    db.add(EstatisticasProvedor(provedor_id=provedor.id))
+    db.add(ModeloProvedor(provedor_id=provedor.id, modelo_id=f"{nome}-modelo", nome=f"{nome}-modelo", contexto=8192))
+    db.commit()
+    return provedor
+
+
+def test_listar_todos_usa_uma_query(db):
+    for nome in ("a", "b", "c"):
+        _criar_provedor(db, nome)
+    db.expunge_all()
+
+    with contar_queries() as queries:
+        provedores = ProvedorLLMService.listar_todos(db)
+        [(p.nome, p.base_url, p.ativo, p.status) for p in provedores]
+
+    assert len(provedores) == 3
+    assert len(queries) <= 1
+
+
+def test_enviar_requisicao_so_consulta_o_banco_sem_cache(db, monkeypatch):
+    provedor_id = _criar_provedor(db, "local").id
+
+    def responder(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "oi"}, "finish_reason": "stop"}],
+            "usage": {"total_tokens": 5}
+        })
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(responder))
+
+    async def get_client():
+        return client
+
+    monkeypatch.setattr(ProvedorLLMService, "_get_client", get_client)
+    # As estatísticas são gravadas por outra thread, com sessão própria
+    monkeypatch.setattr(ProvedorLLMService, "_atualizar_estatisticas", lambda *args: None)
+
+    requisicao = RequisicaoLLM(
+        mensagens=[{"role": "user", "content": "olá"}],
+        modelo="local-modelo",
+        stream=False
+    )
+
+    async def enviar_duas_vezes():
+        try:
+            with contar_queries() as primeira:
+                resposta = await ProvedorLLMService.enviar_requisicao(db, provedor_id, requisicao)
+            with contar_queries() as segunda:
+                await ProvedorLLMService.enviar_requisicao(db, provedor_id, requisicao)
+        finally:
+            await client.aclose()
+        return resposta, primeira, segunda
+
+    resposta, primeira, segunda = asyncio.run(enviar_duas_vezes())
+
+    assert resposta.conteudo == "oi"
+    # Provedor + janelas de contexto dos modelos; depois, tudo vem do cache
+    assert len(primeira) <= 2
+    assert len(segunda) == 0